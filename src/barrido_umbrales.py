@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Barrido de umbrales de clasificación (perímetro abdominal y presión arterial) en una sola pasada
+Cada medida se compara a la vez contra todos los umbrales candidatos (matriz registros x umbrales por
+difusión de numpy) y la matriz se reduce por visita y por paciente. Las combinaciones de las dos categorías
+(F/M o sistólica/diastólica) se cuentan por inclusión-exclusión:
+    anormales(i, j) = anormales_a(i) + anormales_b(j) - ambas(i, j),  ambas = A_a^T @ A_b
+sin volver a clasificar ni reprocesar la entrada por cada escenario.
+El perímetro tiene dos cortes por candidato (NORMAL si valor <= normal, ANORMAL si > anormal): los registros
+entre ambos, los nulos y los de otros géneros quedan NO_CLASIFICADO, igual que en classify_perimeter_abdominal,
+y los grupos clasificados (con algún registro NORMAL o ANORMAL) se cuentan con la misma inclusión-exclusión.
+"""
+
+import numpy as np
+import pandas as pd
+
+from corridas import ids_hash
+
+NIVELES = (('registros', None), ('visitas', 'visita'), ('pacientes', 'paciente'))
+
+# Umbrales por defecto de presión arterial (sistólica >= 140, diastólica >= 90; ver tablas_clasificacion)
+UMBRALES_PRESION_VIGENTES = {'S': 140, 'D': 90}
+
+
+def matriz_anormal(valores, umbrales, inclusivo):
+    """
+    Matriz booleana registros x umbrales: ANORMAL si el valor supera el umbral (>= si inclusivo)
+    Los valores nulos nunca son anormales
+    """
+    valores = np.asarray(valores, dtype=np.float64)[:, None]
+    umbrales = np.asarray(umbrales, dtype=np.float64)[None, :]
+    return valores >= umbrales if inclusivo else valores > umbrales
+
+
+def reducir_por_grupo(matriz, ids, n_grupos):
+    """
+    Matriz grupos x umbrales: True si algún registro del grupo es anormal para ese umbral
+    """
+    resultado = np.zeros((n_grupos, matriz.shape[1]), dtype=bool)
+    if len(ids) == 0:
+        return resultado
+    orden = np.argsort(ids, kind='stable')
+    ids_ordenados = ids[orden]
+    inicios = np.flatnonzero(np.r_[True, ids_ordenados[1:] != ids_ordenados[:-1]])
+    resultado[ids_ordenados[inicios]] = np.logical_or.reduceat(matriz[orden], inicios, axis=0)
+    return resultado
+
+
+def _contar_union(grupos_a, grupos_b):
+    """
+    Matriz umbrales_a x umbrales_b con el número de grupos que cumplen en a o en b (inclusión-exclusión)
+    """
+    ambas = grupos_a.T.astype(np.int64) @ grupos_b.astype(np.int64)
+    return grupos_a.sum(axis=0)[:, None] + grupos_b.sum(axis=0)[None, :] - ambas
+
+
+def barrer_umbrales(df, columna_valor, columna_categoria, umbrales, inclusivo, vigentes=None, nulos_clasificados=False,
+                    normales=None, vigentes_normales=None):
+    """
+    Cuenta registros, visitas y pacientes NORMAL/ANORMAL para cada combinación de umbrales
+    umbrales: {categoría: [umbrales candidatos]} con exactamente dos categorías (ej. {'F': [...], 'M': [...]})
+    vigentes: {categoría: umbral configurado} para marcar la combinación vigente
+    nulos_clasificados: los valores nulos cuentan como NORMAL (presión) en vez de quedar sin clasificar (perímetro)
+    normales: {categoría: [corte NORMAL de cada candidato]} (perímetro): NORMAL si valor <= corte, y los valores
+        entre el corte NORMAL y el ANORMAL, los nulos y las otras categorías quedan NO_CLASIFICADO como en
+        classify_perimeter_abdominal; la tabla agrega los cortes normal_<categoría> y las columnas *_no_clasificados
+    vigentes_normales: {categoría: corte NORMAL configurado} (con normales)
+    Un grupo es ANORMAL si alguno de sus registros lo es, NORMAL si no y alguno es NORMAL, y NO_CLASIFICADO si no
+    """
+    categoria_a, categoria_b = umbrales
+    umbrales_a = [float(u) for u in umbrales[categoria_a]]
+    umbrales_b = [float(u) for u in umbrales[categoria_b]]
+    valores = pd.to_numeric(df[columna_valor], errors='coerce').to_numpy(dtype=np.float64)
+    categorias = df[columna_categoria].to_numpy()
+
+    filas_a = categorias == categoria_a
+    filas_b = categorias == categoria_b
+    if not nulos_clasificados:
+        filas_a &= ~np.isnan(valores)
+        filas_b &= ~np.isnan(valores)
+    matriz_a = matriz_anormal(valores[filas_a], umbrales_a, inclusivo)
+    matriz_b = matriz_anormal(valores[filas_b], umbrales_b, inclusivo)
+    if normales is None:
+        # Sin corte NORMAL todo registro de la categoría que no es ANORMAL es NORMAL
+        clasificada_a = np.ones_like(matriz_a)
+        clasificada_b = np.ones_like(matriz_b)
+    else:
+        clasificada_a = matriz_a | ~matriz_anormal(valores[filas_a], [float(u) for u in normales[categoria_a]], False)
+        clasificada_b = matriz_b | ~matriz_anormal(valores[filas_b], [float(u) for u in normales[categoria_b]], False)
+
+    conteos = {}
+    for nivel, ambito in NIVELES:
+        if ambito is None:
+            ids, n_grupos = np.arange(len(df)), len(df)
+            con_clave = np.ones(len(df), dtype=bool)
+        else:
+            ids, n_grupos = ids_hash(df, ambito)
+            ids = np.asarray(ids)
+            # Registros sin paciente (o sin fecha por visita) no pertenecen a ningún grupo, como en groupby
+            columnas_clave = ['Numero_Documento_Paciente'] if ambito == 'paciente' else ['Numero_Documento_Paciente', 'Fecha_Atencion']
+            con_clave = df[columnas_clave].notna().all(axis=1).to_numpy()
+        grupos_a = reducir_por_grupo(matriz_a[con_clave[filas_a]], ids[filas_a & con_clave], n_grupos)
+        grupos_b = reducir_por_grupo(matriz_b[con_clave[filas_b]], ids[filas_b & con_clave], n_grupos)
+        anormales = _contar_union(grupos_a, grupos_b)
+        clasificados = _contar_union(reducir_por_grupo(clasificada_a[con_clave[filas_a]], ids[filas_a & con_clave], n_grupos),
+                                     reducir_por_grupo(clasificada_b[con_clave[filas_b]], ids[filas_b & con_clave], n_grupos))
+        # Total: todos los grupos (con normales, los que no tienen registros de las categorías son NO_CLASIFICADO)
+        con_grupo = con_clave if normales is not None else (filas_a | filas_b) & con_clave
+        presentes = np.zeros(n_grupos, dtype=bool)
+        presentes[ids[con_grupo]] = True
+        conteos[nivel] = (int(presentes.sum()), clasificados, anormales)
+
+    vigentes = vigentes or {}
+    vigentes_normales = vigentes_normales or {}
+    filas = []
+    for i, umbral_a in enumerate(umbrales_a):
+        for j, umbral_b in enumerate(umbrales_b):
+            fila = {}
+            if normales is not None:
+                fila[f"normal_{categoria_a}"] = float(normales[categoria_a][i])
+                fila[f"normal_{categoria_b}"] = float(normales[categoria_b][j])
+            fila[f"umbral_{categoria_a}"] = umbral_a
+            fila[f"umbral_{categoria_b}"] = umbral_b
+            fila['vigente'] = (umbral_a == vigentes.get(categoria_a) and umbral_b == vigentes.get(categoria_b)
+                               and (normales is None or (fila[f"normal_{categoria_a}"] == vigentes_normales.get(categoria_a)
+                                                         and fila[f"normal_{categoria_b}"] == vigentes_normales.get(categoria_b))))
+            for nivel, _ in NIVELES:
+                total, clasificados, anormales = conteos[nivel]
+                fila[f"{nivel}_normales"] = int(clasificados[i, j] - anormales[i, j])
+                fila[f"{nivel}_anormales"] = int(anormales[i, j])
+                if normales is not None:
+                    fila[f"{nivel}_no_clasificados"] = total - int(clasificados[i, j])
+            fila['pct_pacientes_anormales'] = round(100 * fila['pacientes_anormales'] / conteos['pacientes'][0], 2) if conteos['pacientes'][0] else 0.0
+            filas.append(fila)
+    return pd.DataFrame(filas)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de los motores de lectura sobre datos sintéticos
+Genera el mismo conjunto de registros en cada formato (xlsx, csv, csv.gz, y csv.zst y parquet si
+zstandard y pyarrow están instalados) y mide el tiempo de lectura de cada motor disponible.
+
+Uso: python src/benchmark_lectores.py [--filas N] [--repeticiones N]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from datos_sinteticos import generar_registros
+from lectores import MOTORES, modulo_disponible, motores_disponibles, leer_entrada
+
+
+def escribir_formatos(df, directorio):
+    """
+    Escribe los registros en cada formato soportado; devuelve [(nombre, ruta, formato)]
+    """
+    archivos = []
+    ruta = os.path.join(directorio, "sinteticos.xlsx")
+    df.to_excel(ruta, index=False)
+    archivos.append(("xlsx", ruta, 'excel'))
+
+    ruta = os.path.join(directorio, "sinteticos.csv")
+    df.to_csv(ruta, index=False)
+    archivos.append(("csv", ruta, 'csv'))
+
+    ruta = os.path.join(directorio, "sinteticos.csv.gz")
+    df.to_csv(ruta, index=False, compression='gzip')
+    archivos.append(("csv.gz", ruta, 'csv'))
+
+    if modulo_disponible('zstandard'):
+        ruta = os.path.join(directorio, "sinteticos.csv.zst")
+        df.to_csv(ruta, index=False, compression='zstd')
+        archivos.append(("csv.zst", ruta, 'csv'))
+
+    if modulo_disponible('pyarrow'):
+        ruta = os.path.join(directorio, "sinteticos.parquet")
+        df.to_parquet(ruta, index=False)
+        archivos.append(("parquet", ruta, 'parquet'))
+    return archivos
+
+
+def medir(ruta, formato, motor, repeticiones):
+    """
+    Mejor tiempo de lectura (segundos) de varias repeticiones y número de filas leídas
+    """
+    mejor = None
+    filas = 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        if formato == 'excel':
+            df, _ = leer_entrada(ruta, motor_excel=motor)
+        else:
+            df, _ = leer_entrada(ruta, motor_csv=motor)
+        duracion = time.perf_counter() - inicio
+        filas = len(df)
+        mejor = duracion if mejor is None else min(mejor, duracion)
+    return mejor, filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark de los motores de lectura con datos sintéticos")
+    parser.add_argument('--filas', type=int, default=100000, help="Registros sintéticos a generar (por defecto 100000)")
+    parser.add_argument('--repeticiones', type=int, default=3, help="Lecturas por motor; se informa la mejor (por defecto 3)")
+    args = parser.parse_args()
+    if args.filas <= 0 or args.repeticiones <= 0:
+        parser.error("--filas y --repeticiones deben ser números positivos")
+    filas, repeticiones = args.filas, args.repeticiones
+
+    print(f"🧪 Benchmark de lectores: {filas:,} registros sintéticos, {repeticiones} repeticiones")
+    for formato in MOTORES:
+        no_instalados = [nombre for nombre, _ in MOTORES[formato] if nombre not in motores_disponibles(formato)]
+        print(f"📋 Motores {formato}: disponibles {motores_disponibles(formato)}"
+              + (f", no instalados {no_instalados}" if no_instalados else ""))
+
+    directorio = tempfile.mkdtemp(prefix="benchmark_lectores_")
+    try:
+        archivos = escribir_formatos(generar_registros(filas), directorio)
+        resultados = []
+        for nombre, ruta, formato in archivos:
+            for motor in motores_disponibles(formato):
+                segundos, leidas = medir(ruta, formato, motor, repeticiones)
+                resultados.append({
+                    'formato': nombre,
+                    'motor': motor,
+                    'MB': round(os.path.getsize(ruta) / 1024 / 1024, 2),
+                    'segundos': round(segundos, 3),
+                    'filas/s': int(leidas / segundos) if segundos else 0
+                })
+                print(f"  {nombre:8} {motor:9} {segundos:8.3f} s")
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    tabla = pd.DataFrame(resultados).sort_values('segundos')
+    print(f"\n📊 Resultados (mejor de {repeticiones}):")
+    print(tabla.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Caché de resultados del procesador de datos médicos
+La clave de cada resultado es el hash del contenido del archivo de entrada más un hash canónico
+de la configuración efectiva (después de que load_config completa los valores por defecto).
+Si un perfil se vuelve a ejecutar sin cambios, se reutiliza el CSV ya generado en lugar de reprocesar.
+La caché también guarda el DataFrame limpio (después de las reglas de calidad) con una clave que solo depende
+de la entrada y de los ajustes de limpieza: los perfiles que comparten columnas, validaciones y filtro previo
+empiezan directamente desde él aunque sus filtros sean distintos. Se guarda como marco columnar mapeado en
+memoria (marco_compartido.py): los trabajos que se ejecutan a la vez (cola de trabajos) comparten una sola copia
+de las columnas en lugar de deserializar cada uno la suya.
+Los índices (indice.json, huellas.json) se leen, modifican y reescriben bajo un bloqueo exclusivo (fcntl.flock)
+sobre un archivo del directorio de caché, para que los trabajos concurrentes no pisen las entradas de los demás.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import struct
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin flock, los índices se actualizan sin bloqueo
+    fcntl = None
+
+from marco_compartido import adjuntar_marco, guardar_marco
+
+# Claves de configuración que no cambian el contenido del resultado
+CLAVES_IGNORADAS_CONFIGURACION = ('archivo_salida', 'generar_nombre_unico')
+SECCIONES_IGNORADAS = ('cache_resultados', 'fuera_de_memoria', 'historial', 'puntos_control', 'cola_trabajos')
+
+ARCHIVO_INDICE = "indice.json"
+ARCHIVO_HUELLAS = "huellas.json"
+ARCHIVO_BLOQUEO = "indice.lock"
+
+TAMANO_BLOQUE_HASH = 1024 * 1024
+
+
+def _leer_json(ruta, por_defecto):
+    """
+    Lee un archivo JSON del directorio de caché; si no existe o está corrupto devuelve el valor por defecto
+    """
+    try:
+        with open(ruta, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return por_defecto
+
+
+def _escribir_json(ruta, datos):
+    """
+    Escribe un archivo JSON de forma atómica (archivo temporal + os.replace)
+    """
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as file:
+        json.dump(datos, file, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temporal, ruta)
+
+
+@contextlib.contextmanager
+def _bloqueo_indice(directorio):
+    """
+    Bloqueo exclusivo entre procesos para leer, modificar y reescribir los índices del directorio de caché
+    """
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, ARCHIVO_BLOQUEO), 'a') as cerrojo:
+        if fcntl is not None:
+            fcntl.flock(cerrojo.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(cerrojo.fileno(), fcntl.LOCK_UN)
+
+
+def hash_archivo(ruta, directorio_cache=None):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo
+    Si se indica directorio_cache, memoriza el hash por (ruta, tamaño, fecha de modificación)
+    para no volver a leer archivos grandes que no han cambiado
+    """
+    estado = os.stat(ruta)
+    ruta_absoluta = os.path.abspath(ruta)
+    firma = [estado.st_size, estado.st_mtime_ns]
+
+    ruta_huellas = None
+    if directorio_cache:
+        os.makedirs(directorio_cache, exist_ok=True)
+        ruta_huellas = os.path.join(directorio_cache, ARCHIVO_HUELLAS)
+        memorizada = _leer_json(ruta_huellas, {}).get(ruta_absoluta)
+        if memorizada and memorizada.get('firma') == firma:
+            return memorizada['hash']
+
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as file:
+        for bloque in iter(lambda: file.read(TAMANO_BLOQUE_HASH), b''):
+            digest.update(bloque)
+    resultado = digest.hexdigest()
+
+    if ruta_huellas:
+        # El archivo se vuelve a leer bajo el bloqueo: otros procesos pudieron agregar huellas mientras se calculaba
+        with _bloqueo_indice(directorio_cache):
+            huellas = _leer_json(ruta_huellas, {})
+            huellas[ruta_absoluta] = {'firma': firma, 'hash': resultado}
+            _escribir_json(ruta_huellas, huellas)
+    return resultado
+
+
+def configuracion_canonica(config):
+    """
+    Devuelve la configuración normalizada como texto JSON canónico (claves ordenadas)
+    Se excluyen las claves que solo afectan al nombre del archivo de salida, a la propia caché
+    o a la forma de ejecución (el modo fuera de memoria produce el mismo resultado)
+    """
+    normalizada = {}
+    for clave, valor in config.items():
+        if clave in SECCIONES_IGNORADAS:
+            continue
+        if clave == 'configuracion' and isinstance(valor, dict):
+            valor = {k: v for k, v in valor.items() if k not in CLAVES_IGNORADAS_CONFIGURACION}
+        normalizada[clave] = valor
+    return json.dumps(normalizada, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+
+
+def hash_configuracion(config):
+    """
+    Hash SHA-256 de la configuración canónica
+    """
+    return hashlib.sha256(configuracion_canonica(config).encode('utf-8')).hexdigest()
+
+
+def clave_resultado(archivo_entrada, config, directorio_cache=None):
+    """
+    Clave de la caché: hash del contenido de la entrada + hash de la configuración efectiva
+    """
+    hash_entrada = hash_archivo(archivo_entrada, directorio_cache)
+    hash_config = hash_configuracion(config)
+    return hashlib.sha256(f"{hash_entrada}:{hash_config}".encode('utf-8')).hexdigest()
+
+
+def _enlazar_o_copiar(origen, destino):
+    """
+    Crea un enlace duro (sin duplicar bytes en disco); si no es posible, copia el archivo
+    """
+    directorio = os.path.dirname(destino)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    if os.path.exists(destino):
+        os.remove(destino)
+    try:
+        os.link(origen, destino)
+    except OSError:
+        shutil.copy2(origen, destino)
+
+
+def buscar_resultado(clave, cache_config):
+    """
+    Busca un resultado en la caché. Devuelve la entrada del índice o None
+    Una entrada cuyo archivo ya no existe o fue modificado (tamaño o fecha) se descarta
+    """
+    directorio = cache_config['directorio']
+    ruta_indice = os.path.join(directorio, ARCHIVO_INDICE)
+    if clave not in _leer_json(ruta_indice, {}):
+        return None
+
+    with _bloqueo_indice(directorio):
+        indice = _leer_json(ruta_indice, {})
+        entrada = indice.get(clave)
+        if not entrada:
+            return None
+
+        archivo = os.path.join(directorio, entrada['archivo'])
+        if not os.path.exists(archivo) or [os.path.getsize(archivo), os.stat(archivo).st_mtime_ns] != [entrada['bytes'], entrada.get('mtime_ns')]:
+            del indice[clave]
+            _escribir_json(ruta_indice, indice)
+            return None
+
+        entrada['usado'] = time.time()
+        entrada['aciertos'] = entrada.get('aciertos', 0) + 1
+        indice[clave] = entrada
+        _escribir_json(ruta_indice, indice)
+    return dict(entrada, ruta=archivo)
+
+
+def entregar_resultado(entrada, archivo_salida, cache_config):
+    """
+    Entrega un resultado en caché: si la salida original sigue intacta se reutiliza tal cual
+    (sin generar un archivo duplicado); si no, se enlaza el archivo de la caché a archivo_salida
+    Devuelve la ruta final del resultado
+    """
+    original = entrada.get('salida_original')
+    if original and os.path.exists(original) and os.path.samefile(original, entrada['ruta']):
+        return original
+
+    _enlazar_o_copiar(entrada['ruta'], archivo_salida)
+
+    directorio = cache_config['directorio']
+    ruta_indice = os.path.join(directorio, ARCHIVO_INDICE)
+    with _bloqueo_indice(directorio):
+        indice = _leer_json(ruta_indice, {})
+        for clave, valor in indice.items():
+            if valor['archivo'] == entrada['archivo']:
+                valor['salida_original'] = os.path.abspath(archivo_salida)
+        _escribir_json(ruta_indice, indice)
+    return archivo_salida
+
+
+def guardar_resultado(clave, archivo_salida, cache_config):
+    """
+    Registra el CSV generado en la caché (enlace duro si es posible) y aplica la política de expulsión
+    """
+    directorio = cache_config['directorio']
+    os.makedirs(directorio, exist_ok=True)
+    nombre = f"{clave}{os.path.splitext(archivo_salida)[1] or '.csv'}"
+    _enlazar_o_copiar(archivo_salida, os.path.join(directorio, nombre))
+    _registrar_entrada(directorio, clave, nombre, salida_original=os.path.abspath(archivo_salida))
+    return expulsar_entradas(cache_config)
+
+
+def _registrar_entrada(directorio, clave, nombre, **datos):
+    """
+    Agrega al índice un archivo ya guardado en el directorio de la caché
+    """
+    ruta_cache = os.path.join(directorio, nombre)
+    ruta_indice = os.path.join(directorio, ARCHIVO_INDICE)
+    with _bloqueo_indice(directorio):
+        indice = _leer_json(ruta_indice, {})
+        ahora = time.time()
+        indice[clave] = {
+            'archivo': nombre,
+            'bytes': os.path.getsize(ruta_cache),
+            'mtime_ns': os.stat(ruta_cache).st_mtime_ns,
+            'creado': ahora,
+            'usado': ahora,
+            'aciertos': 0,
+            **datos
+        }
+        _escribir_json(ruta_indice, indice)
+
+
+def clave_limpieza(archivo_entrada, ajustes, directorio_cache=None):
+    """
+    Clave del DataFrame limpio: hash del contenido de la entrada + hash de los ajustes que afectan
+    a la lectura y la limpieza (no de los filtros que se aplican después)
+    """
+    hash_entrada = hash_archivo(archivo_entrada, directorio_cache)
+    texto = json.dumps(ajustes, sort_keys=True, ensure_ascii=False, default=str, separators=(',', ':'))
+    hash_ajustes = hashlib.sha256(texto.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{hash_entrada}:limpieza:{hash_ajustes}".encode('utf-8')).hexdigest()
+
+
+def buscar_limpieza(clave, cache_config):
+    """
+    Estado limpio guardado para la clave, o None si no existe o no se puede leer
+    El DataFrame limpio se mapea del archivo: sus columnas numéricas y de fechas no se copian en este proceso
+    """
+    entrada = buscar_resultado(clave, cache_config)
+    if entrada is None:
+        return None
+    try:
+        df_clean, estado = adjuntar_marco(entrada['ruta'])
+    except (OSError, EOFError, struct.error, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        return None
+    return dict(estado, df_clean=df_clean)
+
+
+def guardar_limpieza(clave, estado, cache_config):
+    """
+    Guarda el estado limpio (marco columnar con el DataFrame y el resto del estado en sus metadatos, escritura
+    atómica) como entrada propia de la caché, sujeta a la misma política de expulsión que los resultados.
+    Devuelve (bytes, entradas expulsadas)
+    """
+    directorio = cache_config['directorio']
+    os.makedirs(directorio, exist_ok=True)
+    nombre = f"{clave}_limpieza.marco"
+    ruta = os.path.join(directorio, nombre)
+    guardar_marco(estado['df_clean'], ruta, {campo: valor for campo, valor in estado.items() if campo != 'df_clean'})
+    _registrar_entrada(directorio, clave, nombre, tipo='limpieza')
+    return os.path.getsize(ruta), expulsar_entradas(cache_config)
+
+
+def expulsar_entradas(cache_config):
+    """
+    Aplica la política de expulsión de la caché:
+    1. Elimina entradas con más de max_dias sin usarse
+    2. Elimina las entradas usadas hace más tiempo (LRU) hasta cumplir max_mb y max_entradas
+    Devuelve el número de entradas eliminadas
+    """
+    directorio = cache_config['directorio']
+    ruta_indice = os.path.join(directorio, ARCHIVO_INDICE)
+    with _bloqueo_indice(directorio):
+        indice = _leer_json(ruta_indice, {})
+        if not indice:
+            return 0
+
+        ahora = time.time()
+        max_dias = cache_config.get('max_dias')
+        max_bytes = cache_config['max_mb'] * 1024 * 1024 if cache_config.get('max_mb') else None
+        max_entradas = cache_config.get('max_entradas')
+
+        eliminar = set()
+        if max_dias:
+            eliminar.update(clave for clave, entrada in indice.items() if ahora - entrada['usado'] > max_dias * 86400)
+
+        vigentes = sorted((c for c in indice if c not in eliminar), key=lambda c: indice[c]['usado'], reverse=True)
+        total_bytes = 0
+        for posicion, clave in enumerate(vigentes):
+            total_bytes += indice[clave]['bytes']
+            if (max_bytes is not None and total_bytes > max_bytes) or (max_entradas and posicion >= max_entradas):
+                eliminar.add(clave)
+
+        for clave in eliminar:
+            archivo = os.path.join(directorio, indice[clave]['archivo'])
+            if os.path.exists(archivo):
+                os.remove(archivo)
+            del indice[clave]
+
+        if eliminar:
+            _escribir_json(ruta_indice, indice)
+        return len(eliminar)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Clasificación por tablas de umbrales (género x banda de edad x medida)
+Cada tabla de tablas_clasificacion declara los límites de las bandas de edad y, por género, un umbral por banda
+para cada medida. La tabla se aplana en un array por medida (fila = género, columna = banda) y cada registro
+obtiene su umbral en una sola pasada vectorizada, sin ramas por género ni por banda:
+    banda    = np.searchsorted(límites, edad, side='right')
+    posición = fila del género * número de bandas + banda
+    umbral   = umbrales.take(posición)         (la posición -1 toma el NaN final: sin umbral)
+El costo es el mismo con una banda o con veinte.
+    perimetro          normal (<= es NORMAL) y anormal (> es ANORMAL); entre ambos o sin umbral NO_CLASIFICADO
+    presion_arterial   sistolica y diastolica (>= es ANORMAL); sin umbral NORMAL
+"""
+
+import numpy as np
+import pandas as pd
+
+# Claves de género de las tablas; 'todos' se aplica a los géneros sin fila propia
+GENEROS = {'genero_femenino': 'F', 'genero_masculino': 'M'}
+COMODIN = 'todos'
+
+MEDIDAS = {
+    'perimetro': ('normal', 'anormal'),
+    'presion_arterial': ('sistolica', 'diastolica'),
+}
+
+
+class ErrorClasificacion(ValueError):
+    """Tabla de clasificación mal declarada"""
+
+
+def validar_tabla(nombre, seccion):
+    """
+    Normaliza una tabla de la configuración: bandas_edad como lista creciente y, por género, una lista de
+    umbrales por medida con un valor por banda (un número solo se repite en todas las bandas; null = sin umbral)
+    """
+    if nombre not in MEDIDAS:
+        raise ErrorClasificacion(f"tabla '{nombre}' no reconocida (opciones: {', '.join(MEDIDAS)})")
+    if not isinstance(seccion, dict):
+        raise ErrorClasificacion(f"{nombre}: la tabla debe ser un diccionario")
+    limites = seccion.get('bandas_edad') or []
+    if not isinstance(limites, list) or not all(isinstance(limite, (int, float)) for limite in limites):
+        raise ErrorClasificacion(f"{nombre}.bandas_edad debe ser una lista de edades")
+    if any(b <= a for a, b in zip(limites, limites[1:])):
+        raise ErrorClasificacion(f"{nombre}.bandas_edad debe ser estrictamente creciente: {limites}")
+    n_bandas = len(limites) + 1
+
+    tabla = {'bandas_edad': list(limites)}
+    for clave, umbrales in seccion.items():
+        if clave == 'bandas_edad':
+            continue
+        if clave not in GENEROS and clave != COMODIN:
+            raise ErrorClasificacion(f"{nombre}: clave '{clave}' no reconocida "
+                                     f"(use {', '.join(GENEROS)} o {COMODIN})")
+        if not isinstance(umbrales, dict):
+            raise ErrorClasificacion(f"{nombre}.{clave} debe indicar los umbrales de {', '.join(MEDIDAS[nombre])}")
+        tabla[clave] = {}
+        for medida in MEDIDAS[nombre]:
+            valores = umbrales.get(medida)
+            if not isinstance(valores, list):
+                valores = [valores] * n_bandas
+            if len(valores) != n_bandas:
+                raise ErrorClasificacion(f"{nombre}.{clave}.{medida} necesita {n_bandas} valores "
+                                         f"(uno por banda de edad), tiene {len(valores)}")
+            if not all(valor is None or isinstance(valor, (int, float)) for valor in valores):
+                raise ErrorClasificacion(f"{nombre}.{clave}.{medida} debe contener números o null: {valores}")
+            tabla[clave][medida] = valores
+    if len(tabla) == 1:
+        raise ErrorClasificacion(f"{nombre}: la tabla no tiene umbrales por género")
+    return tabla
+
+
+def construir_tabla(nombre, tabla):
+    """
+    Arrays de búsqueda de una tabla validada: límites de banda, fila por género y umbrales aplanados por medida
+    """
+    limites = np.asarray(tabla['bandas_edad'], dtype=np.float64)
+    claves = [clave for clave in tabla if clave != 'bandas_edad']
+    cortes = {}
+    for medida in MEDIDAS[nombre]:
+        valores = [np.nan if valor is None else valor for clave in claves for valor in tabla[clave][medida]]
+        # Posición final NaN: registros sin fila de género o sin edad cuando hay bandas
+        cortes[medida] = np.append(np.asarray(valores, dtype=np.float64), np.nan)
+    return {
+        'limites': limites,
+        'n_bandas': len(limites) + 1,
+        'filas': {GENEROS[clave]: fila for fila, clave in enumerate(claves) if clave in GENEROS},
+        'comodin': claves.index(COMODIN) if COMODIN in claves else -1,
+        'cortes': cortes,
+    }
+
+
+def posiciones(tabla, genero, edad):
+    """
+    Posición de cada registro en los umbrales aplanados (-1 = sin umbral)
+    El género se resuelve sobre sus valores distintos (pd.factorize) y la banda por búsqueda binaria
+    """
+    codigos, distintos = pd.factorize(pd.Series(genero))
+    # Los géneros nulos tienen código -1 y toman la última posición (la fila comodín)
+    filas = np.array([tabla['filas'].get(valor, tabla['comodin']) for valor in distintos] + [tabla['comodin']],
+                     dtype=np.int64)[codigos]
+    edad = pd.to_numeric(pd.Series(edad), errors='coerce').to_numpy(dtype=np.float64)
+    bandas = np.searchsorted(tabla['limites'], edad, side='right')
+    validas = filas >= 0
+    if len(tabla['limites']):
+        validas &= ~np.isnan(edad)
+    return np.where(validas, filas * tabla['n_bandas'] + bandas, -1)
+
+
+def umbrales(tabla, medida, posicion):
+    """
+    Umbral de la medida para cada registro (NaN sin umbral)
+    """
+    return tabla['cortes'][medida].take(posicion)
+
+
+def clasificar_perimetro(df, tabla):
+    """
+    NORMAL / ANORMAL / NO_CLASIFICADO de Perimetro_Abdominal según género y banda de edad de cada registro
+    """
+    posicion = posiciones(tabla, df['Genero'], df['Edad_Reg'])
+    valor = pd.to_numeric(df['Perimetro_Abdominal'], errors='coerce').to_numpy(dtype=np.float64)
+    clasificacion = np.full(len(df), 'NO_CLASIFICADO', dtype=object)
+    with np.errstate(invalid='ignore'):
+        clasificacion[valor <= umbrales(tabla, 'normal', posicion)] = 'NORMAL'
+        clasificacion[valor > umbrales(tabla, 'anormal', posicion)] = 'ANORMAL'
+    return clasificacion
+
+
+def umbrales_presion(df, tabla):
+    """
+    Umbrales (sistólica, diastólica) de cada registro según género y banda de edad
+    """
+    posicion = posiciones(tabla, df['Genero'], df['Edad_Reg'])
+    return umbrales(tabla, 'sistolica', posicion), umbrales(tabla, 'diastolica', posicion)
+
+
+def umbral_unico(tabla, clave, medida):
+    """
+    Umbral de una tabla de una sola banda para el género indicado (o el comodín); None si depende de la edad
+    """
+    if tabla['bandas_edad']:
+        return None
+    fila = tabla.get(clave) or tabla.get(COMODIN)
+    return fila[medida][0] if fila else None
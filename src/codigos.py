@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Índice de códigos de item y patrones jerárquicos CIE-10
+Las listas de códigos aceptan, además de códigos exactos, patrones con comodines:
+    E66*       prefijo: E66, E669, E6690, ... (cualquier subcódigo presente en los datos)
+    E78[0-5]   clase de caracteres: E780 a E785
+    E11?       un carácter cualquiera
+Los patrones se resuelven una sola vez contra los valores distintos de Codigo_Item (pd.factorize):
+cada lista se convierte en una tabla booleana por código distinto y la máscara por fila se obtiene
+indexando esa tabla con el id entero del código, sin comparar cadenas fila por fila.
+"""
+
+import fnmatch
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+_COMODIN_RE = re.compile(r'[*?\[]')
+
+
+def es_patron(codigo):
+    """
+    Indica si un código de la configuración es un patrón con comodines
+    """
+    return isinstance(codigo, str) and _COMODIN_RE.search(codigo) is not None
+
+
+@lru_cache(maxsize=None)
+def _regex_patron(patron):
+    return re.compile(fnmatch.translate(patron))
+
+
+def indice_codigos(serie):
+    """
+    Índice de la columna Codigo_Item: (id entero por fila, -1 si es nulo; valores distintos)
+    """
+    return pd.factorize(serie)
+
+
+def tabla_codigos(codigos, categorias):
+    """
+    Tabla booleana sobre los códigos distintos (más una posición False al final para los nulos)
+    True si el código coincide con algún código exacto o patrón de la lista
+    """
+    categorias = pd.Index(categorias)
+    exactos = [codigo for codigo in codigos if not es_patron(codigo)]
+    tabla = categorias.isin(exactos)
+    patrones = [codigo for codigo in codigos if es_patron(codigo)]
+    if patrones:
+        textos = [str(categoria) for categoria in categorias]
+        for patron in patrones:
+            regex = _regex_patron(patron)
+            tabla |= np.fromiter((regex.match(texto) is not None for texto in textos), dtype=bool, count=len(textos))
+    return np.append(tabla, False)
+
+
+def mascara_codigos(serie, codigos, indice=None):
+    """
+    Máscara por fila de los registros cuyo código está en la lista (códigos exactos o patrones)
+    Con indice (resultado de indice_codigos) se reutiliza la factorización de la columna
+    """
+    ids, categorias = indice if indice is not None else indice_codigos(serie)
+    return tabla_codigos(codigos, categorias)[ids]
+
+
+def resolver_lista(codigos, categorias):
+    """
+    Sustituye cada patrón de la lista por la lista de códigos presentes que coinciden con él
+    Los códigos exactos no cambian. Devuelve (lista resuelta, {patrón: códigos resueltos})
+    """
+    resuelta = []
+    resoluciones = {}
+    for codigo in codigos:
+        if es_patron(codigo):
+            coincidencias = [categoria for categoria, coincide in zip(categorias, tabla_codigos([codigo], categorias)) if coincide]
+            resoluciones[codigo] = sorted(coincidencias, key=str)
+            resuelta.append(resoluciones[codigo])
+        else:
+            resuelta.append(codigo)
+    return resuelta, resoluciones
+
+
+def codigos_planos(codigos):
+    """
+    Lista plana de códigos de una lista resuelta (los patrones aportan todos sus códigos)
+    """
+    planos = []
+    for codigo in codigos:
+        planos.extend(codigo if isinstance(codigo, list) else [codigo])
+    return planos
+
+
+def requisitos_codigos(codigos):
+    """
+    Requisitos para 'todos los códigos' de una lista resuelta: cada código exacto o patrón es un requisito
+    que se cumple con cualquiera de sus códigos (formato de corridas.grupos_con_codigos)
+    """
+    return [list(codigo) if isinstance(codigo, list) else [codigo] for codigo in codigos]
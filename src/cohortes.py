@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Cohortes externas de pacientes (listas de inclusión y exclusión)
+Los documentos de cada archivo de cohorte se cargan una sola vez como un array int64 ordenado y sin
+duplicados (8 bytes por paciente). La pertenencia se resuelve sobre los documentos distintos de los datos
+(pd.factorize) con búsqueda binaria (np.searchsorted): cada documento distinto cuesta O(log n) y el
+resultado se propaga a las filas por su id entero, sin conjuntos de Python ni merge.
+Formatos: .txt/.csv (opcionalmente .gz/.zip/.bz2/.xz) con un documento por línea o una columna con
+nombre, y .xlsx (primera hoja).
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+class ErrorCohorte(ValueError):
+    """Archivo de cohorte inexistente o sin documentos válidos"""
+
+
+def _leer_documentos(ruta, columna):
+    """
+    Columna de documentos del archivo: la columna indicada, o la primera si no se indica
+    (sin encabezado: un encabezado no numérico se descarta al convertir a número)
+    """
+    if ruta.lower().endswith(('.xlsx', '.xlsm')):
+        tabla = pd.read_excel(ruta, usecols=[columna] if columna else [0], header=0 if columna else None)
+    else:
+        tabla = pd.read_csv(ruta, usecols=[columna] if columna else [0], header=0 if columna else None)
+    return tabla.iloc[:, 0]
+
+
+@lru_cache(maxsize=8)
+def cargar_cohorte(ruta, columna=None, huella=None):
+    """
+    Documentos de un archivo de cohorte como array int64 ordenado y sin duplicados
+    La huella (hash del contenido) forma parte de la clave de memoria: un archivo modificado se vuelve a leer
+    """
+    if not os.path.exists(ruta):
+        raise ErrorCohorte(f"el archivo de cohorte {ruta} no existe")
+    try:
+        documentos = _leer_documentos(ruta, columna)
+    except (OSError, ValueError) as e:
+        raise ErrorCohorte(f"no se pudo leer el archivo de cohorte {ruta}: {e}")
+    documentos = pd.to_numeric(documentos, errors='coerce').to_numpy(dtype=np.float64)
+    documentos = documentos[~np.isnan(documentos) & (documentos == np.floor(documentos))]
+    if len(documentos) == 0:
+        raise ErrorCohorte(f"el archivo de cohorte {ruta} no tiene documentos numéricos")
+    ids = np.unique(documentos.astype(np.int64))
+    ids.setflags(write=False)
+    return ids
+
+
+def pertenece(valores, ids):
+    """
+    Máscara de pertenencia de un array int64 a un array ordenado (búsqueda binaria)
+    Los valores se buscan ordenados: las búsquedas consecutivas recorren zonas vecinas de ids y aprovechan la caché
+    """
+    if len(ids) == 0 or len(valores) == 0:
+        return np.zeros(len(valores), dtype=bool)
+    orden = np.argsort(valores)
+    ordenados = valores[orden]
+    posiciones = np.searchsorted(ids, ordenados)
+    posiciones[posiciones == len(ids)] = 0
+    resultado = np.empty(len(valores), dtype=bool)
+    resultado[orden] = ids[posiciones] == ordenados
+    return resultado
+
+
+def mascara_cohorte(documentos, incluir=None, excluir=None):
+    """
+    Máscara por fila: documento en la cohorte de inclusión (si hay) y fuera de la de exclusión (si hay)
+    Los documentos nulos o no numéricos nunca pertenecen a una cohorte
+    """
+    codigos, distintos = pd.factorize(documentos)
+    numericos = pd.to_numeric(pd.Series(distintos), errors='coerce').to_numpy(dtype=np.float64)
+    validos = ~np.isnan(numericos) & (numericos == np.floor(numericos))
+    claves = np.where(validos, numericos, 0).astype(np.int64)
+
+    conservar = np.ones(len(distintos), dtype=bool)
+    if incluir is not None:
+        conservar &= validos & pertenece(claves, incluir)
+    if excluir is not None:
+        conservar &= ~(validos & pertenece(claves, excluir))
+    # Los documentos nulos tienen id -1: se añade una posición al final (fuera de una cohorte de inclusión)
+    return np.append(conservar, incluir is None)[codigos]
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Cola local de trabajos con concurrencia acotada y control de memoria
+Cada trabajo es un archivo YAML en <directorio>/pendientes: una configuración completa (como config.yaml) o
+una referencia a una configuración con la entrada y la salida propias del trabajo:
+    config: equipos/cardiologia.yaml      # por defecto config.yaml
+    entrada: files/atenciones_2025_01.xlsx
+    salida: files/cardiologia_2025_01.csv
+
+Los trabajos que comparten el archivo de entrada forman un grupo: un solo proceso lee la entrada una vez y
+ejecuta los trabajos del grupo uno tras otro sobre el mismo DataFrame. Los grupos se ejecutan en un pool de
+procesos acotado y un grupo solo se admite si su memoria estimada cabe en el presupuesto junto con los grupos
+en curso (en orden de llegada: un grupo que no cabe espera a que se libere memoria y los posteriores esperan
+detrás de él). Un grupo mayor que el presupuesto completo se ejecuta solo.
+Con repartir_grupos, los trabajos de un grupo que comparten los ajustes de limpieza (y usan la caché de registros
+limpios) se reparten entre los trabajadores: el primero lee, limpia y publica el DataFrame limpio en la caché como
+marco mapeado en memoria (marco_compartido.py), y los demás se ejecutan en paralelo, uno por trabajador,
+mapeando esa única copia en lugar de leer la entrada o deserializar cada uno su propia copia.
+
+Estados: pendientes/ -> en_proceso/ -> terminados/ | fallidos/, con el log de cada trabajo (<nombre>.log)
+
+Uso:
+    python src/cola_trabajos.py [--directorio files/cola] [--trabajadores 2] [--memoria-mb 4096] [--vigilar]
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import yaml
+
+from lectores import ErrorLector, detectar_formato, estimar_filas, leer_entrada
+
+ESTADOS = ('pendientes', 'en_proceso', 'terminados', 'fallidos')
+CONFIGURACION_DEFECTO = {'directorio': "files/cola", 'trabajadores': 2, 'memoria_mb': 4096, 'intervalo_segundos': 5,
+                         'repartir_grupos': True}
+
+# Modelo de memoria (medido sobre entradas de prueba, con margen):
+#   proceso   intérprete con pandas y numpy cargados
+#   fila      DataFrame de entrada leído (10 columnas, textos incluidos)
+#   lectura   pico de la lectura respecto del DataFrame final, por formato (openpyxl construye cada celda)
+#   trabajo   copias intermedias del procesamiento respecto de la entrada, según el filtro activo
+MB_PROCESO = 80
+BYTES_POR_FILA = 400
+FACTOR_LECTURA = {'excel': 4.0, 'csv': 1.5, 'parquet': 1.2, 'sqlite': 1.5}
+FACTOR_TRABAJO = {'especifico': 0.5, 'perimetro': 2.0, 'valoracion': 2.0, 'riesgo': 2.0, 'expresion': 2.0, 'basico': 2.5}
+# Filas estimadas por byte de un CSV comprimido (no se puede estimar sin descomprimirlo)
+BYTES_COMPRIMIDOS_POR_FILA = 20
+
+
+def configuracion_cola(config_file="config.yaml"):
+    """
+    Sección cola_trabajos de config.yaml con los valores por defecto
+    """
+    configuracion = dict(CONFIGURACION_DEFECTO)
+    if os.path.exists(config_file):
+        with open(config_file, 'r', encoding='utf-8') as file:
+            configuracion.update((yaml.safe_load(file) or {}).get('cola_trabajos') or {})
+    return configuracion
+
+
+def preparar_directorios(directorio):
+    for estado in ESTADOS:
+        os.makedirs(os.path.join(directorio, estado), exist_ok=True)
+
+
+def recuperar_interrumpidos(directorio):
+    """
+    Devuelve a pendientes los trabajos que quedaron en en_proceso (la cola anterior se interrumpió)
+    """
+    recuperados = 0
+    en_proceso = os.path.join(directorio, 'en_proceso')
+    for nombre in sorted(os.listdir(en_proceso)):
+        if nombre.endswith(('.yaml', '.yml')) and not nombre.endswith('.config.yaml'):
+            os.replace(os.path.join(en_proceso, nombre), os.path.join(directorio, 'pendientes', nombre))
+            recuperados += 1
+        else:
+            os.remove(os.path.join(en_proceso, nombre))
+    return recuperados
+
+
+def configuracion_trabajo(ruta_trabajo):
+    """
+    Configuración YAML efectiva de un trabajo (sin los valores por defecto de load_config)
+    """
+    with open(ruta_trabajo, 'r', encoding='utf-8') as file:
+        trabajo = yaml.safe_load(file) or {}
+    if not isinstance(trabajo, dict):
+        raise ValueError("el archivo del trabajo debe ser un diccionario YAML")
+    if 'configuracion' in trabajo:
+        return trabajo
+    ruta_config = trabajo.get('config', "config.yaml")
+    if not os.path.exists(ruta_config):
+        raise ValueError(f"la configuración {ruta_config} no existe")
+    with open(ruta_config, 'r', encoding='utf-8') as file:
+        config = yaml.safe_load(file) or {}
+    config.setdefault('configuracion', {})
+    if trabajo.get('entrada'):
+        config['configuracion']['archivo_entrada'] = trabajo['entrada']
+    if trabajo.get('salida'):
+        config['configuracion']['archivo_salida'] = trabajo['salida']
+    return config
+
+
+def filas_entrada(archivo_entrada):
+    """
+    Registros estimados de la entrada (encabezado de Excel, muestra de CSV o conteo de SQLite)
+    """
+    filas, _ = estimar_filas(archivo_entrada)
+    if filas is None:
+        filas = os.path.getsize(archivo_entrada) // BYTES_COMPRIMIDOS_POR_FILA
+    return filas
+
+
+def estimar_trabajo(ruta_config, filas):
+    """
+    Memoria estimada de un trabajo: {'rama', 'precargar', 'motores', 'lectura_mb', 'trabajo_mb', 'marco_mb', 'limpieza'}
+    Con el historial SQLite (predicados propios de cada trabajo) o en modo fuera de memoria (bloques de
+    filas_por_bloque filas) el trabajo lee su propia entrada y no comparte la lectura del grupo
+    limpieza: huella de los ajustes de limpieza si el trabajo puede mapear los registros limpios publicados en la
+    caché por otro trabajo de su grupo (None si no usa esa caché)
+    """
+    from data_processor import load_config, plan_fuera_de_memoria, ajustes_limpieza
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        config = load_config(ruta_config)
+    if config is None:
+        raise ValueError("la configuración no es válida")
+    rama = plan_fuera_de_memoria(config)['rama']
+    formato = detectar_formato(config['configuracion']['archivo_entrada'])[0]
+    fuera_de_memoria = config['fuera_de_memoria']['activo']
+    if fuera_de_memoria:
+        filas = min(filas, config['fuera_de_memoria']['filas_por_bloque'])
+    mb_entrada = filas * BYTES_POR_FILA / 1024 / 1024
+    cache = config['cache_resultados']
+    limpieza = None
+    if (cache['activo'] and cache['limpieza'] and not fuera_de_memoria and not config['barrido_umbrales']['activo']
+            and not config['procedencia']['activo']):
+        texto = json.dumps([ajustes_limpieza(config), os.path.realpath(cache['directorio'])], sort_keys=True, default=str)
+        limpieza = hashlib.sha256(texto.encode('utf-8')).hexdigest()
+    return {
+        'rama': rama,
+        'precargar': formato != 'sqlite' and not fuera_de_memoria,
+        'motores': (config['lectura']['motor_excel'], config['lectura']['motor_csv']),
+        'lectura_mb': mb_entrada * FACTOR_LECTURA[formato],
+        'trabajo_mb': mb_entrada * FACTOR_TRABAJO[rama],
+        'marco_mb': mb_entrada,
+        'limpieza': limpieza,
+    }
+
+
+def memoria_grupo(trabajos):
+    """
+    Memoria estimada de un grupo (MB): una sola lectura compartida más el mayor trabajo (se ejecutan uno tras
+    otro); los trabajos que leen su propia entrada suman su lectura a su propio pico
+    """
+    compartidos = [t for t in trabajos if t['estimacion']['precargar']]
+    lectura = max((t['estimacion']['lectura_mb'] for t in compartidos), default=0)
+    pico = max(t['estimacion']['trabajo_mb'] + (0 if t['estimacion']['precargar'] else t['estimacion']['lectura_mb'])
+               for t in trabajos)
+    return MB_PROCESO + lectura + pico
+
+
+def repartir(entrada, trabajos, publicados, publicando):
+    """
+    Divide un grupo en unidades de ejecución [(trabajos, precargar, clave de limpieza publicada o None)]:
+        - los trabajos sin limpieza compartida y el primero de cada clave aún no publicada van juntos en una
+          unidad que lee la entrada (el primero de cada clave publica los registros limpios)
+        - los trabajos de una clave ya publicada van uno por unidad y mapean los registros limpios
+        - los trabajos de una clave que se está publicando esperan
+    Devuelve (unidades, claves que se publicarán)
+    """
+    unidades = []
+    grupo = []
+    nuevas = []
+    for trabajo in trabajos:
+        clave = (entrada, trabajo['estimacion']['limpieza']) if trabajo['estimacion']['limpieza'] else None
+        if clave is None:
+            grupo.append(trabajo)
+        elif clave in publicados:
+            unidades.append(([trabajo], False, clave))
+        elif clave not in publicando and clave not in nuevas:
+            nuevas.append(clave)
+            grupo.append(trabajo)
+    if grupo:
+        unidades.insert(0, (grupo, True, None))
+    return unidades, nuevas
+
+
+def ejecutar_grupo(archivo_entrada, trabajos, precargar=True):
+    """
+    Ejecuta los trabajos de un grupo en el proceso trabajador, leyendo la entrada compartida una sola vez
+    (precargar=False: cada trabajo obtiene sus registros por su cuenta, por ejemplo mapeando la caché)
+    Devuelve [(nombre, exito, segundos)]; la salida de cada trabajo va a su log
+    """
+    from data_processor import process_medical_data
+
+    entrada = None
+    error_lectura = None
+    compartidos = [trabajo for trabajo in trabajos if trabajo['estimacion']['precargar']] if precargar else []
+    if compartidos:
+        try:
+            entrada = leer_entrada(archivo_entrada, *compartidos[0]['estimacion']['motores'])
+        except (ErrorLector, OSError) as e:
+            error_lectura = e
+
+    resultados = []
+    for trabajo in trabajos:
+        inicio = time.perf_counter()
+        with open(trabajo['log'], 'w', encoding='utf-8') as log, contextlib.redirect_stdout(log):
+            if compartidos and trabajo['estimacion']['precargar'] and error_lectura is not None:
+                print(f"❌ Error al leer la entrada compartida {archivo_entrada}: {error_lectura}")
+                exito = False
+            else:
+                try:
+                    exito = process_medical_data(trabajo['config'], entrada if compartidos and trabajo['estimacion']['precargar'] else None)
+                except Exception as e:
+                    print(f"❌ Error inesperado: {e}")
+                    exito = False
+        resultados.append((trabajo['nombre'], bool(exito), time.perf_counter() - inicio))
+    return resultados
+
+
+def _finalizar(directorio, nombre, estado, motivo=None):
+    """
+    Mueve el trabajo y su log de en_proceso (o pendientes) al estado final
+    """
+    destino = os.path.join(directorio, estado)
+    for origen in ('en_proceso', 'pendientes'):
+        ruta = os.path.join(directorio, origen, nombre)
+        if os.path.exists(ruta):
+            os.replace(ruta, os.path.join(destino, nombre))
+            break
+    base = os.path.splitext(nombre)[0]
+    log = os.path.join(directorio, 'en_proceso', f"{base}.log")
+    if os.path.exists(log):
+        os.replace(log, os.path.join(destino, f"{base}.log"))
+    if motivo:
+        with open(os.path.join(destino, f"{base}.log"), 'a', encoding='utf-8') as file:
+            file.write(f"❌ {motivo}\n")
+    config = os.path.join(directorio, 'en_proceso', f"{base}.config.yaml")
+    if os.path.exists(config):
+        os.remove(config)
+
+
+def leer_pendientes(directorio, estimaciones):
+    """
+    Agrupa los trabajos pendientes por archivo de entrada, en orden de llegada: [(entrada, [trabajo, ...])]
+    Las estimaciones se guardan por (nombre, fecha de modificación); un trabajo inválido pasa a fallidos
+    """
+    pendientes = os.path.join(directorio, 'pendientes')
+    archivos = [n for n in os.listdir(pendientes) if n.endswith(('.yaml', '.yml'))]
+    archivos.sort(key=lambda n: (os.path.getmtime(os.path.join(pendientes, n)), n))
+
+    grupos = {}
+    for nombre in archivos:
+        ruta = os.path.join(pendientes, nombre)
+        clave = (nombre, os.path.getmtime(ruta))
+        if clave not in estimaciones:
+            base = os.path.splitext(nombre)[0]
+            ruta_config = os.path.join(directorio, 'en_proceso', f"{base}.config.yaml")
+            try:
+                config = configuracion_trabajo(ruta)
+                entrada = config['configuracion'].get('archivo_entrada')
+                if not entrada or not os.path.exists(entrada):
+                    raise ValueError(f"el archivo de entrada {entrada} no existe")
+                with open(ruta_config, 'w', encoding='utf-8') as file:
+                    yaml.safe_dump(config, file, allow_unicode=True, sort_keys=False)
+                estimaciones[clave] = {
+                    'entrada': os.path.realpath(entrada),
+                    'estimacion': estimar_trabajo(ruta_config, filas_entrada(entrada)),
+                    'config': ruta_config,
+                }
+            except (OSError, ValueError, KeyError, yaml.YAMLError, ErrorLector) as e:
+                print(f"❌ Trabajo {nombre} no válido: {e}")
+                _finalizar(directorio, nombre, 'fallidos', f"Trabajo no válido: {e}")
+                continue
+        datos = estimaciones[clave]
+        grupos.setdefault(datos['entrada'], []).append({
+            'nombre': nombre,
+            'config': datos['config'],
+            'estimacion': datos['estimacion'],
+            'log': os.path.join(directorio, 'en_proceso', f"{os.path.splitext(nombre)[0]}.log"),
+        })
+    return list(grupos.items())
+
+
+def _recrear_pool(pool, trabajadores):
+    """
+    Reemplaza un pool roto (murió uno de sus procesos) por uno nuevo
+    """
+    pool.shutdown(wait=False, cancel_futures=True)
+    print(f"♻️  Pool de trabajadores recreado")
+    return ProcessPoolExecutor(max_workers=trabajadores)
+
+
+def ejecutar_cola(directorio, trabajadores, memoria_mb, vigilar=False, intervalo=5, repartir_grupos=True):
+    """
+    Procesa los trabajos del directorio de cola; con vigilar=True sigue esperando trabajos nuevos
+    Con repartir_grupos=True los trabajos de un grupo con registros limpios publicados se reparten entre los
+    trabajadores (ver repartir). Si un proceso trabajador muere (por ejemplo, lo termina el sistema por falta de
+    memoria) el pool queda roto: los trabajos en curso en él pasan a fallidos con el motivo, el pool se recrea y
+    la cola continúa. Devuelve (terminados, fallidos)
+    """
+    preparar_directorios(directorio)
+    recuperados = recuperar_interrumpidos(directorio)
+    if recuperados:
+        print(f"♻️  Trabajos interrumpidos devueltos a pendientes: {recuperados}")
+
+    print(f"📥 Cola {directorio}: {trabajadores} trabajadores, presupuesto de memoria {memoria_mb:,} MB")
+    estimaciones = {}
+    en_curso = {}
+    # Claves de limpieza (entrada, ajustes) con registros limpios publicados y las que se están publicando
+    publicados = set()
+    publicando = {}
+    terminados, fallidos = 0, 0
+    pool = ProcessPoolExecutor(max_workers=trabajadores)
+    try:
+        while True:
+            # Admisión en orden de llegada mientras haya trabajadores libres y memoria en el presupuesto
+            en_uso = sum(memoria for _, memoria, _, _ in en_curso.values())
+            mapeados = {clave for _, _, clave, _ in en_curso.values() if clave}
+            lleno = False
+            for entrada, trabajos in leer_pendientes(directorio, estimaciones):
+                if repartir_grupos:
+                    unidades, nuevas = repartir(entrada, trabajos, publicados, publicando)
+                else:
+                    unidades, nuevas = [(trabajos, True, None)], []
+                for unidad, precargar, clave in unidades:
+                    if len(en_curso) >= trabajadores:
+                        lleno = True
+                        break
+                    if precargar:
+                        memoria = memoria_grupo(unidad)
+                    else:
+                        # Registros limpios mapeados: las páginas compartidas se cuentan una sola vez por clave
+                        memoria = MB_PROCESO + unidad[0]['estimacion']['trabajo_mb']
+                        if clave not in mapeados:
+                            memoria += unidad[0]['estimacion']['marco_mb']
+                    if en_curso and en_uso + memoria > memoria_mb:
+                        lleno = True
+                        break
+                    for trabajo in unidad:
+                        os.replace(os.path.join(directorio, 'pendientes', trabajo['nombre']),
+                                   os.path.join(directorio, 'en_proceso', trabajo['nombre']))
+                    try:
+                        futuro = pool.submit(ejecutar_grupo, entrada, unidad, precargar)
+                    except BrokenProcessPool:
+                        # Un trabajador murió antes de que se recogiera su resultado: la unidad no llegó a
+                        # ejecutarse y vuelve a pendientes; sus compañeros de pool se recogen abajo como fallidos
+                        for trabajo in unidad:
+                            os.replace(os.path.join(directorio, 'en_proceso', trabajo['nombre']),
+                                       os.path.join(directorio, 'pendientes', trabajo['nombre']))
+                        pool = _recrear_pool(pool, trabajadores)
+                        lleno = True
+                        break
+                    en_curso[futuro] = (unidad, memoria, clave, pool)
+                    if precargar:
+                        for nueva in nuevas:
+                            publicando[nueva] = futuro
+                    else:
+                        mapeados.add(clave)
+                    en_uso += memoria
+                    aviso = " (supera el presupuesto: se ejecuta solo)" if memoria > memoria_mb else ""
+                    modo = "" if precargar else ", registros limpios mapeados de la caché"
+                    print(f"▶️  {os.path.basename(entrada)}: {len(unidad)} trabajo(s) "
+                          f"[{', '.join(t['nombre'] for t in unidad)}], ~{memoria:,.0f} MB estimados{modo}{aviso}; "
+                          f"en uso ~{en_uso:,.0f}/{memoria_mb:,} MB")
+                if lleno:
+                    break
+
+            if not en_curso:
+                if not vigilar:
+                    break
+                time.sleep(intervalo)
+                continue
+
+            listos, _ = wait(list(en_curso), timeout=intervalo if vigilar else None, return_when=FIRST_COMPLETED)
+            for futuro in listos:
+                trabajos, _, _, pool_futuro = en_curso.pop(futuro)
+                motivo = None
+                try:
+                    resultados = futuro.result()
+                except BrokenProcessPool as e:
+                    resultados = [(trabajo['nombre'], False, 0.0) for trabajo in trabajos]
+                    motivo = f"El proceso trabajador terminó de forma abrupta (¿falta de memoria?): {e}"
+                    print(f"❌ {motivo}")
+                    if pool_futuro is pool:
+                        pool = _recrear_pool(pool, trabajadores)
+                except Exception as e:
+                    resultados = [(trabajo['nombre'], False, 0.0) for trabajo in trabajos]
+                    motivo = f"El proceso trabajador falló: {e}"
+                    print(f"❌ {motivo}")
+                # Claves publicadas por esta unidad (si falló, el siguiente trabajo de la clave vuelve a intentarlo)
+                exitosos = {nombre for nombre, exito, _ in resultados if exito}
+                for clave in [c for c, f in publicando.items() if f is futuro]:
+                    del publicando[clave]
+                    if any(t['nombre'] in exitosos and t['estimacion']['limpieza'] == clave[1] for t in trabajos):
+                        publicados.add(clave)
+                for nombre, exito, segundos in resultados:
+                    if exito:
+                        terminados += 1
+                        _finalizar(directorio, nombre, 'terminados')
+                        print(f"✅ {nombre} terminado en {segundos:.1f} s")
+                    else:
+                        fallidos += 1
+                        _finalizar(directorio, nombre, 'fallidos', motivo)
+                        print(f"❌ {nombre} falló (log en {os.path.join(directorio, 'fallidos')})")
+                for clave in [c for c in estimaciones if c[0] in {t['nombre'] for t in trabajos}]:
+                    del estimaciones[clave]
+    finally:
+        pool.shutdown()
+
+    print(f"📊 Trabajos terminados: {terminados}, fallidos: {fallidos}")
+    return terminados, fallidos
+
+
+def main(argumentos=None):
+    configuracion = configuracion_cola()
+    parser = argparse.ArgumentParser(description="Cola local de trabajos (configuraciones) con control de memoria")
+    parser.add_argument('--directorio', default=configuracion['directorio'], help="Directorio de la cola")
+    parser.add_argument('--trabajadores', type=int, default=configuracion['trabajadores'], help="Procesos simultáneos")
+    parser.add_argument('--memoria-mb', type=int, default=configuracion['memoria_mb'], help="Presupuesto de memoria estimada")
+    parser.add_argument('--vigilar', action='store_true', help="Seguir esperando trabajos nuevos (Ctrl+C para terminar)")
+    parser.add_argument('--intervalo', type=float, default=configuracion['intervalo_segundos'], help="Segundos entre revisiones")
+    argumentos = parser.parse_args(argumentos)
+    if argumentos.trabajadores < 1 or argumentos.memoria_mb < 1:
+        print("❌ Error: --trabajadores y --memoria-mb deben ser positivos")
+        return 1
+    try:
+        _, fallidos = ejecutar_cola(argumentos.directorio, argumentos.trabajadores, argumentos.memoria_mb,
+                                    argumentos.vigilar, argumentos.intervalo, configuracion['repartir_grupos'])
+    except KeyboardInterrupt:
+        print("\n⏹️  Cola detenida; los trabajos en curso vuelven a pendientes en la próxima ejecución")
+        return 130
+    return 1 if fallidos else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
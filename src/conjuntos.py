@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Álgebra de conjuntos de pacientes entre indicadores
+Cada indicador (expresión de códigos evaluada sobre el historial de cada paciente) se guarda como un mapa de
+bits sobre ids densos de paciente: el bit i corresponde al i-ésimo documento del array ordenado de pacientes
+(1 bit por paciente; 1 millón de pacientes = 122 KB por indicador). Las intersecciones, uniones y diferencias
+entre indicadores con nombre son operaciones bit a bit sobre esos arrays y se resuelven en milisegundos:
+    obesidad AND hipertension AND NOT consejeria
+    (dislipidemia OR diabetes) AND NOT control_anual
+
+Uso:
+    python src/conjuntos.py files/conjuntos.npz
+    python src/conjuntos.py files/conjuntos.npz "obesidad AND hipertension AND NOT consejeria" [--pacientes salida.csv]
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from expresiones import ErrorExpresion, evaluar_indicadores, parsear_expresion
+
+PREFIJO = 'conjunto_'
+
+
+def parsear_conjunto(texto, nombres):
+    """
+    Árbol de una expresión de conjuntos: AND (intersección), OR (unión), NOT (complemento; A AND NOT B es la
+    diferencia) y paréntesis sobre nombres de indicadores. Usa el mismo parser que las expresiones de códigos
+    """
+    arbol = parsear_expresion(texto)
+
+    def validar(nodo):
+        if nodo[0] == 'atomo':
+            atomo = nodo[1]
+            if atomo.codigo[0] != 'codigo' or atomo.condiciones:
+                raise ErrorExpresion(f"Solo se admiten nombres de indicadores en expresiones de conjuntos: {texto}")
+            if atomo.codigo[1] not in nombres:
+                raise ErrorExpresion(f"Indicador '{atomo.codigo[1]}' no definido (disponibles: {sorted(nombres)}): {texto}")
+        elif nodo[0] in ('y', 'o', 'no'):
+            for hijo in nodo[1:]:
+                validar(hijo)
+        else:
+            raise ErrorExpresion(f"Los predicados temporales no se admiten en expresiones de conjuntos: {texto}")
+
+    validar(arbol)
+    return arbol
+
+
+def construir_conjuntos(df, indicadores, ordenado=False):
+    """
+    Evalúa los indicadores {nombre: expresión de códigos} por paciente en un solo recorrido agrupado
+    Devuelve (pacientes: array int64 ordenado, {nombre: mapa de bits uint8})
+    """
+    evaluacion = evaluar_indicadores(df, indicadores, 'paciente', ordenado)
+    ids = evaluacion['ids']
+    n_pacientes = int(ids.max()) + 1 if len(ids) else 0
+    documentos = pd.to_numeric(df['Numero_Documento_Paciente']).to_numpy(dtype=np.int64)
+    por_grupo = np.empty(n_pacientes, dtype=np.int64)
+    por_grupo[ids] = documentos
+    orden = np.argsort(por_grupo, kind='stable')
+    pacientes = por_grupo[orden]
+    bitmaps = {nombre: np.packbits(resultado[orden]) for nombre, resultado in evaluacion['resultados'].items()}
+    return pacientes, bitmaps
+
+
+def evaluar_conjunto(arbol, bitmaps, n_pacientes):
+    """
+    Mapa de bits de la expresión (operaciones bit a bit; el complemento se limita a los n pacientes)
+    """
+    tipo = arbol[0]
+    if tipo == 'atomo':
+        return bitmaps[arbol[1].codigo[1]]
+    if tipo == 'no':
+        return np.invert(evaluar_conjunto(arbol[1], bitmaps, n_pacientes)) & np.packbits(np.ones(n_pacientes, dtype=bool))
+    resultados = [evaluar_conjunto(hijo, bitmaps, n_pacientes) for hijo in arbol[1:]]
+    operacion = np.bitwise_and if tipo == 'y' else np.bitwise_or
+    return operacion.reduce(resultados)
+
+
+def contar(bitmap):
+    return int(np.bitwise_count(bitmap).sum())
+
+
+def pertenencia(bitmap, n_pacientes):
+    """
+    Máscara booleana por id de paciente
+    """
+    return np.unpackbits(bitmap, count=n_pacientes).astype(bool)
+
+
+def mascara_registros(documentos, pacientes, bitmap):
+    """
+    Máscara por registro: el documento del registro pertenece al conjunto (búsqueda binaria en pacientes)
+    """
+    documentos = pd.to_numeric(documentos).to_numpy(dtype=np.int64)
+    if len(pacientes) == 0:
+        return np.zeros(len(documentos), dtype=bool)
+    posicion = np.minimum(np.searchsorted(pacientes, documentos), len(pacientes) - 1)
+    return (pacientes[posicion] == documentos) & pertenencia(bitmap, len(pacientes))[posicion]
+
+
+def tabla_conteos(expresiones, pacientes, bitmaps):
+    """
+    Pacientes de cada indicador y de cada expresión {nombre: texto}, con el tiempo de evaluación
+    Devuelve (DataFrame, {nombre de la expresión: mapa de bits})
+    """
+    total = len(pacientes)
+    filas = [{'conjunto': nombre, 'expresion': '(indicador)', 'pacientes': contar(bitmap),
+              'porcentaje': round(contar(bitmap) / total * 100, 2) if total else 0.0, 'milisegundos': 0.0}
+             for nombre, bitmap in bitmaps.items()]
+    resultados = {}
+    for nombre, texto in expresiones.items():
+        inicio = time.perf_counter()
+        resultados[nombre] = evaluar_conjunto(parsear_conjunto(texto, bitmaps), bitmaps, total)
+        cantidad = contar(resultados[nombre])
+        filas.append({'conjunto': nombre, 'expresion': texto, 'pacientes': cantidad,
+                      'porcentaje': round(cantidad / total * 100, 2) if total else 0.0,
+                      'milisegundos': round((time.perf_counter() - inicio) * 1000, 3)})
+    return pd.DataFrame(filas), resultados
+
+
+def guardar_conjuntos(ruta, pacientes, bitmaps):
+    np.savez_compressed(ruta, pacientes=pacientes, **{f"{PREFIJO}{nombre}": bitmap for nombre, bitmap in bitmaps.items()})
+
+
+def cargar_conjuntos(ruta):
+    """
+    (pacientes, {nombre: mapa de bits}) de un archivo generado por el procesador
+    """
+    with np.load(ruta) as datos:
+        pacientes = datos['pacientes']
+        bitmaps = {clave[len(PREFIJO):]: datos[clave] for clave in datos.files if clave.startswith(PREFIJO)}
+    return pacientes, bitmaps
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Intersecciones, uniones y diferencias de pacientes entre indicadores")
+    parser.add_argument('archivo', help="Archivo .npz de conjuntos generado por el procesador (conjuntos.archivo)")
+    parser.add_argument('expresion', nargs='?', help="Expresión de conjuntos, por ejemplo \"obesidad AND NOT consejeria\"")
+    parser.add_argument('--pacientes', help="Guardar los documentos de los pacientes de la expresión en un CSV")
+    argumentos = parser.parse_args(argumentos)
+
+    pacientes, bitmaps = cargar_conjuntos(argumentos.archivo)
+    print(f"👥 {argumentos.archivo}: {len(pacientes):,} pacientes, {len(bitmaps)} indicadores")
+    expresiones = {'expresion': argumentos.expresion} if argumentos.expresion else {}
+    try:
+        tabla, resultados = tabla_conteos(expresiones, pacientes, bitmaps)
+    except ErrorExpresion as e:
+        print(f"❌ Error en la expresión: {e}")
+        return 1
+    print(tabla.to_string(index=False))
+    if argumentos.pacientes:
+        if not argumentos.expresion:
+            print("❌ Error: --pacientes necesita una expresión")
+            return 1
+        seleccion = pacientes[pertenencia(resultados['expresion'], len(pacientes))]
+        pd.DataFrame({'Numero_Documento_Paciente': seleccion}).to_csv(argumentos.pacientes, index=False)
+        print(f"✅ {len(seleccion):,} pacientes guardados en {argumentos.pacientes}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Agrupación por corridas para entradas ordenadas por Numero_Documento_Paciente y Fecha_Atencion
+Si los registros llegan ordenados, cada paciente (o paciente-fecha) ocupa un tramo contiguo de filas:
+los grupos se delimitan con los cambios de clave (np.flatnonzero sobre la diferencia) y las
+reducciones por grupo se hacen con reduceat, sin construir tablas hash.
+Si la entrada no está ordenada se usa pd.factorize (agrupación por hash) con el mismo resultado.
+"""
+
+import numpy as np
+import pandas as pd
+
+from codigos import indice_codigos, mascara_codigos
+
+
+def _claves(df, ambito):
+    """
+    Claves numéricas por fila: (pacientes float64, fechas int64 en ns o None si el ámbito es paciente)
+    """
+    pacientes = pd.to_numeric(df['Numero_Documento_Paciente'], errors='coerce').to_numpy(dtype=np.float64)
+    if ambito == 'paciente':
+        return pacientes, None
+    fechas = pd.to_datetime(df['Fecha_Atencion'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    return pacientes, fechas
+
+
+def esta_ordenado(df, ambito='visita'):
+    """
+    Indica si las filas están ordenadas por paciente (y fecha si el ámbito es visita)
+    Los valores nulos cuentan como desorden: en ese caso se usa la agrupación por hash
+    """
+    if len(df) < 2:
+        return True
+    pacientes, fechas = _claves(df, ambito)
+    if np.isnan(pacientes).any():
+        return False
+    if fechas is None:
+        return bool((pacientes[1:] >= pacientes[:-1]).all())
+    if np.isnat(fechas).any():
+        return False
+    mismo_paciente = pacientes[1:] == pacientes[:-1]
+    return bool(((pacientes[1:] > pacientes[:-1]) | (mismo_paciente & (fechas[1:] >= fechas[:-1]))).all())
+
+
+def inicios_corridas(df, ambito='visita'):
+    """
+    Posición de la primera fila de cada grupo en una entrada ordenada
+    """
+    if len(df) == 0:
+        return np.empty(0, dtype=np.intp)
+    pacientes, fechas = _claves(df, ambito)
+    cambio = pacientes[1:] != pacientes[:-1]
+    if fechas is not None:
+        cambio |= fechas[1:] != fechas[:-1]
+    return np.flatnonzero(np.r_[True, cambio])
+
+
+def ids_corridas(df, ambito='visita'):
+    """
+    Id de grupo denso por fila a partir de las corridas de una entrada ordenada
+    Devuelve (ids_por_fila, inicios)
+    """
+    inicios = inicios_corridas(df, ambito)
+    marcas = np.zeros(len(df), dtype=np.int64)
+    marcas[inicios] = 1
+    return np.cumsum(marcas) - 1, inicios
+
+
+def ids_hash(df, ambito='visita'):
+    """
+    Id de grupo denso por fila con pd.factorize (entrada sin orden)
+    Devuelve (ids_por_fila, numero_de_grupos)
+    """
+    ids_paciente, pacientes = pd.factorize(df['Numero_Documento_Paciente'])
+    if ambito == 'paciente':
+        return ids_paciente, len(pacientes)
+    ids_fecha, fechas = pd.factorize(df['Fecha_Atencion'])
+    combinado = ids_paciente.astype(np.int64) * max(len(fechas), 1) + ids_fecha
+    ids_visita, visitas = pd.factorize(combinado)
+    return ids_visita, len(visitas)
+
+
+def presencia_por_grupo(mascara, ids, n_grupos, inicios=None):
+    """
+    Un valor por grupo: True si alguna fila del grupo cumple la máscara
+    Con inicios (entrada ordenada) se reduce por tramos; si no, se indexa por id de grupo
+    """
+    if inicios is not None:
+        if len(inicios) == 0:
+            return np.zeros(0, dtype=bool)
+        return np.logical_or.reduceat(mascara, inicios)
+    presente = np.zeros(n_grupos, dtype=bool)
+    presente[ids[mascara]] = True
+    return presente
+
+
+def grupos_con_codigos(df, ambito, requisitos, ordenado=False, por_requisito=False):
+    """
+    Selecciona los grupos (paciente o paciente-fecha) que cumplen todos los requisitos,
+    donde cada requisito es una lista de códigos de la que debe aparecer al menos uno
+    Ej: TODOS los códigos = [[c] for c in codigos]; requerido Y factor = [requeridos, factores]
+    Los requisitos admiten patrones (E66*, E78[0-5]), ver codigos.py
+    Devuelve (máscara por fila de los grupos válidos, número de grupos, número de grupos válidos)
+    Con por_requisito=True agrega la máscara por fila de los grupos que cumplen cada requisito por separado
+    """
+    if ordenado:
+        ids, inicios = ids_corridas(df, ambito)
+        n_grupos = len(inicios)
+    else:
+        ids, n_grupos = ids_hash(df, ambito)
+        inicios = None
+
+    # Codigo_Item se factoriza una vez; cada requisito es una tabla sobre los códigos distintos
+    indice = indice_codigos(df['Codigo_Item'])
+    validos = np.ones(n_grupos, dtype=bool)
+    cumplen = []
+    for requisito in requisitos:
+        mascara = mascara_codigos(df['Codigo_Item'], requisito, indice)
+        presente = presencia_por_grupo(mascara, ids, n_grupos, inicios)
+        validos &= presente
+        if por_requisito:
+            cumplen.append(presente[ids])
+    if por_requisito:
+        return validos[ids], n_grupos, int(validos.sum()), cumplen
+    return validos[ids], n_grupos, int(validos.sum())
@@ -12,12 +12,43 @@ import numpy as np
 import yaml
 from datetime import datetime
 
-def load_config():
+from expresiones import (ErrorExpresion, AMBITOS_VALIDOS, Atomo, parsear_expresion, evaluar_indicadores, describir_atomo,
+                         describir_arbol, atomos_de, mascaras_atomos, evaluar_arbol, tiene_temporales, ids_grupo)
+from cache_resultados import (clave_resultado, buscar_resultado, entregar_resultado, guardar_resultado, hash_archivo,
+                               clave_limpieza, buscar_limpieza, guardar_limpieza)
+from corridas import esta_ordenado, ids_corridas, grupos_con_codigos, presencia_por_grupo
+from lectores import ErrorLector, MOTORES, detectar_formato, estimar_filas, leer_entrada, leer_csv_por_bloques, leer_parquet_por_bloques
+from historial import ErrorHistorial, leer_historial, leer_historial_por_bloques
+from barrido_umbrales import UMBRALES_PRESION_VIGENTES, barrer_umbrales
+from transiciones import ErrorVentanas, validar_ventanas, nombre_ventana, estados_por_ventana, conteos_transiciones
+from codigos import es_patron, mascara_codigos, resolver_lista, codigos_planos, requisitos_codigos
+from muestreo import mascara_muestra, leer_info_muestra, escalar as escalar_muestra
+from cohortes import ErrorCohorte, cargar_cohorte, mascara_cohorte
+from puntos_control import ETAPAS, claves_puntos, guardar_punto, ultimo_punto, borrar_puntos
+from procedencia import COLUMNA as COLUMNA_PROCEDENCIA, iniciar as iniciar_procedencia, registrar as registrar_procedencia, serie as serie_procedencia
+from conjuntos import parsear_conjunto, construir_conjuntos, tabla_conteos, guardar_conjuntos, mascara_registros
+from clasificacion import (ErrorClasificacion, validar_tabla, construir_tabla, clasificar_perimetro, umbrales_presion,
+                           umbral_unico)
+
+# Formatos que --explain recorre completos por bloques (lectura barata): la muestra tiene pacientes completos
+FORMATOS_RECORRIDO_COMPLETO = ('csv', 'parquet', 'sqlite')
+SELECTIVIDAD_COTA_INFERIOR = ("las selectividades de las etapas que exigen todos los códigos de un paciente o visita "
+                              "son una cota inferior")
+
+# Listas de códigos de la configuración que admiten patrones (E66*, E78[0-5])
+LISTAS_CODIGOS = (
+    ('codigos_item', 'obligatorios'),
+    ('codigos_item', 'opcionales'),
+    ('filtro_perimetro', 'codigos_requeridos'),
+    ('filtro_valoracion_clinica', 'codigos_requeridos'),
+    ('filtro_valoracion_clinica_con_riesgo', 'codigos_requeridos'),
+    ('filtro_valoracion_clinica_con_riesgo', 'codigos_factores_riesgo'),
+)
+
+def load_config(config_file="config.yaml"):
     """
     Función para cargar la configuración desde el archivo YAML
     """
-    config_file = "config.yaml"
-    
     if not os.path.exists(config_file):
         print(f"❌ Error: El archivo de configuración {config_file} no existe")
         print(f"📁 Directorio actual: {os.getcwd()}")
@@ -129,10 +160,245 @@ def load_config():
         if 'fecha_atencion_activo' not in config['filtro_valoracion_clinica_con_riesgo']:
             config['filtro_valoracion_clinica_con_riesgo']['fecha_atencion_activo'] = False
         
+        # Configurar filtro por expresión de códigos por defecto
+        if 'filtro_expresion' not in config:
+            config['filtro_expresion'] = {
+                'activo': False,
+                'expresion': None,
+                'indicadores': {},
+                'ambito': "paciente",
+                'registros': "codigos"
+            }
+        
+        # Asegurar que existen las claves del filtro por expresión
+        if 'expresion' not in config['filtro_expresion']:
+            config['filtro_expresion']['expresion'] = None
+        if not config['filtro_expresion'].get('indicadores'):
+            config['filtro_expresion']['indicadores'] = {}
+        if 'ambito' not in config['filtro_expresion']:
+            config['filtro_expresion']['ambito'] = "paciente"
+        if 'registros' not in config['filtro_expresion']:
+            config['filtro_expresion']['registros'] = "codigos"
+        
+        # Validar la sintaxis de las expresiones antes de procesar
+        if config['filtro_expresion']['activo']:
+            if not config['filtro_expresion']['expresion'] and not config['filtro_expresion']['indicadores']:
+                print(f"❌ Error: filtro_expresion activo sin 'expresion' ni 'indicadores'")
+                return None
+            if config['filtro_expresion']['ambito'] not in AMBITOS_VALIDOS:
+                print(f"❌ Error: Ámbito '{config['filtro_expresion']['ambito']}' no reconocido en filtro_expresion. Use uno de: {list(AMBITOS_VALIDOS)}")
+                return None
+            try:
+                if config['filtro_expresion']['expresion']:
+                    parsear_expresion(config['filtro_expresion']['expresion'])
+                for nombre, texto in config['filtro_expresion']['indicadores'].items():
+                    parsear_expresion(texto)
+            except ErrorExpresion as e:
+                print(f"❌ Error en expresión de filtro_expresion: {e}")
+                return None
+        
         # Configurar generación de nombre único
         if 'generar_nombre_unico' not in config['configuracion']:
             config['configuracion']['generar_nombre_unico'] = True
         
+        # Configurar detección de entrada ordenada ("auto" = detectar, true = declarada ordenada, false = nunca)
+        if 'entrada_ordenada' not in config['configuracion']:
+            config['configuracion']['entrada_ordenada'] = "auto"
+        if config['configuracion']['entrada_ordenada'] not in ("auto", True, False):
+            print(f"❌ Error: entrada_ordenada debe ser \"auto\", true o false")
+            return None
+        
+        # Configurar caché de resultados por defecto
+        if 'cache_resultados' not in config:
+            config['cache_resultados'] = {
+                'activo': False,
+                'directorio': "files/.cache/resultados",
+                'max_mb': 2048,
+                'max_dias': 30,
+                'max_entradas': 100,
+                'limpieza': True
+            }
+        
+        # Asegurar que existen todas las claves de la caché de resultados
+        if 'directorio' not in config['cache_resultados']:
+            config['cache_resultados']['directorio'] = "files/.cache/resultados"
+        if 'max_mb' not in config['cache_resultados']:
+            config['cache_resultados']['max_mb'] = 2048
+        if 'max_dias' not in config['cache_resultados']:
+            config['cache_resultados']['max_dias'] = 30
+        if 'max_entradas' not in config['cache_resultados']:
+            config['cache_resultados']['max_entradas'] = 100
+        if 'limpieza' not in config['cache_resultados']:
+            config['cache_resultados']['limpieza'] = True
+        
+        # Configurar motores de lectura por defecto ("auto" = el más rápido instalado)
+        if 'lectura' not in config:
+            config['lectura'] = {'motor_excel': "auto", 'motor_csv': "auto"}
+        for formato in ('excel', 'csv'):
+            clave = f"motor_{formato}"
+            if clave not in config['lectura']:
+                config['lectura'][clave] = "auto"
+            motores_validos = ["auto"] + [nombre for nombre, _ in MOTORES[formato]]
+            if config['lectura'][clave] not in motores_validos:
+                print(f"❌ Error: lectura.{clave} debe ser uno de: {motores_validos}")
+                return None
+        
+        # Configurar barrido de umbrales por defecto (listas vacías = solo el umbral vigente)
+        if 'barrido_umbrales' not in config:
+            config['barrido_umbrales'] = {
+                'activo': False,
+                'perimetro': {'genero_femenino': [], 'genero_masculino': []},
+                'presion_arterial': {'sistolica': [], 'diastolica': []},
+                'archivo_salida': "files/barrido_umbrales.csv"
+            }
+        
+        # Asegurar que existen todas las claves del barrido de umbrales
+        barrido = config['barrido_umbrales']
+        if 'archivo_salida' not in barrido:
+            barrido['archivo_salida'] = "files/barrido_umbrales.csv"
+        for medida, categorias in (('perimetro', ('genero_femenino', 'genero_masculino')),
+                                   ('presion_arterial', ('sistolica', 'diastolica'))):
+            if not barrido.get(medida):
+                barrido[medida] = {}
+            for categoria in categorias:
+                if not barrido[medida].get(categoria):
+                    barrido[medida][categoria] = []
+                elif not isinstance(barrido[medida][categoria], list):
+                    barrido[medida][categoria] = [barrido[medida][categoria]]
+                # Perímetro: cada candidato es un corte ANORMAL o un par [normal, anormal]
+                pares_validos = medida == 'perimetro'
+                for candidato in barrido[medida][categoria]:
+                    if isinstance(candidato, list) and (not pares_validos or len(candidato) != 2):
+                        print(f"❌ Error: barrido_umbrales.{medida}.{categoria}: candidato no válido {candidato}"
+                              f"{' (use un número o [normal, anormal])' if pares_validos else ' (use números)'}")
+                        return None
+        
+        # Configurar tablas de clasificación por género y banda de edad (por defecto, los umbrales vigentes en una sola banda)
+        if not config.get('tablas_clasificacion'):
+            config['tablas_clasificacion'] = {}
+        tablas = config['tablas_clasificacion']
+        if not tablas.get('perimetro'):
+            clasificacion = config['filtro_perimetro'].get('clasificacion_perimetro') or {}
+            tablas['perimetro'] = {'bandas_edad': []}
+            for clave, valores in (('genero_femenino', {'normal': 88, 'anormal': 88}),
+                                   ('genero_masculino', {'normal': 102, 'anormal': 102})):
+                tablas['perimetro'][clave] = dict(valores, **(clasificacion.get(clave) or {}))
+        if not tablas.get('presion_arterial'):
+            tablas['presion_arterial'] = {'bandas_edad': [], 'todos': {'sistolica': UMBRALES_PRESION_VIGENTES['S'],
+                                                                       'diastolica': UMBRALES_PRESION_VIGENTES['D']}}
+        try:
+            for nombre in list(tablas):
+                tablas[nombre] = validar_tabla(nombre, tablas[nombre])
+        except ErrorClasificacion as e:
+            print(f"❌ Error en tablas_clasificacion: {e}")
+            return None
+        
+        # Configurar transiciones entre periodos por defecto
+        if 'transiciones' not in config:
+            config['transiciones'] = {'activo': False, 'ventanas': [], 'archivo_salida': "files/transiciones.csv"}
+        transiciones = config['transiciones']
+        if 'activo' not in transiciones:
+            transiciones['activo'] = False
+        if not transiciones.get('ventanas'):
+            transiciones['ventanas'] = []
+        if 'archivo_salida' not in transiciones:
+            transiciones['archivo_salida'] = "files/transiciones.csv"
+        if transiciones['activo']:
+            try:
+                ventanas = validar_ventanas(transiciones['ventanas'])
+            except ErrorVentanas as e:
+                print(f"❌ Error en transiciones.ventanas: {e}")
+                return None
+            # El rango de fechas del filtro específico no se modifica (define el CSV principal): las ventanas
+            # se evalúan sobre los registros finales, es decir, sobre su intersección con ese rango
+            rango = config['filtro_especifico']['fecha_atencion_rango']
+            if config['filtro_especifico']['activo'] and rango and len(rango) == 2:
+                inicio, fin = pd.to_datetime(rango[0]), pd.to_datetime(rango[1])
+                fuera = [ventana for ventana in ventanas if ventana[0] < inicio or ventana[1] > fin]
+                if fuera:
+                    print(f"⚠️  Transiciones: {len(fuera)} ventana(s) exceden fecha_atencion_rango ({rango[0]} a {rango[1]}); "
+                          f"solo se clasifican con los registros dentro del rango (amplíe el rango para cubrirlas)")
+        
+        # Configurar conjuntos de pacientes por indicador por defecto
+        if 'conjuntos' not in config:
+            config['conjuntos'] = {}
+        for clave, valor in (('activo', False), ('indicadores', {}), ('expresiones', {}),
+                             ('archivo_salida', "files/conjuntos.csv"), ('exportar_registros', False)):
+            if config['conjuntos'].get(clave) is None:
+                config['conjuntos'][clave] = valor
+        if config['conjuntos']['activo']:
+            # Sin indicadores propios se usan los de filtro_expresion
+            if not config['conjuntos']['indicadores']:
+                config['conjuntos']['indicadores'] = dict(config['filtro_expresion']['indicadores'])
+            if not config['conjuntos']['indicadores']:
+                print(f"❌ Error: conjuntos activo sin 'indicadores' (ni en conjuntos ni en filtro_expresion)")
+                return None
+            try:
+                for texto in config['conjuntos']['indicadores'].values():
+                    parsear_expresion(texto)
+                for texto in config['conjuntos']['expresiones'].values():
+                    parsear_conjunto(texto, config['conjuntos']['indicadores'])
+            except ErrorExpresion as e:
+                print(f"❌ Error en conjuntos: {e}")
+                return None
+        
+        # Configurar banderas de procedencia por defecto
+        if 'procedencia' not in config:
+            config['procedencia'] = {'activo': False, 'archivo_excluidos': "files/procedencia_excluidos.csv"}
+        if 'activo' not in config['procedencia']:
+            config['procedencia']['activo'] = False
+        if 'archivo_excluidos' not in config['procedencia']:
+            config['procedencia']['archivo_excluidos'] = "files/procedencia_excluidos.csv"
+        
+        # Configurar cohortes externas por defecto (archivos de documentos a incluir o excluir)
+        if 'cohorte' not in config:
+            config['cohorte'] = {}
+        for clave in ('incluir', 'excluir', 'columna'):
+            if not config['cohorte'].get(clave):
+                config['cohorte'][clave] = ""
+        # La huella del contenido de cada archivo entra en las claves de caché y de puntos de control
+        config['cohorte']['huellas'] = {}
+        for clave in ('incluir', 'excluir'):
+            ruta = config['cohorte'][clave]
+            if ruta:
+                if not os.path.exists(ruta):
+                    print(f"❌ Error: El archivo de cohorte cohorte.{clave} no existe: {ruta}")
+                    return None
+                config['cohorte']['huellas'][clave] = hash_archivo(ruta)
+        
+        # Configurar puntos de control por defecto
+        if 'puntos_control' not in config:
+            config['puntos_control'] = {}
+        for clave, valor in (('activo', False), ('directorio', "files/.checkpoints"), ('reanudar', True), ('conservar', False)):
+            if clave not in config['puntos_control']:
+                config['puntos_control'][clave] = valor
+        
+        # Configurar historial SQLite por defecto
+        if 'historial' not in config:
+            config['historial'] = {'archivo': "files/historial.sqlite"}
+        if 'archivo' not in config['historial']:
+            config['historial']['archivo'] = "files/historial.sqlite"
+        
+        # Configurar modo fuera de memoria por defecto
+        if 'fuera_de_memoria' not in config:
+            config['fuera_de_memoria'] = {
+                'activo': False,
+                'filas_por_bloque': 200000,
+                'directorio_temporal': "files/.tmp",
+                'max_corridas_mezcla': 64
+            }
+        
+        # Asegurar que existen todas las claves del modo fuera de memoria
+        if 'filas_por_bloque' not in config['fuera_de_memoria']:
+            config['fuera_de_memoria']['filas_por_bloque'] = 200000
+        if 'directorio_temporal' not in config['fuera_de_memoria']:
+            config['fuera_de_memoria']['directorio_temporal'] = "files/.tmp"
+        if 'max_corridas_mezcla' not in config['fuera_de_memoria']:
+            config['fuera_de_memoria']['max_corridas_mezcla'] = 64
+        if not isinstance(config['fuera_de_memoria']['max_corridas_mezcla'], int) or config['fuera_de_memoria']['max_corridas_mezcla'] < 2:
+            print(f"❌ Error: fuera_de_memoria.max_corridas_mezcla debe ser un entero mayor o igual a 2")
+            return None
+        
         print(f"\n📋 CONFIGURACIÓN CARGADA:")
         if config['codigos_item']['obligatorios'] or config['codigos_item']['opcionales']:
             if config['codigos_item']['obligatorios']:
@@ -162,6 +428,9 @@ def load_config():
             if config['filtro_especifico']['tipo_presion_arterial_activo']:
                 print(f"   Filtro presión arterial: ACTIVO")
                 print(f"   Tipos presión arterial: {config['filtro_especifico']['tipo_presion_arterial']}")
+                tabla_presion = config['tablas_clasificacion']['presion_arterial']
+                if tabla_presion['bandas_edad']:
+                    print(f"   Umbrales presión arterial: tabla por género y {len(tabla_presion['bandas_edad']) + 1} bandas de edad (límites {tabla_presion['bandas_edad']})")
             else:
                 print(f"   Filtro presión arterial: INACTIVO")
         else:
@@ -171,8 +440,13 @@ def load_config():
         if config['filtro_perimetro']['activo']:
             print(f"✅ Filtro de perímetro: ACTIVO")
             print(f"   Códigos requeridos: {config['filtro_perimetro']['codigos_requeridos']}")
-            print(f"   Clasificación Femenino: Normal ≤{config['filtro_perimetro']['clasificacion_perimetro']['genero_femenino']['normal']}cm, Anormal >{config['filtro_perimetro']['clasificacion_perimetro']['genero_femenino']['anormal']}cm")
-            print(f"   Clasificación Masculino: Normal ≤{config['filtro_perimetro']['clasificacion_perimetro']['genero_masculino']['normal']}cm, Anormal >{config['filtro_perimetro']['clasificacion_perimetro']['genero_masculino']['anormal']}cm")
+            tabla_perimetro = config['tablas_clasificacion']['perimetro']
+            if tabla_perimetro['bandas_edad']:
+                print(f"   Clasificación: tabla por género y {len(tabla_perimetro['bandas_edad']) + 1} bandas de edad (límites {tabla_perimetro['bandas_edad']})")
+            else:
+                for clave, etiqueta in (('genero_femenino', 'Femenino'), ('genero_masculino', 'Masculino'), ('todos', 'otros géneros')):
+                    if clave in tabla_perimetro:
+                        print(f"   Clasificación {etiqueta}: Normal ≤{tabla_perimetro[clave]['normal'][0]}cm, Anormal >{tabla_perimetro[clave]['anormal'][0]}cm")
             print(f"   Modo de filtrado: {config['filtro_perimetro']['modo_filtrado']}")
             if config['filtro_perimetro']['fecha_atencion_activo']:
                 print(f"   Filtro por fecha de atención: ACTIVO")
@@ -193,101 +467,2315 @@ def load_config():
             else:
                 print(f"   Filtro por fecha de atención: INACTIVO")
         else:
-            print(f"✅ Filtro de valoración clínica: INACTIVO")
-        
-        # Mostrar configuración del filtro de valoración clínica con factores de riesgo
-        if config['filtro_valoracion_clinica_con_riesgo']['activo']:
-            print(f"✅ Filtro de valoración clínica con factores de riesgo: ACTIVO")
-            print(f"   Códigos requeridos: {config['filtro_valoracion_clinica_con_riesgo']['codigos_requeridos']}")
-            print(f"   Códigos de factores de riesgo: {config['filtro_valoracion_clinica_con_riesgo']['codigos_factores_riesgo']}")
-            print(f"   Modo de filtrado: {config['filtro_valoracion_clinica_con_riesgo']['modo_filtrado']}")
-            if config['filtro_valoracion_clinica_con_riesgo']['valor_lab_especifico']:
-                print(f"   Valor_Lab específico: {config['filtro_valoracion_clinica_con_riesgo']['valor_lab_especifico']}")
-            if config['filtro_valoracion_clinica_con_riesgo']['fecha_atencion_activo']:
-                print(f"   Filtro por fecha de atención: ACTIVO")
-            else:
-                print(f"   Filtro por fecha de atención: INACTIVO")
+            print(f"✅ Filtro de valoración clínica: INACTIVO")
+        
+        # Mostrar configuración del filtro de valoración clínica con factores de riesgo
+        if config['filtro_valoracion_clinica_con_riesgo']['activo']:
+            print(f"✅ Filtro de valoración clínica con factores de riesgo: ACTIVO")
+            print(f"   Códigos requeridos: {config['filtro_valoracion_clinica_con_riesgo']['codigos_requeridos']}")
+            print(f"   Códigos de factores de riesgo: {config['filtro_valoracion_clinica_con_riesgo']['codigos_factores_riesgo']}")
+            print(f"   Modo de filtrado: {config['filtro_valoracion_clinica_con_riesgo']['modo_filtrado']}")
+            if config['filtro_valoracion_clinica_con_riesgo']['valor_lab_especifico']:
+                print(f"   Valor_Lab específico: {config['filtro_valoracion_clinica_con_riesgo']['valor_lab_especifico']}")
+            if config['filtro_valoracion_clinica_con_riesgo']['fecha_atencion_activo']:
+                print(f"   Filtro por fecha de atención: ACTIVO")
+            else:
+                print(f"   Filtro por fecha de atención: INACTIVO")
+        else:
+            print(f"✅ Filtro de valoración clínica con factores de riesgo: INACTIVO")
+        
+        # Mostrar configuración del filtro por expresión
+        if config['filtro_expresion']['activo']:
+            print(f"✅ Filtro por expresión: ACTIVO")
+            if config['filtro_expresion']['expresion']:
+                print(f"   Expresión: {config['filtro_expresion']['expresion']}")
+            for nombre, texto in config['filtro_expresion']['indicadores'].items():
+                print(f"   Indicador {nombre}: {texto}")
+            print(f"   Ámbito: {config['filtro_expresion']['ambito']}")
+            print(f"   Registros: {config['filtro_expresion']['registros']}")
+        else:
+            print(f"✅ Filtro por expresión: INACTIVO")
+            
+        print(f"✅ Tipo de diagnóstico: {config['configuracion']['tipo_diagnostico']}")
+        print(f"✅ Archivo de entrada: {config['configuracion']['archivo_entrada']}")
+        print(f"✅ Motores de lectura: Excel={config['lectura']['motor_excel']}, CSV={config['lectura']['motor_csv']}")
+        print(f"✅ Generar nombre único: {config['configuracion']['generar_nombre_unico']}")
+        print(f"✅ Entrada ordenada: {config['configuracion']['entrada_ordenada']}")
+        if config['cache_resultados']['activo']:
+            print(f"✅ Caché de resultados: ACTIVA ({config['cache_resultados']['directorio']}, máx. {config['cache_resultados']['max_mb']} MB, {config['cache_resultados']['max_dias']} días, {config['cache_resultados']['max_entradas']} entradas{', limpieza compartida' if config['cache_resultados']['limpieza'] else ''})")
+        else:
+            print(f"✅ Caché de resultados: INACTIVA")
+        
+        if config['barrido_umbrales']['activo']:
+            print(f"✅ Barrido de umbrales: ACTIVO (perímetro F={config['barrido_umbrales']['perimetro']['genero_femenino'] or 'vigente'}, M={config['barrido_umbrales']['perimetro']['genero_masculino'] or 'vigente'}; presión S={config['barrido_umbrales']['presion_arterial']['sistolica'] or 'vigente'}, D={config['barrido_umbrales']['presion_arterial']['diastolica'] or 'vigente'})")
+        
+        if config['procedencia']['activo']:
+            print(f"✅ Banderas de procedencia: ACTIVO (columna {COLUMNA_PROCEDENCIA}; excluidos en {config['procedencia']['archivo_excluidos'] or 'no se guardan'})")
+        
+        if config['transiciones']['activo']:
+            print(f"✅ Transiciones entre periodos: ACTIVO ({len(config['transiciones']['ventanas'])} ventanas: {config['transiciones']['ventanas']})")
+        
+        if config['conjuntos']['activo']:
+            print(f"✅ Conjuntos de pacientes: ACTIVO ({len(config['conjuntos']['indicadores'])} indicadores, {len(config['conjuntos']['expresiones'])} expresiones)")
+        
+        if config['cohorte']['incluir'] or config['cohorte']['excluir']:
+            print(f"✅ Cohorte: incluir={config['cohorte']['incluir'] or 'todos'}, excluir={config['cohorte']['excluir'] or 'ninguno'}")
+        
+        if config['puntos_control']['activo']:
+            print(f"✅ Puntos de control: ACTIVOS ({config['puntos_control']['directorio']}, reanudar={config['puntos_control']['reanudar']})")
+        
+        if config['fuera_de_memoria']['activo']:
+            print(f"✅ Modo fuera de memoria: ACTIVO (bloques de {config['fuera_de_memoria']['filas_por_bloque']:,} filas, temporales en {config['fuera_de_memoria']['directorio_temporal']})")
+        else:
+            print(f"✅ Modo fuera de memoria: INACTIVO")
+        print(f"✅ Columnas a mantener: {len(config['columnas'])} columnas")
+        
+        return config
+        
+    except yaml.YAMLError as e:
+        print(f"❌ Error al leer el archivo YAML: {e}")
+        return None
+    except Exception as e:
+        print(f"❌ Error inesperado al cargar configuración: {e}")
+        return None
+
+def generate_unique_filename(base_filename):
+    """
+    Genera un nombre de archivo único con timestamp
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    name, ext = os.path.splitext(base_filename)
+    return f"{name}_{timestamp}{ext}"
+
+def classify_perimeter_abdominal(df, config, mostrar=True):
+    """
+    Clasifica el perímetro abdominal según género y banda de edad (tablas_clasificacion.perimetro)
+    La clasificación solo depende de cada registro: se resuelve en una pasada vectorizada (búsqueda de la
+    banda y del umbral en la tabla) también con fecha_atencion_activo, sin recorrer los grupos paciente-fecha
+    """
+    if mostrar:
+        if config['filtro_perimetro'].get('fecha_atencion_activo', False):
+            print(f"📅 Clasificando perímetro por paciente y fecha de atención...")
+        else:
+            print(f"📅 Clasificando perímetro por registro individual...")
+    
+    tabla = construir_tabla('perimetro', config['tablas_clasificacion']['perimetro'])
+    df['Clasificacion_Perimetro'] = clasificar_perimetro(df, tabla)
+    return df
+
+def resolver_patrones_config(config, categorias):
+    """
+    Sustituye en la configuración cada patrón de código por la lista de códigos presentes que coinciden
+    (en su lugar, para que cada patrón siga contando como un solo requisito en el modo "todos")
+    Sin patrones pendientes no hace nada, así que se puede llamar de nuevo con la configuración ya resuelta
+    """
+    if not any(es_patron(codigo) for seccion, clave in LISTAS_CODIGOS for codigo in config[seccion].get(clave, [])):
+        return
+    print(f"\n🔎 Resolviendo patrones de códigos contra {len(categorias):,} códigos distintos...")
+    for seccion, clave in LISTAS_CODIGOS:
+        codigos = config[seccion].get(clave, [])
+        if not any(es_patron(codigo) for codigo in codigos):
+            continue
+        config[seccion][clave], resoluciones = resolver_lista(codigos, categorias)
+        for patron, resueltos in resoluciones.items():
+            if resueltos:
+                print(f"✅ {seccion}.{clave}: {patron} → {len(resueltos)} códigos: {resueltos}")
+            else:
+                print(f"⚠️  {seccion}.{clave}: {patron} no coincide con ningún código de los datos")
+
+def ejecutar_barrido_umbrales(df, medida, config):
+    """
+    Barrido de umbrales de una medida ('perimetro' o 'presion_arterial') sobre los registros ya clasificados
+    Muestra y guarda la tabla de conteos NORMAL/ANORMAL por combinación de umbrales
+    """
+    barrido = config['barrido_umbrales']
+    # Umbral vigente de cada categoría: el de la tabla de clasificación si no depende de la edad
+    tabla_clasificacion = config['tablas_clasificacion'][medida]
+    if medida == 'perimetro':
+        clasificacion = config['filtro_perimetro'].get('clasificacion_perimetro') or {}
+        vigentes = {}
+        vigentes_normales = {}
+        umbrales = {}
+        normales = {}
+        for genero, clave, defecto in (('F', 'genero_femenino', 88), ('M', 'genero_masculino', 102)):
+            for corte, vigentes_corte in (('anormal', vigentes), ('normal', vigentes_normales)):
+                vigentes_corte[genero] = umbral_unico(tabla_clasificacion, clave, corte) or (clasificacion.get(clave) or {}).get(corte, defecto)
+            # Cada candidato es un corte ANORMAL (con el corte NORMAL vigente) o un par [normal, anormal]
+            candidatos = [candidato if isinstance(candidato, list) else [vigentes_normales[genero], candidato]
+                          for candidato in barrido['perimetro'][clave]] or [[vigentes_normales[genero], vigentes[genero]]]
+            normales[genero] = [normal for normal, _ in candidatos]
+            umbrales[genero] = [anormal for _, anormal in candidatos]
+        tabla = barrer_umbrales(df, 'Perimetro_Abdominal', 'Genero', umbrales, inclusivo=False, vigentes=vigentes,
+                                normales=normales, vigentes_normales=vigentes_normales)
+    else:
+        vigentes = {tipo: umbral_unico(tabla_clasificacion, 'todos', medida_tabla) or UMBRALES_PRESION_VIGENTES[tipo]
+                    for tipo, medida_tabla in (('S', 'sistolica'), ('D', 'diastolica'))}
+        umbrales = {'S': barrido['presion_arterial']['sistolica'] or [vigentes['S']],
+                    'D': barrido['presion_arterial']['diastolica'] or [vigentes['D']]}
+        tabla = barrer_umbrales(df, 'Valor_Lab_Numeric', 'tipo_presion', umbrales, inclusivo=True,
+                                vigentes=vigentes, nulos_clasificados=True)
+    
+    print(f"\n📐 Barrido de umbrales de {medida.replace('_', ' ')}: {len(tabla):,} combinaciones")
+    print(tabla.to_string(index=False))
+    
+    nombre, extension = os.path.splitext(barrido['archivo_salida'])
+    archivo_barrido = f"{nombre}_{medida}{extension}"
+    if config['configuracion']['generar_nombre_unico']:
+        archivo_barrido = generate_unique_filename(archivo_barrido)
+    if os.path.dirname(archivo_barrido):
+        os.makedirs(os.path.dirname(archivo_barrido), exist_ok=True)
+    tabla.to_csv(archivo_barrido, index=False)
+    print(f"✅ Tabla de barrido guardada en: {archivo_barrido}")
+    return tabla
+
+def ejecutar_transiciones(df_final, config):
+    """
+    Estado NORMAL/ANORMAL de cada paciente en cada ventana de transiciones.ventanas y pacientes por transición
+    entre ventanas consecutivas, a partir de los registros finales (valor_presion_total o Clasificacion_Perimetro)
+    Guarda la tabla por paciente en archivo_salida y los conteos en <archivo_salida>_conteos
+    """
+    transiciones = config['transiciones']
+    if 'valor_presion_total' in df_final.columns:
+        columna = 'valor_presion_total'
+    elif 'Clasificacion_Perimetro' in df_final.columns:
+        columna = 'Clasificacion_Perimetro'
+    else:
+        print(f"⚠️  Transiciones omitidas: requieren el filtro de presión arterial o el de perímetro abdominal")
+        return None
+    
+    ventanas = validar_ventanas(transiciones['ventanas'])
+    estados = estados_por_ventana(df_final, columna, ventanas)
+    conteos = conteos_transiciones(estados)
+    
+    print(f"\n🔀 Transiciones de {columna} entre {len(ventanas)} ventanas ({len(estados):,} pacientes):")
+    for ventana in ventanas:
+        distribucion = estados[f"estado_{nombre_ventana(ventana)}"].value_counts()
+        print(f"  {ventana[0].date()} a {ventana[1].date()}: " + ", ".join(f"{estado}={distribucion.get(estado, 0):,}" for estado in ('NORMAL', 'ANORMAL', 'SIN_DATOS')))
+    for (desde, hasta), grupo in conteos.groupby(['desde', 'hasta'], sort=False):
+        print(f"\n📊 {desde} → {hasta} (filas: estado inicial, columnas: estado final)")
+        print(grupo.pivot(index='estado_desde', columns='estado_hasta', values='pacientes').to_string())
+    
+    archivo_estados = transiciones['archivo_salida']
+    nombre, extension = os.path.splitext(archivo_estados)
+    archivo_conteos = f"{nombre}_conteos{extension}"
+    if config['configuracion']['generar_nombre_unico']:
+        archivo_estados = generate_unique_filename(archivo_estados)
+        archivo_conteos = generate_unique_filename(archivo_conteos)
+    if os.path.dirname(archivo_estados):
+        os.makedirs(os.path.dirname(archivo_estados), exist_ok=True)
+    estados.to_csv(archivo_estados, index=False)
+    conteos.to_csv(archivo_conteos, index=False)
+    print(f"✅ Estados por paciente guardados en: {archivo_estados}")
+    print(f"✅ Conteos de transiciones guardados en: {archivo_conteos}")
+    return conteos
+
+def ejecutar_conjuntos(df_clean, config, ordenado=False):
+    """
+    Conjuntos de pacientes de cada indicador de conjuntos.indicadores (mapas de bits sobre los pacientes de los
+    registros limpios, independientes del filtro activo) y pacientes de cada expresión de conjuntos.expresiones
+    Guarda los conteos en archivo_salida, los mapas de bits en <archivo_salida>.npz y, con exportar_registros,
+    los registros limpios de los pacientes de cada expresión en <archivo_salida>_<expresión>
+    """
+    import time
+    
+    conjuntos = config['conjuntos']
+    inicio = time.perf_counter()
+    pacientes, bitmaps = construir_conjuntos(df_clean, conjuntos['indicadores'], ordenado)
+    segundos = time.perf_counter() - inicio
+    tabla, resultados = tabla_conteos(conjuntos['expresiones'], pacientes, bitmaps)
+    
+    print(f"\n👥 Conjuntos de pacientes: {len(pacientes):,} pacientes, {len(bitmaps)} indicadores en {segundos:.2f} s "
+          f"({sum(b.nbytes for b in bitmaps.values()) / 1024:,.1f} KB en mapas de bits)")
+    print(tabla.to_string(index=False))
+    
+    archivo_conteos = conjuntos['archivo_salida']
+    nombre, extension = os.path.splitext(archivo_conteos)
+    archivo_bitmaps = f"{nombre}.npz"
+    if config['configuracion']['generar_nombre_unico']:
+        archivo_conteos = generate_unique_filename(archivo_conteos)
+        archivo_bitmaps = f"{os.path.splitext(archivo_conteos)[0]}.npz"
+    if os.path.dirname(archivo_conteos):
+        os.makedirs(os.path.dirname(archivo_conteos), exist_ok=True)
+    tabla.to_csv(archivo_conteos, index=False)
+    guardar_conjuntos(archivo_bitmaps, pacientes, bitmaps)
+    print(f"✅ Conteos de conjuntos guardados en: {archivo_conteos}")
+    print(f"✅ Mapas de bits guardados en: {archivo_bitmaps} (consultas: python src/conjuntos.py {archivo_bitmaps} \"A AND NOT B\")")
+    
+    if conjuntos['exportar_registros']:
+        base = os.path.splitext(archivo_conteos)[0]
+        for nombre_expresion, bitmap in resultados.items():
+            registros = df_clean[mascara_registros(df_clean['Numero_Documento_Paciente'], pacientes, bitmap)]
+            archivo_registros = f"{base}_{nombre_expresion}{extension}"
+            registros.to_csv(archivo_registros, index=False)
+            print(f"✅ {nombre_expresion}: {len(registros):,} registros guardados en {archivo_registros}")
+    return tabla
+
+def mostrar_escala_muestra(archivo_entrada, registros, pacientes):
+    """
+    Si la entrada es una muestra de desarrollo (python src/muestreo.py), escala los conteos finales a la entrada completa
+    """
+    info = leer_info_muestra(archivo_entrada)
+    if info is None:
+        return
+    print(f"📐 Entrada muestreada: {info['fraccion']:.2%} de los pacientes (semilla {info['semilla']}) de {info['origen']}")
+    print(f"📐 Estimación en la entrada completa: ≈ {escalar_muestra(info, registros):,} registros finales, "
+          f"≈ {escalar_muestra(info, pacientes):,} pacientes")
+
+def guardar_punto_control(puntos_control, claves, etapa, estado):
+    """
+    Guarda el punto de control de una etapa; si no se puede escribir (disco lleno, permisos) el procesamiento sigue
+    """
+    try:
+        tamano = guardar_punto(puntos_control['directorio'], claves, etapa, estado)
+        print(f"⏯️  Punto de control '{etapa}' guardado ({tamano / 1024 / 1024:,.1f} MB)")
+    except OSError as e:
+        print(f"⚠️  No se pudo guardar el punto de control '{etapa}': {e}")
+
+def aplicar_reglas_calidad(df_selected, validaciones, mostrar=True, procedencia=False):
+    """
+    Elimina registros nulos de Numero_Documento_Paciente y aplica las reglas de calidad de datos
+    (conversión numérica del documento, rango de edad, género y formato de fecha)
+    Con mostrar=False no imprime estadísticas (uso por bloques en modo fuera de memoria)
+    Con procedencia=True devuelve (df_clean, banderas): las banderas de calidad de cada registro de df_selected
+    (ver procedencia.py) salen de las máscaras de cada regla, evaluada también en los registros ya descartados
+    """
+    # PASO 5: Eliminar registros nulos de Numero_Documento_Paciente
+    if mostrar:
+        print(f"\n🧹 Eliminando registros nulos de Numero_Documento_Paciente")
+        null_count = df_selected['Numero_Documento_Paciente'].isnull().sum()
+        print(f"📊 Registros nulos en Numero_Documento_Paciente: {null_count:,}")
+    
+    df_clean = df_selected.dropna(subset=['Numero_Documento_Paciente'])
+    if procedencia:
+        # Registros descartados hasta el momento y etiquetas de los que no cumplen cada regla
+        descartados = df_selected[df_selected['Numero_Documento_Paciente'].isnull()]
+        fallan = {'DOCUMENTO_VALIDO': [descartados.index]}
+    if mostrar:
+        print(f"📊 Registros después de eliminar nulos: {len(df_clean):,}")
+    
+    # PASO 6: Aplicar reglas de calidad de datos
+    if mostrar:
+        print(f"\n🔧 Aplicando reglas de calidad de datos...")
+    
+    # Regla 1: Convertir Numero_Documento_Paciente a numérico
+    df_clean['Numero_Documento_Paciente'] = pd.to_numeric(df_clean['Numero_Documento_Paciente'], errors='coerce')
+    if procedencia:
+        rechazados = df_clean[df_clean['Numero_Documento_Paciente'].isna()]
+        fallan['DOCUMENTO_VALIDO'].append(rechazados.index)
+        descartados = pd.concat([descartados, rechazados])
+    df_clean = df_clean.dropna(subset=['Numero_Documento_Paciente'])
+    if mostrar:
+        print(f"📊 Registros después de conversión numérica: {len(df_clean):,}")
+    
+    # Regla 2: Validar rango de edad
+    edad_min = validaciones.get('edad_minima', 0)
+    edad_max = validaciones.get('edad_maxima', 120)
+    if 'Edad_Reg' in df_clean.columns:
+        edad_valida = (df_clean['Edad_Reg'] >= edad_min) & (df_clean['Edad_Reg'] <= edad_max)
+        if procedencia:
+            edad_descartados = (descartados['Edad_Reg'] >= edad_min) & (descartados['Edad_Reg'] <= edad_max)
+            fallan['EDAD_VALIDA'] = [descartados.index[~edad_descartados.to_numpy()], df_clean.index[~edad_valida.to_numpy()]]
+            descartados = pd.concat([descartados, df_clean[~edad_valida]])
+        df_clean = df_clean[edad_valida]
+        if mostrar:
+            print(f"📊 Registros después de validación de edad ({edad_min}-{edad_max}): {len(df_clean):,}")
+    
+    # Regla 3: Validar género
+    generos_validos = validaciones.get('generos_validos', ['M', 'F'])
+    if 'Genero' in df_clean.columns:
+        genero_valido = df_clean['Genero'].isin(generos_validos)
+        if procedencia:
+            fallan['GENERO_VALIDO'] = [descartados.index[~descartados['Genero'].isin(generos_validos).to_numpy()],
+                                       df_clean.index[~genero_valido.to_numpy()]]
+            descartados = pd.concat([descartados, df_clean[~genero_valido]])
+        df_clean = df_clean[genero_valido]
+        if mostrar:
+            print(f"📊 Registros después de validación de género: {len(df_clean):,}")
+    
+    # Regla 4: Validar formato de fecha
+    if 'Fecha_Atencion' in df_clean.columns:
+        # Convertir a datetime y verificar fechas válidas
+        df_clean['Fecha_Atencion'] = pd.to_datetime(df_clean['Fecha_Atencion'], errors='coerce')
+        if procedencia:
+            fecha_descartados = pd.to_datetime(descartados['Fecha_Atencion'], errors='coerce')
+            fallan['FECHA_VALIDA'] = [descartados.index[fecha_descartados.isna().to_numpy()],
+                                      df_clean.index[df_clean['Fecha_Atencion'].isna().to_numpy()]]
+        df_clean = df_clean.dropna(subset=['Fecha_Atencion'])
+        if mostrar:
+            print(f"📊 Registros después de validación de fecha: {len(df_clean):,}")
+    
+    if procedencia:
+        return df_clean, iniciar_procedencia(df_selected.index, fallan)
+    return df_clean
+
+def leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados=None):
+    """
+    Lee el archivo de entrada por bloques de filas sin cargarlo completo en memoria
+    Excel: openpyxl en modo solo lectura (primera hoja, igual que pd.read_excel)
+    CSV (también .csv.gz/.csv.zst): lector por bloques de pandas con descompresión como flujo
+    Parquet: lotes de filas de pyarrow
+    Historial SQLite: consulta por bloques con los predicados del filtro activo
+    """
+    formato = detectar_formato(archivo_entrada)[0]
+    if formato == 'sqlite':
+        yield from leer_historial_por_bloques(archivo_entrada, filas_por_bloque, **(predicados or {}))
+        return
+    if formato == 'csv':
+        yield from leer_csv_por_bloques(archivo_entrada, filas_por_bloque)
+        return
+    if formato == 'parquet':
+        yield from leer_parquet_por_bloques(archivo_entrada, filas_por_bloque)
+        return
+    
+    from openpyxl import load_workbook
+    libro = load_workbook(archivo_entrada, read_only=True, data_only=True)
+    try:
+        filas = libro.worksheets[0].iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        bloque = []
+        for fila in filas:
+            # Las filas completamente vacías no aportan registros
+            if all(valor is None for valor in fila):
+                continue
+            bloque.append(fila)
+            if len(bloque) >= filas_por_bloque:
+                yield pd.DataFrame(bloque, columns=encabezado).infer_objects()
+                bloque = []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=encabezado).infer_objects()
+    finally:
+        libro.close()
+
+def _atomo_codigo(codigo, valores_lab=None):
+    """
+    Átomo de expresión para un código, opcionalmente restringido a valores de laboratorio
+    """
+    condiciones = (('Valor_Lab', '=', tuple(str(v) for v in valores_lab)),) if valores_lab else ()
+    especificacion = ('patron', codigo) if es_patron(codigo) else ('codigo', str(codigo))
+    return ('atomo', Atomo(especificacion, condiciones))
+
+def _arbol_todos(atomos):
+    return atomos[0] if len(atomos) == 1 else ('y', *atomos)
+
+def _arbol_cualquiera(atomos):
+    return atomos[0] if len(atomos) == 1 else ('o', *atomos)
+
+def plan_fuera_de_memoria(config):
+    """
+    Traduce el filtro activo a un plan de evaluación por grupos para el modo fuera de memoria:
+        ambito: 'paciente' | 'visita' | None (filtro solo por registro, sin agrupar)
+        arbol: expresión que debe cumplir el grupo
+        indicadores: {nombre: arbol} con columnas Indicador_<nombre> (solo filtro_expresion)
+        filas: átomos que seleccionan los registros de salida, o None = todos los registros del grupo
+    La semántica de cada rama reproduce la del procesamiento en memoria
+    """
+    if config['filtro_especifico']['activo']:
+        return {'rama': 'especifico', 'ambito': None, 'arbol': None, 'indicadores': {}, 'filas': None}
+    
+    filtro_perimetro = config['filtro_perimetro']
+    if filtro_perimetro['activo']:
+        atomos = [_atomo_codigo(c) for c in filtro_perimetro['codigos_requeridos']]
+        if filtro_perimetro.get('fecha_atencion_activo', False):
+            ambito = 'visita'
+        else:
+            ambito = 'paciente' if filtro_perimetro['modo_filtrado'] == "todos" else None
+        return {'rama': 'perimetro', 'ambito': ambito, 'arbol': _arbol_todos(atomos) if ambito else None,
+                'indicadores': {}, 'filas': [a[1] for a in atomos]}
+    
+    filtro_valoracion = config['filtro_valoracion_clinica']
+    if filtro_valoracion['activo']:
+        # Los registros Z006 solo cuentan si tienen el Valor_Lab específico
+        valor_lab = filtro_valoracion.get('valor_lab_especifico')
+        atomos = [_atomo_codigo(c, valor_lab if str(c) == 'Z006' else None) for c in filtro_valoracion['codigos_requeridos']]
+        if filtro_valoracion.get('fecha_atencion_activo', False):
+            ambito = 'visita'
+        else:
+            ambito = 'paciente' if filtro_valoracion['modo_filtrado'] == "todos" else None
+        return {'rama': 'valoracion', 'ambito': ambito, 'arbol': _arbol_todos(atomos) if ambito else None,
+                'indicadores': {}, 'filas': [a[1] for a in atomos]}
+    
+    filtro_riesgo = config['filtro_valoracion_clinica_con_riesgo']
+    if filtro_riesgo['activo']:
+        requeridos = filtro_riesgo['codigos_requeridos']
+        factores = filtro_riesgo.get('codigos_factores_riesgo', [])
+        if filtro_riesgo.get('fecha_atencion_activo', False):
+            # Por fecha: al menos un requerido Y al menos un factor en la misma visita (sin filtro de Valor_Lab)
+            atomos_req = [_atomo_codigo(c) for c in requeridos]
+            if factores:
+                atomos_riesgo = [_atomo_codigo(c) for c in factores]
+                arbol = ('y', _arbol_cualquiera(atomos_req), _arbol_cualquiera(atomos_riesgo))
+            else:
+                atomos_riesgo = []
+                arbol = _arbol_todos(atomos_req)
+            return {'rama': 'riesgo', 'ambito': 'visita', 'arbol': arbol, 'indicadores': {},
+                    'filas': [a[1] for a in atomos_req + atomos_riesgo]}
+        # Sin fecha: todos los registros de pacientes con algún requerido y algún factor (con Valor_Lab)
+        arbol = _arbol_cualquiera([_atomo_codigo(c) for c in requeridos])
+        if factores:
+            valor_lab = filtro_riesgo.get('valor_lab_especifico')
+            arbol = ('y', arbol, _arbol_cualquiera([_atomo_codigo(c, valor_lab) for c in factores]))
+        return {'rama': 'riesgo', 'ambito': 'paciente', 'arbol': arbol, 'indicadores': {}, 'filas': None}
+    
+    filtro_expresion = config['filtro_expresion']
+    if filtro_expresion['activo']:
+        indicadores = {nombre: parsear_expresion(texto) for nombre, texto in filtro_expresion['indicadores'].items()}
+        if filtro_expresion['expresion']:
+            arbol = parsear_expresion(filtro_expresion['expresion'])
+        else:
+            arbol = ('o', *indicadores.values()) if len(indicadores) > 1 else next(iter(indicadores.values()))
+        filas = None
+        if filtro_expresion['registros'] != "todos":
+            filas = [atomo for atomo, positivo in atomos_de(arbol).items() if positivo]
+        return {'rama': 'expresion', 'ambito': filtro_expresion['ambito'], 'arbol': arbol,
+                'indicadores': indicadores, 'filas': filas}
+    
+    # Filtros básicos: los códigos y valores de laboratorio filtran registros antes de agrupar por paciente
+    obligatorios = config['codigos_item']['obligatorios']
+    opcionales = config['codigos_item']['opcionales']
+    if not obligatorios:
+        return {'rama': 'basico', 'ambito': None, 'arbol': None, 'indicadores': {}, 'filas': None}
+    atomos_obligatorios = [_atomo_codigo(c) for c in obligatorios]
+    if config['filtrado_codigos']['modo'] == "cualquiera":
+        arbol = _arbol_cualquiera(atomos_obligatorios)
+    else:
+        arbol = _arbol_todos(atomos_obligatorios)
+    if opcionales:
+        arbol = ('y', arbol, _arbol_cualquiera([_atomo_codigo(c) for c in opcionales]))
+    return {'rama': 'basico', 'ambito': 'paciente', 'arbol': arbol, 'indicadores': {}, 'filas': None}
+
+def predicados_historial(config):
+    """
+    Predicados que se envían al historial SQLite para leer solo los registros que el filtro activo usa:
+    Tipo_Diagnostico siempre; los códigos cuando la rama evalúa y devuelve solo registros de esos códigos;
+    el rango de fechas del filtro específico
+    """
+    filtro_especifico = config['filtro_especifico']
+    if filtro_especifico['activo']:
+        predicados = {'tipos': list(filtro_especifico['tipo_diagnostico']),
+                      'codigos': [filtro_especifico['codigo_item_especifico']]}
+        if filtro_especifico['fecha_atencion_rango'] and len(filtro_especifico['fecha_atencion_rango']) == 2:
+            predicados['desde'], predicados['hasta'] = filtro_especifico['fecha_atencion_rango']
+        return predicados
+    
+    predicados = {'tipos': [config['configuracion']['tipo_diagnostico']]}
+    plan = plan_fuera_de_memoria(config)
+    if plan['rama'] in ('perimetro', 'valoracion', 'riesgo') and plan['filas'] is not None:
+        predicados['codigos'] = sorted({atomo.codigo[1] for atomo in plan['filas']})
+    elif plan['rama'] == 'basico':
+        todos_codigos = config['codigos_item']['obligatorios'] + config['codigos_item']['opcionales']
+        if todos_codigos:
+            predicados['codigos'] = todos_codigos
+    return predicados
+
+def ajustes_limpieza(config):
+    """
+    Ajustes de la configuración que determinan los registros limpios (PASOS 2 a 6): columnas, validaciones,
+    cohorte, filtro previo (filtro específico o Tipo_Diagnostico) y predicados de lectura del historial
+    """
+    filtro_especifico = config['filtro_especifico']
+    ajustes = {
+        'columnas': config['columnas'],
+        'validaciones': config.get('validaciones', {}),
+        'cohorte': config['cohorte'],
+        'filtro_previo': filtro_especifico if filtro_especifico['activo'] else {'tipo_diagnostico': config['configuracion']['tipo_diagnostico']},
+    }
+    # La presión arterial se clasifica antes de la limpieza: sus umbrales determinan los registros limpios
+    if filtro_especifico['activo'] and filtro_especifico['tipo_presion_arterial_activo']:
+        ajustes['tabla_presion'] = config['tablas_clasificacion']['presion_arterial']
+    if detectar_formato(config['configuracion']['archivo_entrada'])[0] == 'sqlite':
+        ajustes['predicados'] = predicados_historial(config)
+    return ajustes
+
+def cohortes_config(config):
+    """
+    Cohortes de inclusión y exclusión de la configuración como arrays int64 ordenados (None si no hay)
+    Cada archivo se lee una sola vez por ejecución
+    """
+    cohorte = config['cohorte']
+    return tuple(cargar_cohorte(cohorte[clave], cohorte['columna'] or None, cohorte['huellas'][clave]) if cohorte[clave] else None
+                 for clave in ('incluir', 'excluir'))
+
+def _filtrar_bloque(bloque, config):
+    """
+    Equivalente por bloque de los PASOS 2.1 y 3: cohorte, filtro específico (sin presión arterial) o Tipo_Diagnostico
+    """
+    if config['cohorte']['incluir'] or config['cohorte']['excluir']:
+        bloque = bloque[mascara_cohorte(bloque['Numero_Documento_Paciente'], *cohortes_config(config))]
+    filtro_especifico = config['filtro_especifico']
+    if not filtro_especifico['activo']:
+        return bloque[bloque['Tipo_Diagnostico'] == config['configuracion']['tipo_diagnostico']].copy()
+    
+    df_filtered = bloque[
+        (bloque['Tipo_Diagnostico'].isin(filtro_especifico['tipo_diagnostico'])) &
+        (bloque['Codigo_Item'] == filtro_especifico['codigo_item_especifico'])
+    ].copy()
+    if filtro_especifico.get('valor_lab_especifico'):
+        df_filtered = df_filtered[df_filtered['Valor_Lab'].isin(filtro_especifico['valor_lab_especifico'])].copy()
+    if filtro_especifico['fecha_atencion_rango'] and len(filtro_especifico['fecha_atencion_rango']) == 2:
+        fecha_inicio_dt = pd.to_datetime(filtro_especifico['fecha_atencion_rango'][0])
+        fecha_fin_dt = pd.to_datetime(filtro_especifico['fecha_atencion_rango'][1])
+        df_filtered['Fecha_Atencion'] = pd.to_datetime(df_filtered['Fecha_Atencion'])
+        df_filtered = df_filtered[
+            (df_filtered['Fecha_Atencion'] >= fecha_inicio_dt) &
+            (df_filtered['Fecha_Atencion'] <= fecha_fin_dt)
+        ].copy()
+    return df_filtered
+
+def _limpiar_bloque(df_filtered, config, columnas):
+    """
+    Equivalente por bloque de los PASOS 4 a 6 y del prefiltrado de los filtros básicos
+    """
+    df_clean = aplicar_reglas_calidad(df_filtered[columnas].copy(), config.get('validaciones', {}), mostrar=False)
+    
+    ramas_especiales = ['filtro_especifico', 'filtro_perimetro', 'filtro_valoracion_clinica',
+                        'filtro_valoracion_clinica_con_riesgo', 'filtro_expresion']
+    if not any(config[rama]['activo'] for rama in ramas_especiales):
+        todos_codigos = config['codigos_item']['obligatorios'] + config['codigos_item']['opcionales']
+        if todos_codigos:
+            df_clean = df_clean[mascara_codigos(df_clean['Codigo_Item'], todos_codigos)]
+        if config['valores_laboratorio']:
+            df_clean = df_clean[df_clean['Valor_Lab'].isin(config['valores_laboratorio'])]
+    return df_clean
+
+def _claves_visita(df, ambito):
+    """
+    Claves de grupo como array estructurado (paciente, fecha en ns); fecha = 0 si el ámbito es paciente
+    El orden del array estructurado es lexicográfico, por lo que admite np.sort y np.searchsorted
+    """
+    claves = np.empty(len(df), dtype=[('paciente', np.int64), ('fecha', np.int64)])
+    claves['paciente'] = pd.to_numeric(df['Numero_Documento_Paciente']).to_numpy(dtype=np.float64).astype(np.int64)
+    if ambito == 'visita':
+        claves['fecha'] = df['Fecha_Atencion'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+    else:
+        claves['fecha'] = 0
+    return claves
+
+def _reducir_or(claves, bits):
+    """
+    Reduce por clave de grupo con OR bit a bit (claves ordenadas y únicas en la salida)
+    """
+    if len(claves) == 0:
+        return claves, bits
+    orden = np.argsort(claves, kind='stable')
+    claves = claves[orden]
+    bits = bits[orden]
+    inicio = np.flatnonzero(np.r_[True, claves[1:] != claves[:-1]])
+    return claves[inicio], np.bitwise_or.reduceat(bits, inicio)
+
+def _mascara_filas(df, atomos):
+    """
+    Registros que cumplen al menos uno de los átomos (registros de salida del plan)
+    """
+    if not atomos:
+        return np.zeros(len(df), dtype=bool)
+    return np.logical_or.reduce(list(mascaras_atomos(df, atomos).values()))
+
+def _valor_presion(df_filtered, es_sistolica, config):
+    """
+    NORMAL / ANORMAL de cada registro de presión arterial con los umbrales de tablas_clasificacion.presion_arterial
+    """
+    umbral_s, umbral_d = umbrales_presion(df_filtered, construir_tabla('presion_arterial', config['tablas_clasificacion']['presion_arterial']))
+    valor = pd.to_numeric(df_filtered['Valor_Lab'], errors='coerce').to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        anormal = valor >= np.where(es_sistolica, umbral_s, umbral_d)
+    return np.where(anormal, 'ANORMAL', 'NORMAL')
+
+def _estado_presion_bloque(df_filtered, config):
+    """
+    Estado compacto de presión arterial por paciente-fecha para un bloque:
+        id_min: menor Id_Correlativo (registro Sistólico)
+        s_max: 1 si algún registro con Id_Correlativo mínimo alcanza su umbral sistólico, 0 si no
+        d_id_max: mayor Id_Correlativo entre registros que alcanzan su umbral diastólico
+        d_nulo: algún registro sin Id_Correlativo que alcanza su umbral diastólico (siempre Diastólico)
+    Los umbrales de cada registro dependen de su género y banda de edad (tablas_clasificacion.presion_arterial)
+    """
+    paciente = pd.to_numeric(df_filtered['Numero_Documento_Paciente'], errors='coerce')
+    fecha = pd.to_datetime(df_filtered['Fecha_Atencion'], errors='coerce')
+    validos = (paciente.notna() & fecha.notna()).to_numpy()
+    datos = pd.DataFrame({
+        'paciente': paciente.to_numpy(dtype=np.float64)[validos].astype(np.int64),
+        'fecha': fecha.to_numpy(dtype='datetime64[ns]')[validos].view(np.int64),
+        'id': pd.to_numeric(df_filtered['Id_Correlativo'], errors='coerce').to_numpy(dtype=np.float64)[validos],
+        'valor': pd.to_numeric(df_filtered['Valor_Lab'], errors='coerce').to_numpy(dtype=np.float64)[validos]
+    })
+    umbral_s, umbral_d = umbrales_presion(df_filtered, construir_tabla('presion_arterial', config['tablas_clasificacion']['presion_arterial']))
+    with np.errstate(invalid='ignore'):
+        s_anormal = datos['valor'].to_numpy() >= umbral_s[validos]
+        d_anormal = datos['valor'].to_numpy() >= umbral_d[validos]
+    id_min = datos.groupby(['paciente', 'fecha'])['id'].transform('min')
+    datos['s_valor'] = pd.Series(s_anormal.astype(np.float64), index=datos.index).where(datos['id'] == id_min)
+    datos['d_id'] = datos['id'].where(d_anormal)
+    datos['d_nulo'] = datos['id'].isna() & d_anormal
+    return datos.groupby(['paciente', 'fecha']).agg(
+        id_min=('id', 'min'), s_max=('s_valor', 'max'), d_id_max=('d_id', 'max'), d_nulo=('d_nulo', 'any'))
+
+def _combinar_estados_presion(estados):
+    """
+    Combina estados parciales de presión arterial de varios bloques
+    """
+    datos = pd.concat(estados).reset_index()
+    id_min = datos.groupby(['paciente', 'fecha'])['id_min'].transform('min')
+    datos['s_max'] = datos['s_max'].where(datos['id_min'] == id_min)
+    return datos.groupby(['paciente', 'fecha']).agg(
+        id_min=('id_min', 'min'), s_max=('s_max', 'max'), d_id_max=('d_id_max', 'max'), d_nulo=('d_nulo', 'any'))
+
+def _aplicar_presion_bloque(df_filtered, estado, tipos, config):
+    """
+    Asigna tipo_presion, valor_presion y valor_presion_total a un bloque usando el estado global por paciente-fecha
+    """
+    paciente = pd.to_numeric(df_filtered['Numero_Documento_Paciente'], errors='coerce')
+    fecha = pd.to_datetime(df_filtered['Fecha_Atencion'], errors='coerce')
+    claves = pd.MultiIndex.from_arrays([
+        paciente.fillna(-1).to_numpy(dtype=np.float64).astype(np.int64),
+        fecha.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    ])
+    visita = estado.reindex(claves)
+    
+    id_correlativo = pd.to_numeric(df_filtered['Id_Correlativo'], errors='coerce').to_numpy(dtype=np.float64)
+    id_min = visita['id_min'].to_numpy(dtype=np.float64)
+    
+    es_sistolica = id_correlativo == id_min
+    valor_presion = _valor_presion(df_filtered, es_sistolica, config)
+    with np.errstate(invalid='ignore'):
+        total_anormal = (visita['s_max'].to_numpy(dtype=np.float64) == 1) | \
+                        (visita['d_id_max'].to_numpy(dtype=np.float64) > id_min) | \
+                        visita['d_nulo'].fillna(False).to_numpy(dtype=bool)
+    
+    df_filtered = df_filtered.copy()
+    df_filtered['tipo_presion'] = np.where(es_sistolica, 'S', 'D')
+    df_filtered['valor_presion'] = valor_presion
+    df_filtered['valor_presion_total'] = np.where(visita['d_nulo'].notna().to_numpy(),
+                                                  np.where(total_anormal, 'ANORMAL', 'NORMAL'), None)
+    return df_filtered[df_filtered['tipo_presion'].isin(tipos)]
+
+def _mezclar_corridas(rutas):
+    """
+    Mezcla k-vías de los bloques ya ordenados (CSV temporales): genera primero el encabezado y después
+    las filas (listas de texto) en orden de paciente y fecha, leyendo una fila por corrida a la vez
+    """
+    import csv
+    import heapq
+    
+    archivos = [open(ruta, 'r', encoding='utf-8', newline='') for ruta in rutas]
+    try:
+        lectores = [csv.reader(archivo) for archivo in archivos]
+        encabezados = [next(lector) for lector in lectores]
+        encabezado = encabezados[0]
+        i_paciente = encabezado.index('Numero_Documento_Paciente')
+        i_fecha = encabezado.index('Fecha_Atencion')
+        yield encabezado
+        yield from heapq.merge(*lectores, key=lambda fila: (int(fila[i_paciente]), fila[i_fecha]))
+    finally:
+        for archivo in archivos:
+            archivo.close()
+
+def _combinar_corridas(filas, final_file):
+    """
+    Escribe en el archivo final las filas mezcladas por _mezclar_corridas
+    Devuelve (registros escritos, pacientes únicos)
+    """
+    import csv
+    
+    encabezado = next(filas)
+    i_paciente = encabezado.index('Numero_Documento_Paciente')
+    registros = 0
+    pacientes = 0
+    ultimo_paciente = None
+    with open(final_file, 'w', encoding='utf-8', newline='') as salida:
+        escritor = csv.writer(salida, lineterminator='\n')
+        escritor.writerow(encabezado)
+        for fila in filas:
+            escritor.writerow(fila)
+            registros += 1
+            if fila[i_paciente] != ultimo_paciente:
+                pacientes += 1
+                ultimo_paciente = fila[i_paciente]
+    return registros, pacientes
+
+def _reducir_corridas(rutas, carpeta, max_corridas):
+    """
+    Mezcla las corridas en pasadas de a lo sumo max_corridas corridas consecutivas hasta que quedan
+    max_corridas o menos: ninguna mezcla abre más archivos a la vez (límite de archivos abiertos del sistema)
+    Las corridas consecutivas conservan su orden, así las filas con la misma clave quedan como en una sola mezcla
+    """
+    pasada = 0
+    while len(rutas) > max_corridas:
+        pasada += 1
+        mezcladas = []
+        for inicio in range(0, len(rutas), max_corridas):
+            grupo = rutas[inicio:inicio + max_corridas]
+            if len(grupo) == 1:
+                mezcladas.append(grupo[0])
+                continue
+            ruta = os.path.join(carpeta, f"mezcla_{pasada:02d}_{len(mezcladas):05d}.csv")
+            _combinar_corridas(_mezclar_corridas(grupo), ruta)
+            for ruta_grupo in grupo:
+                os.remove(ruta_grupo)
+            mezcladas.append(ruta)
+        print(f"🔀 Mezcla intermedia {pasada}: {len(rutas):,} corridas → {len(mezcladas):,}")
+        rutas = mezcladas
+    return rutas
+
+def procesar_fuera_de_memoria(config, archivo_entrada, final_file, destino=None):
+    """
+    Modo fuera de memoria en dos pasadas por bloques para entradas que no caben en RAM:
+        Pasada 1: limpia cada bloque y acumula por paciente (o paciente-fecha) una máscara de bits
+                  con los códigos presentes (y el estado de presión arterial si aplica)
+        Pasada 2: vuelve a leer la entrada y escribe solo los registros de los grupos que cumplen,
+                  en bloques ordenados que al final se mezclan en el archivo de salida (en varias pasadas
+                  de max_corridas_mezcla corridas si hay más)
+    La memoria máxima depende del número de pacientes/visitas, no del número de registros
+    Con destino (función que recibe el generador de _mezclar_corridas y devuelve (registros, pacientes))
+    las filas mezcladas se entregan a esa función en lugar de escribir final_file (flujo por paciente)
+    """
+    import shutil
+    import tempfile
+    
+    opciones = config['fuera_de_memoria']
+    filas_por_bloque = opciones['filas_por_bloque']
+    filtro_especifico = config['filtro_especifico']
+    presion_activa = filtro_especifico['activo'] and filtro_especifico['tipo_presion_arterial_activo']
+    
+    plan = plan_fuera_de_memoria(config)
+    ambito = plan['ambito']
+    arboles = [plan['arbol']] + list(plan['indicadores'].values()) if ambito else []
+    atomos = []
+    for arbol in arboles:
+        for atomo in atomos_de(arbol):
+            if atomo not in atomos:
+                atomos.append(atomo)
+    if tiene_temporales(atomos):
+        # Los pares de una ventana temporal pueden quedar en bloques distintos
+        print(f"❌ Error: Los predicados temporales (THEN ... WITHIN) no están soportados en modo fuera de memoria")
+        return False
+    if len(atomos) > 64:
+        print(f"❌ Error: El modo fuera de memoria admite hasta 64 códigos distintos por filtro ({len(atomos)} configurados)")
+        return False
+    
+    columnas = list(config['columnas'])
+    if presion_activa:
+        columnas = columnas + ['tipo_presion', 'valor_presion', 'valor_presion_total']
+    
+    print(f"\n💽 Modo fuera de memoria: bloques de {filas_por_bloque:,} filas")
+    print(f"   Filtro: {plan['rama']}")
+    if ambito:
+        print(f"   Agrupación: {'paciente y fecha de atención' if ambito == 'visita' else 'paciente'} ({len(atomos)} códigos en máscara de bits)")
+    else:
+        print(f"   Agrupación: ninguna (filtro por registro)")
+    
+    # PASADA 1: máscaras de bits por grupo y estado de presión arterial
+    claves_grupo = np.empty(0, dtype=[('paciente', np.int64), ('fecha', np.int64)])
+    bits_grupo = np.empty(0, dtype=np.uint64)
+    pendientes = []
+    estado_presion = None
+    estados_presion = []
+    registros_leidos = 0
+    bloques = 0
+    
+    if ambito or presion_activa:
+        print(f"\n📊 Pasada 1: acumulando estado por {'paciente-fecha' if ambito == 'visita' or presion_activa else 'paciente'}...")
+        for bloque in leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados_historial(config)):
+            bloques += 1
+            registros_leidos += len(bloque)
+            df_filtered = _filtrar_bloque(bloque, config)
+            
+            if presion_activa:
+                estados_presion.append(_estado_presion_bloque(df_filtered, config))
+                if sum(len(e) for e in estados_presion) > filas_por_bloque:
+                    estados_presion = [_combinar_estados_presion(estados_presion)]
+                continue
+            
+            df_clean = _limpiar_bloque(df_filtered, config, columnas)
+            mascaras = mascaras_atomos(df_clean, atomos)
+            bits = np.zeros(len(df_clean), dtype=np.uint64)
+            for posicion, atomo in enumerate(atomos):
+                bits |= mascaras[atomo].astype(np.uint64) << np.uint64(posicion)
+            presentes = bits != 0
+            pendientes.append(_reducir_or(_claves_visita(df_clean[presentes], ambito), bits[presentes]))
+            
+            # Se combinan los parciales cuando superan al estado acumulado (costo amortizado)
+            if sum(len(c) for c, _ in pendientes) > max(len(claves_grupo), filas_por_bloque):
+                claves_grupo, bits_grupo = _reducir_or(
+                    np.concatenate([claves_grupo] + [c for c, _ in pendientes]),
+                    np.concatenate([bits_grupo] + [b for _, b in pendientes]))
+                pendientes = []
+        
+        if presion_activa:
+            estado_presion = _combinar_estados_presion(estados_presion) if estados_presion else None
+            print(f"📊 Registros leídos: {registros_leidos:,} en {bloques:,} bloques")
+            print(f"📊 Grupos (paciente-fecha) de presión arterial: {len(estado_presion) if estado_presion is not None else 0:,}")
+        else:
+            if pendientes:
+                claves_grupo, bits_grupo = _reducir_or(
+                    np.concatenate([claves_grupo] + [c for c, _ in pendientes]),
+                    np.concatenate([bits_grupo] + [b for _, b in pendientes]))
+            presencia = {atomo: ((bits_grupo >> np.uint64(posicion)) & np.uint64(1)).astype(bool)
+                         for posicion, atomo in enumerate(atomos)}
+            grupos_validos = evaluar_arbol(plan['arbol'], presencia)
+            indicadores = {nombre: evaluar_arbol(arbol, presencia) for nombre, arbol in plan['indicadores'].items()}
+            nombre_grupo = "Grupos (paciente-fecha)" if ambito == 'visita' else "Pacientes"
+            print(f"📊 Registros leídos: {registros_leidos:,} en {bloques:,} bloques")
+            print(f"📊 {nombre_grupo} con algún código del filtro: {len(claves_grupo):,}")
+            print(f"📊 {nombre_grupo} que cumplen el filtro: {int(grupos_validos.sum()):,}")
+            memoria_estado = claves_grupo.nbytes + bits_grupo.nbytes
+            print(f"📊 Memoria del estado por grupo: {memoria_estado / 1024 / 1024:,.1f} MB")
+    
+    # PASADA 2: escribir solo los registros de los grupos que cumplen, en corridas ordenadas
+    print(f"\n📊 Pasada 2: seleccionando registros...")
+    directorio_temporal = opciones['directorio_temporal']
+    if directorio_temporal:
+        os.makedirs(directorio_temporal, exist_ok=True)
+    carpeta_corridas = tempfile.mkdtemp(prefix="corridas_", dir=directorio_temporal)
+    try:
+        rutas = []
+        registros_leidos = 0
+        conteo_codigos = {}
+        fecha_min = None
+        fecha_max = None
+        for bloque in leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados_historial(config)):
+            registros_leidos += len(bloque)
+            df_filtered = _filtrar_bloque(bloque, config)
+            if presion_activa:
+                if estado_presion is None:
+                    continue
+                df_filtered = _aplicar_presion_bloque(df_filtered, estado_presion, filtro_especifico['tipo_presion_arterial'], config)
+            df_clean = _limpiar_bloque(df_filtered, config, columnas)
+            
+            if ambito:
+                claves = _claves_visita(df_clean, ambito)
+                posicion = np.searchsorted(claves_grupo, claves)
+                posicion_valida = np.minimum(posicion, max(len(claves_grupo) - 1, 0))
+                encontrado = (posicion < len(claves_grupo)) & (claves_grupo[posicion_valida] == claves) if len(claves_grupo) else np.zeros(len(claves), dtype=bool)
+                mascara = encontrado.copy()
+                mascara[encontrado] = grupos_validos[posicion_valida[encontrado]]
+                if plan['filas'] is not None:
+                    mascara &= _mascara_filas(df_clean, plan['filas'])
+                df_bloque = df_clean[mascara].copy()
+                for nombre, resultado in indicadores.items():
+                    df_bloque[f"Indicador_{nombre}"] = resultado[posicion_valida[mascara]]
+            elif plan['filas'] is not None:
+                df_bloque = df_clean[_mascara_filas(df_clean, plan['filas'])].copy()
+            else:
+                df_bloque = df_clean.copy()
+            
+            if len(df_bloque) == 0:
+                continue
+            if plan['rama'] == 'perimetro':
+                df_bloque = classify_perimeter_abdominal(df_bloque, config, mostrar=False)
+            
+            df_bloque['Numero_Documento_Paciente'] = df_bloque['Numero_Documento_Paciente'].astype('Int64')
+            if config['configuracion']['entrada_ordenada'] is False or not esta_ordenado(df_bloque):
+                df_bloque = df_bloque.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'])
+            ruta = os.path.join(carpeta_corridas, f"corrida_{len(rutas):05d}.csv")
+            df_bloque.to_csv(ruta, index=False, encoding='utf-8')
+            rutas.append(ruta)
+            
+            for code, count in df_bloque['Codigo_Item'].value_counts().items():
+                conteo_codigos[code] = conteo_codigos.get(code, 0) + count
+            fecha_min = min(fecha_min, df_bloque['Fecha_Atencion'].min()) if fecha_min is not None else df_bloque['Fecha_Atencion'].min()
+            fecha_max = max(fecha_max, df_bloque['Fecha_Atencion'].max()) if fecha_max is not None else df_bloque['Fecha_Atencion'].max()
+        
+        print(f"📊 Registros leídos: {registros_leidos:,}")
+        print(f"📊 Corridas ordenadas a combinar: {len(rutas):,}")
+        rutas = _reducir_corridas(rutas, carpeta_corridas, opciones['max_corridas_mezcla'])
+        
+        if destino is not None:
+            # Mezcla final entregada por paciente, sin archivo de salida
+            print(f"\n📤 Entregando los registros por paciente a medida que se mezclan las corridas...")
+            registros_finales, pacientes_unicos = destino(_mezclar_corridas(rutas)) if rutas else (0, 0)
+            final_file = "(flujo por paciente, sin archivo)"
+        else:
+            # Mezcla final de las corridas en el archivo de salida
+            print(f"\n💾 Guardando archivo final: {final_file}")
+            if os.path.exists(final_file):
+                os.remove(final_file)
+            if rutas:
+                registros_finales, pacientes_unicos = _combinar_corridas(_mezclar_corridas(rutas), final_file)
+            else:
+                pd.DataFrame(columns=columnas).to_csv(final_file, index=False, encoding='utf-8')
+                registros_finales, pacientes_unicos = 0, 0
+    finally:
+        shutil.rmtree(carpeta_corridas, ignore_errors=True)
+    
+    if destino is None:
+        file_size = os.path.getsize(final_file)
+        print(f"✅ Archivo final creado exitosamente ({file_size:,} bytes)")
+    
+    print(f"\n📊 Distribución final de códigos:")
+    for code, count in sorted(conteo_codigos.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {code}: {count:,} registros")
+    if len(conteo_codigos) > 10:
+        print(f"  ... y {len(conteo_codigos) - 10} códigos más")
+    
+    print(f"\n{'='*80}")
+    print("📊 RESUMEN FINAL DEL PROCESAMIENTO (FUERA DE MEMORIA)")
+    print(f"{'='*80}")
+    print(f"✅ Archivo original: {archivo_entrada}")
+    print(f"✅ Registros originales: {registros_leidos:,}")
+    print(f"✅ Filtro aplicado: {plan['rama']}")
+    print(f"✅ Registros finales: {registros_finales:,}")
+    print(f"👥 Pacientes únicos en el dataset final: {pacientes_unicos:,}")
+    mostrar_escala_muestra(archivo_entrada, registros_finales, pacientes_unicos)
+    if fecha_min is not None:
+        print(f"📅 Rango de fechas de atención: {fecha_min} a {fecha_max}")
+    print(f"✅ Archivo final: {final_file}")
+    if registros_leidos:
+        print(f"📈 Reducción total de registros: {((registros_leidos - registros_finales) / registros_leidos) * 100:.2f}%")
+    print(f"{'='*80}")
+    return True
+
+def describir_plan(config, plan):
+    """
+    Etapas del procesamiento para la configuración activa (plan de --explain)
+    """
+    filtro_especifico = config['filtro_especifico']
+    validaciones = config.get('validaciones', {})
+    etapas = []
+    
+    motor = "fuera de memoria (dos pasadas por bloques)" if config['fuera_de_memoria']['activo'] else "en memoria"
+    etapas.append(f"Lectura de {config['configuracion']['archivo_entrada']} ({motor})")
+    if filtro_especifico['activo']:
+        descripcion = (f"Filtro específico: Tipo_Diagnostico en {filtro_especifico['tipo_diagnostico']}, "
+                       f"Codigo_Item = {filtro_especifico['codigo_item_especifico']}")
+        if filtro_especifico.get('valor_lab_especifico'):
+            descripcion += f", Valor_Lab en {filtro_especifico['valor_lab_especifico']}"
+        if filtro_especifico['fecha_atencion_rango']:
+            descripcion += f", fechas {filtro_especifico['fecha_atencion_rango'][0]} a {filtro_especifico['fecha_atencion_rango'][1]}"
+        etapas.append(descripcion)
+        if filtro_especifico['tipo_presion_arterial_activo']:
+            etapas.append(f"Presión arterial por visita (paciente-fecha): tipos {filtro_especifico['tipo_presion_arterial']}")
+    else:
+        etapas.append(f"Filtro Tipo_Diagnostico = '{config['configuracion']['tipo_diagnostico']}'")
+    etapas.append(f"Selección de {len(config['columnas'])} columnas y reglas de calidad (edad {validaciones.get('edad_minima', 0)}-"
+                  f"{validaciones.get('edad_maxima', 120)}, géneros {validaciones.get('generos_validos', ['M', 'F'])}, fecha válida)")
+    
+    if plan['ambito']:
+        agrupacion = 'paciente y fecha de atención' if plan['ambito'] == 'visita' else 'paciente'
+        etapas.append(f"Filtro {plan['rama']}: grupos por {agrupacion} que cumplen {describir_arbol(plan['arbol'])}")
+    elif plan['rama'] != 'especifico':
+        etapas.append(f"Filtro {plan['rama']}: por registro, sin agrupar")
+    for nombre, arbol in plan['indicadores'].items():
+        etapas.append(f"Indicador_{nombre}: {describir_arbol(arbol)}")
+    if plan['filas'] is not None:
+        etapas.append(f"Registros de salida: {', '.join(describir_atomo(atomo) for atomo in plan['filas'])}")
+    if plan['rama'] == 'perimetro':
+        etapas.append("Clasificación de perímetro abdominal (Clasificacion_Perimetro)")
+    etapas.append(f"Orden por paciente y fecha (se omite si la entrada ya está ordenada) y guardado en CSV")
+    return etapas
+
+def _evaluar_plan(df_clean, plan, con_indicadores=False):
+    """
+    Máscara por fila de los registros que el plan conserva (misma semántica que las ramas en memoria)
+    Con con_indicadores=True devuelve (máscara, {nombre: valor del indicador por fila})
+    """
+    indicadores = {}
+    if not plan['ambito']:
+        if plan['filas'] is None:
+            mascara = np.ones(len(df_clean), dtype=bool)
+        else:
+            mascara = _mascara_filas(df_clean, plan['filas'])
+        return (mascara, indicadores) if con_indicadores else mascara
+    arboles = [plan['arbol']] + list(plan['indicadores'].values())
+    atomos = list(dict.fromkeys(atomo for arbol in arboles for atomo in atomos_de(arbol)))
+    ids, n_grupos, inicios = ids_grupo(df_clean, plan['ambito'])
+    mascaras = mascaras_atomos(df_clean, atomos)
+    presencia = {atomo: presencia_por_grupo(mascara, ids, n_grupos, inicios) for atomo, mascara in mascaras.items()}
+    mascara = evaluar_arbol(plan['arbol'], presencia)[ids]
+    if plan['filas'] is not None:
+        mascara &= _mascara_filas(df_clean, plan['filas'])
+    if con_indicadores:
+        indicadores = {nombre: evaluar_arbol(arbol, presencia)[ids] for nombre, arbol in plan['indicadores'].items()}
+        return mascara, indicadores
+    return mascara
+
+def explicar_procesamiento(fraccion=0.05, max_filas=50000, semilla=0):
+    """
+    Modo --explain: muestra el plan de etapas de la configuración activa y estima, a partir de una
+    muestra determinista de pacientes completos, cuántos registros y pacientes conserva cada etapa
+    y cuánto tardará. CSV, Parquet y el historial SQLite se recorren completos por bloques (solo se conserva
+    la muestra), así los pacientes de la muestra están completos aunque la entrada no esté ordenada; en Excel,
+    con max_filas > 0 solo se exploran las primeras filas del archivo
+    """
+    import io
+    import time
+    
+    print("=" * 80)
+    print("🔍 PROCESADOR DE DATOS MÉDICOS - PLAN Y ESTIMACIÓN (--explain)")
+    print("=" * 80)
+    config = load_config()
+    if config is None:
+        return False
+    archivo_entrada = config['configuracion']['archivo_entrada']
+    if not os.path.exists(archivo_entrada):
+        print(f"❌ Error: El archivo {archivo_entrada} no existe")
+        return False
+    
+    try:
+        plan = plan_fuera_de_memoria(config)
+    except ErrorExpresion as e:
+        print(f"❌ Error en expresión de filtro_expresion: {e}")
+        return False
+    
+    print(f"\n📋 PLAN DE ETAPAS:")
+    for numero, etapa in enumerate(describir_plan(config, plan), 1):
+        print(f"  {numero}. {etapa}")
+    
+    # Muestra: pacientes elegidos por hash del documento (pacientes completos, siempre los mismos)
+    formato = detectar_formato(archivo_entrada)[0]
+    if max_filas and formato in FORMATOS_RECORRIDO_COMPLETO:
+        print(f"\n📖 Entrada {formato}: se recorre completa por bloques para que los pacientes de la muestra estén completos")
+        max_filas = 0
+    print(f"\n🎲 Muestra determinista de pacientes: {fraccion:.1%} (semilla {semilla})"
+          + (f", explorando hasta {max_filas:,} filas" if max_filas else ", explorando el archivo completo"))
+    total_estimado, exacto = estimar_filas(archivo_entrada)
+    filas_por_bloque = min(max_filas, 50000) if max_filas else 50000
+    bloques = []
+    filas_exploradas = 0
+    inicio = time.perf_counter()
+    for bloque in leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados_historial(config)):
+        if max_filas:
+            bloque = bloque.iloc[:max_filas - filas_exploradas]
+        filas_exploradas += len(bloque)
+        bloques.append(bloque[mascara_muestra(bloque['Numero_Documento_Paciente'], fraccion, semilla)])
+        if max_filas and filas_exploradas >= max_filas:
+            break
+    segundos_lectura = time.perf_counter() - inicio
+    df = pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame(columns=config['columnas'])
+    
+    truncado = bool(max_filas) and filas_exploradas >= max_filas and total_estimado != filas_exploradas
+    if not truncado:
+        total_estimado, exacto = filas_exploradas, True
+    elif total_estimado is None:
+        total_estimado = filas_exploradas
+        print(f"⚠️  No se puede estimar el total de filas de este formato sin leerlo: las estimaciones son un mínimo")
+    print(f"📊 Filas exploradas: {filas_exploradas:,} de {'' if exacto else '~'}{total_estimado:,} en {segundos_lectura:.2f} s")
+    print(f"📊 Registros en la muestra: {len(df):,} ({df['Numero_Documento_Paciente'].nunique():,} pacientes)")
+    if truncado:
+        print(f"⚠️  Solo se exploró el inicio del archivo: si no está ordenado por paciente, los pacientes con registros")
+        print(f"   posteriores quedan incompletos en la muestra (use --max-filas 0 para explorar el archivo completo)")
+        print(f"   Por eso {SELECTIVIDAD_COTA_INFERIOR}")
+    if len(df) == 0:
+        print(f"⚠️  La muestra está vacía: aumente --muestra")
+        return True
+    
+    # Factor de extrapolación: registros totales / registros de la muestra
+    factor = total_estimado / len(df)
+    etapas = [('Lectura', df, segundos_lectura * total_estimado / max(filas_exploradas, 1) / factor)]
+    
+    inicio = time.perf_counter()
+    df_etapa = _filtrar_bloque(df, config)
+    filtro_especifico = config['filtro_especifico']
+    columnas = list(config['columnas'])
+    if filtro_especifico['activo'] and filtro_especifico['tipo_presion_arterial_activo']:
+        estado = _estado_presion_bloque(df_etapa, config)
+        df_etapa = _aplicar_presion_bloque(df_etapa, estado, filtro_especifico['tipo_presion_arterial'], config)
+        columnas = columnas + ['tipo_presion', 'valor_presion', 'valor_presion_total']
+    etapas.append(('Filtro de registros', df_etapa, time.perf_counter() - inicio))
+    
+    inicio = time.perf_counter()
+    df_etapa = _limpiar_bloque(df_etapa, config, columnas)
+    etapas.append(('Limpieza', df_etapa, time.perf_counter() - inicio))
+    
+    inicio = time.perf_counter()
+    df_etapa = df_etapa[_evaluar_plan(df_etapa, plan)].copy()
+    if plan['rama'] == 'perimetro':
+        df_etapa = classify_perimeter_abdominal(df_etapa, config, mostrar=False)
+    etapas.append((f"Filtro {plan['rama']}", df_etapa, time.perf_counter() - inicio))
+    
+    inicio = time.perf_counter()
+    if not esta_ordenado(df_etapa):
+        df_etapa = df_etapa.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'])
+    df_etapa.to_csv(io.StringIO(), index=False)
+    etapas.append(('Orden y guardado', df_etapa, time.perf_counter() - inicio))
+    
+    filas = []
+    anterior = None
+    for nombre, df_e, segundos in etapas:
+        registros = len(df_e)
+        pacientes = df_e['Numero_Documento_Paciente'].nunique() if registros else 0
+        filas.append({
+            'etapa': nombre,
+            'registros_muestra': registros,
+            'pacientes_muestra': pacientes,
+            'selectividad': f"{registros / anterior:.1%}" if anterior else "-",
+            'registros_estimados': int(round(registros * factor)),
+            'pacientes_estimados': int(round(pacientes * factor)),
+            'segundos_estimados': round(segundos * factor, 2),
+        })
+        anterior = registros
+    tabla = pd.DataFrame(filas)
+    print(f"\n📊 ESTIMACIÓN POR ETAPA (muestra x {factor:,.1f}):")
+    print(tabla.to_string(index=False))
+    total = tabla['segundos_estimados'].sum()
+    etapa_lenta = tabla.loc[tabla['segundos_estimados'].idxmax(), 'etapa']
+    print(f"\n⏱️  Tiempo total estimado: {total:,.1f} s ({total / 60:,.1f} min); etapa más costosa: {etapa_lenta}")
+    print(f"ℹ️  Los pacientes estimados escalan la muestra linealmente; el tiempo de lectura usa la velocidad medida")
+    if truncado:
+        print(f"⚠️  Muestra del inicio del archivo (pacientes posiblemente incompletos): {SELECTIVIDAD_COTA_INFERIOR}")
+    return True
+
+def _procesar_pacientes(df, config, plan, columnas_base):
+    """
+    Cadena por bloques del modo fuera de memoria aplicada a pacientes completos (--preview):
+    devuelve (filtrados, limpios, resultado)
+    """
+    filtro_especifico = config['filtro_especifico']
+    columnas = list(columnas_base)
+    df_filtered = _filtrar_bloque(df, config)
+    if filtro_especifico['activo'] and filtro_especifico['tipo_presion_arterial_activo']:
+        estado = _estado_presion_bloque(df_filtered, config)
+        df_filtered = _aplicar_presion_bloque(df_filtered, estado, filtro_especifico['tipo_presion_arterial'], config)
+        columnas = columnas + ['tipo_presion', 'valor_presion', 'valor_presion_total']
+    df_clean = _limpiar_bloque(df_filtered, config, columnas)
+    mascara, indicadores = _evaluar_plan(df_clean, plan, con_indicadores=True)
+    df_resultado = df_clean[mascara].copy()
+    for nombre, valores in indicadores.items():
+        df_resultado[f"Indicador_{nombre}"] = valores[mascara]
+    if plan['rama'] == 'perimetro':
+        df_resultado = classify_perimeter_abdominal(df_resultado, config, mostrar=False)
+    return df_filtered, df_clean, df_resultado
+
+def _ampliar(valores, filas, capacidad):
+    """Copia las primeras filas de un array (de numpy o de pandas, p. ej. str) en otro de mayor capacidad"""
+    if isinstance(valores, np.ndarray):
+        nuevo = np.empty(capacidad, dtype=valores.dtype)
+        nuevo[:filas] = valores[:filas]
+        return nuevo
+    return valores.take(np.append(np.arange(filas), np.full(capacidad - filas, -1)), allow_fill=True)
+
+def _nuevo_acumulado():
+    """Estado de la vista previa sin orden: filas leídas por columna, índice de pacientes y evaluaciones vigentes"""
+    return {'filas': 0, 'bytes_fila': None, 'paso': 0, 'columnas': {}, 'tipos': {}, 'tramos': [],
+            'ultima': np.empty(0, dtype=np.int32),
+            'partes': {'filtrados': [], 'limpios': [], 'resultado': []},
+            'salida': {'filtrados': np.empty(0, dtype=bool), 'limpios': np.empty(0, dtype=bool), 'resultado': np.empty(0, dtype=bool)},
+            'vivas': {'filtrados': 0, 'limpios': 0, 'resultado': 0},
+            'guardadas': {'filtrados': 0, 'limpios': 0, 'resultado': 0}}
+
+def _tramo_indice(documentos, posiciones):
+    """Tramo del índice paciente -> posiciones: posiciones ordenadas por paciente y el inicio de cada paciente"""
+    orden = np.argsort(documentos, kind='stable')
+    documentos = documentos[orden]
+    unicos, inicios = np.unique(documentos, return_index=True)
+    return {'documentos': documentos, 'posiciones': posiciones[orden], 'unicos': unicos,
+            'inicios': np.append(inicios, len(documentos))}
+
+def _anexar_filas(acumulado, bloque, documentos):
+    """
+    Vista previa sin orden: agrega solo las filas nuevas del bloque a los arrays por columna del acumulado (la
+    capacidad se duplica al llenarse, las filas anteriores no se vuelven a copiar en cada bloque) y al índice
+    paciente -> posiciones, formado por tramos ordenados que se combinan al igualarse en tamaño (cada fila se
+    reordena un número logarítmico de veces). documentos: documento numérico de cada fila, la misma clave de
+    paciente que usa el procesamiento. Devuelve los documentos distintos del bloque (ordenados) y las posiciones de
+    las filas sin documento válido, que no pertenecen a ningún paciente y solo se evalúan en su bloque
+    """
+    inicio = acumulado['filas']
+    fin = inicio + len(bloque)
+    capacidad = len(acumulado['ultima'])
+    if fin > capacidad:
+        capacidad = max(fin, 2 * capacidad)
+        for columna, valores in acumulado['columnas'].items():
+            acumulado['columnas'][columna] = _ampliar(valores, inicio, capacidad)
+        acumulado['ultima'] = _ampliar(acumulado['ultima'], inicio, capacidad)
+        for nombre, salida in acumulado['salida'].items():
+            acumulado['salida'][nombre] = _ampliar(salida, inicio, capacidad)
+    acumulado['ultima'][inicio:fin] = -1
+    for salida in acumulado['salida'].values():
+        salida[inicio:fin] = False
+    if acumulado['bytes_fila'] is None and len(bloque):
+        # Memoria por fila medida una sola vez (memory_usage profundo recorre todas las cadenas)
+        acumulado['bytes_fila'] = bloque.memory_usage(deep=True, index=False).sum() / len(bloque)
+    
+    for columna in bloque.columns:
+        serie = bloque[columna]
+        # Los arrays de pandas (str, Int64...) se guardan tal cual: tomar filas no vuelve a inferir ni validar tipos
+        valores = serie.to_numpy() if isinstance(serie.dtype, np.dtype) else serie.array
+        actual = acumulado['columnas'].get(columna)
+        if actual is None:
+            actual = _ampliar(valores, 0, capacidad)
+            acumulado['tipos'][columna] = serie.dtype
+        elif acumulado['tipos'][columna] != serie.dtype:
+            # Tipos distintos entre bloques: como pd.concat, los numéricos se promueven y el resto pasa a object
+            tipo = acumulado['tipos'][columna]
+            numericos = all(isinstance(t, np.dtype) and t.kind in 'iuf' for t in (tipo, serie.dtype))
+            comun = np.promote_types(tipo, serie.dtype) if numericos else np.dtype(object)
+            actual = np.asarray(actual).astype(comun)
+            valores = np.asarray(valores).astype(comun)
+            acumulado['tipos'][columna] = comun
+        actual[inicio:fin] = valores
+        acumulado['columnas'][columna] = actual
+    acumulado['filas'] = fin
+    
+    posiciones = np.arange(inicio, fin)
+    con_documento = ~np.isnan(documentos)
+    tramos = acumulado['tramos']
+    tramos.append(_tramo_indice(documentos[con_documento], posiciones[con_documento]))
+    while len(tramos) > 1 and len(tramos[-2]['documentos']) <= 2 * len(tramos[-1]['documentos']):
+        ultimo = tramos.pop()
+        anterior = tramos.pop()
+        tramos.append(_tramo_indice(np.concatenate([anterior['documentos'], ultimo['documentos']]),
+                                    np.concatenate([anterior['posiciones'], ultimo['posiciones']])))
+    return np.unique(documentos[con_documento]), posiciones[~con_documento]
+
+def _filas_pacientes(acumulado, documentos, sin_documento):
+    """Filas leídas hasta ahora de los pacientes indicados (documentos ordenados), con índice = posición en la entrada"""
+    encontradas = [sin_documento]
+    for tramo in acumulado['tramos']:
+        unicos = tramo['unicos']
+        if len(unicos) == 0:
+            continue
+        donde = np.minimum(np.searchsorted(unicos, documentos), len(unicos) - 1)
+        donde = donde[unicos[donde] == documentos]
+        desde = tramo['inicios'][donde]
+        largos = tramo['inicios'][donde + 1] - desde
+        # Expande los rangos [desde, desde + largo) de cada paciente
+        indices = np.repeat(desde - np.cumsum(largos) + largos, largos) + np.arange(largos.sum())
+        encontradas.append(tramo['posiciones'][indices])
+    posiciones = np.sort(np.concatenate(encontradas))
+    filas = pd.DataFrame({columna: valores.take(posiciones) for columna, valores in acumulado['columnas'].items()},
+                         index=posiciones, copy=False)
+    tipos = {columna: tipo for columna, tipo in acumulado['tipos'].items() if filas[columna].dtype != tipo}
+    return filas.astype(tipos) if tipos else filas
+
+def _reemplazar_evaluacion(acumulado, posiciones, partes_bloque):
+    """
+    Registra la nueva evaluación de los pacientes de las posiciones indicadas: sus filas de evaluaciones
+    anteriores quedan obsoletas y las partes se compactan cuando las obsoletas superan a las vigentes, así
+    solo se conserva (a lo sumo el doble de) la última evaluación de cada paciente
+    """
+    acumulado['paso'] += 1
+    paso = acumulado['paso']
+    ultima = acumulado['ultima']
+    ultima[posiciones] = paso
+    for nombre, parte in zip(acumulado['partes'], partes_bloque):
+        salida = acumulado['salida'][nombre]
+        indice = parte.index.to_numpy(dtype=np.int64)
+        obsoletas = int(salida[posiciones].sum())
+        salida[posiciones] = False
+        salida[indice] = True
+        acumulado['vivas'][nombre] += len(parte) - obsoletas
+        acumulado['guardadas'][nombre] += len(parte)
+        partes = acumulado['partes'][nombre]
+        partes.append((parte, np.full(len(parte), paso, dtype=np.int32)))
+        if acumulado['guardadas'][nombre] > 2 * acumulado['vivas'][nombre]:
+            partes[:] = [_compactar(partes, ultima)]
+            acumulado['guardadas'][nombre] = acumulado['vivas'][nombre]
+
+def _compactar(partes, ultima):
+    """Une las partes conservando solo las filas de la última evaluación de cada paciente"""
+    vigentes = []
+    pasos = []
+    for parte, pasos_parte in partes:
+        mascara = ultima[parte.index.to_numpy(dtype=np.int64)] == pasos_parte
+        vigentes.append(parte[mascara])
+        pasos.append(pasos_parte[mascara])
+    return pd.concat(vigentes), np.concatenate(pasos)
+
+def vista_previa(n_pacientes=200, filas_mostradas=50, memoria_mb=1024):
+    """
+    Modo --preview N: procesa la entrada por bloques y se detiene en cuanto hay N pacientes completos en el
+    resultado. No ordena el resultado global ni escribe el CSV: muestra los registros y las estadísticas.
+    Con la entrada ordenada por paciente (historial SQLite, archivos ya ordenados) un paciente está completo
+    cuando aparece el siguiente, así el resultado de cada paciente es el mismo que en la ejecución completa;
+    sin orden, se guardan las filas leídas con un índice paciente -> posiciones y cada bloque vuelve a evaluar
+    únicamente los pacientes que aparecen en él (con sus filas anteriores), reemplazando su evaluación anterior:
+    los pacientes solo están completos respecto de las filas leídas hasta el momento. Si el desorden aparece
+    después del primer bloque, la lectura se reinicia sin suponer orden. memoria_mb limita las filas guardadas
+    sin orden: al superarlo la vista previa se detiene con los pacientes evaluados hasta ese momento
+    """
+    import time
+    
+    print("=" * 80)
+    print(f"👀 PROCESADOR DE DATOS MÉDICOS - VISTA PREVIA (--preview {n_pacientes})")
+    print("=" * 80)
+    config = load_config()
+    if config is None:
+        return False
+    archivo_entrada = config['configuracion']['archivo_entrada']
+    if not os.path.exists(archivo_entrada):
+        print(f"❌ Error: El archivo {archivo_entrada} no existe")
+        return False
+    try:
+        plan = plan_fuera_de_memoria(config)
+    except ErrorExpresion as e:
+        print(f"❌ Error en expresión de filtro_expresion: {e}")
+        return False
+    
+    filas_por_bloque = min(config['fuera_de_memoria']['filas_por_bloque'], 50000)
+    total_estimado, exacto = estimar_filas(archivo_entrada)
+    print(f"\n📊 Buscando {n_pacientes:,} pacientes en {archivo_entrada} (bloques de {filas_por_bloque:,} filas)...")
+    
+    inicio = time.perf_counter()
+    ordenada = True
+    while True:
+        reiniciar = False
+        pendiente = None
+        acumulado = None
+        detenida = False
+        aprobados = set()
+        partes = {'filtrados': [], 'limpios': [], 'resultado': []}
+        filas_leidas = 0
+        pacientes = 0
+        bloques = leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados_historial(config))
+        try:
+            for bloque in bloques:
+                # Índice = posición de la fila en la entrada: los resultados conservan el orden de la entrada
+                bloque.index = pd.RangeIndex(filas_leidas, filas_leidas + len(bloque))
+                filas_leidas += len(bloque)
+                if pendiente is not None:
+                    bloque = pd.concat([pendiente, bloque])
+                documentos = pd.to_numeric(bloque['Numero_Documento_Paciente'], errors='coerce').to_numpy(dtype=np.float64)
+                if ordenada:
+                    # Orden por paciente (los documentos nulos se descartan en la limpieza y no cuentan)
+                    validos = documentos[~np.isnan(documentos)]
+                    if not (validos[1:] >= validos[:-1]).all():
+                        ordenada = False
+                        print(f"⚠️  La entrada no está ordenada por paciente: los pacientes solo están completos respecto de las filas leídas")
+                        if bloque.index[0] > 0 or pendiente is not None:
+                            # Los bloques anteriores se procesaron como ordenados sin guardar sus filas
+                            print(f"🔄 Reiniciando la lectura sin suponer orden...")
+                            reiniciar = True
+                            break
+                if ordenada:
+                    # Los registros del último paciente del bloque pueden continuar en el siguiente
+                    ultimo = documentos[~np.isnan(documentos)][-1] if (~np.isnan(documentos)).any() else np.nan
+                    completos = documentos != ultimo
+                    pendiente = bloque[~completos]
+                    partes_bloque = _procesar_pacientes(bloque[completos], config, plan, config['columnas'])
+                    for nombre, parte in zip(partes, partes_bloque):
+                        partes[nombre].append(parte)
+                    pacientes += partes_bloque[2]['Numero_Documento_Paciente'].nunique()
+                else:
+                    # Solo se reevalúan los pacientes del bloque, con todas sus filas leídas hasta ahora
+                    if acumulado is None:
+                        acumulado = _nuevo_acumulado()
+                    afectados, sin_documento = _anexar_filas(acumulado, bloque, documentos)
+                    filas_afectadas = _filas_pacientes(acumulado, afectados, sin_documento)
+                    partes_bloque = _procesar_pacientes(filas_afectadas, config, plan, config['columnas'])
+                    _reemplazar_evaluacion(acumulado, filas_afectadas.index.to_numpy(), partes_bloque)
+                    aprobados.difference_update(afectados.tolist())
+                    aprobados.update(pd.to_numeric(partes_bloque[2]['Numero_Documento_Paciente'], errors='coerce').dropna().tolist())
+                    pacientes = len(aprobados)
+                    if acumulado['filas'] * acumulado['bytes_fila'] > memoria_mb * 1024 ** 2 and pacientes < n_pacientes:
+                        print(f"⚠️  Las filas guardadas sin orden superan {memoria_mb:,} MB: la vista previa se detiene con "
+                              f"{pacientes:,} pacientes evaluados (para el resultado completo ejecute sin --preview)")
+                        detenida = True
+                        break
+                if pacientes >= n_pacientes:
+                    break
+            else:
+                # Fin de la entrada: el último paciente ya está completo
+                if ordenada and pendiente is not None and len(pendiente):
+                    partes_bloque = _procesar_pacientes(pendiente, config, plan, config['columnas'])
+                    for nombre, parte in zip(partes, partes_bloque):
+                        partes[nombre].append(parte)
+        finally:
+            bloques.close()
+        if not reiniciar:
+            break
+    if acumulado is not None:
+        # Sin orden: de cada paciente vale su última evaluación, que incluye todas sus filas anteriores
+        partes = {nombre: [_compactar(lista, acumulado['ultima'])[0]] for nombre, lista in acumulado['partes'].items()}
+    segundos = time.perf_counter() - inicio
+    
+    df_filtrados, df_limpios, df_resultado = (pd.concat(partes[nombre]).sort_index(kind='stable').reset_index(drop=True)
+                                              if partes[nombre] else pd.DataFrame() for nombre in partes)
+    # Primeros N pacientes en orden de aparición
+    if len(df_resultado):
+        primeros = pd.unique(df_resultado['Numero_Documento_Paciente'])[:n_pacientes]
+        df_resultado = df_resultado[df_resultado['Numero_Documento_Paciente'].isin(primeros)]
+    
+    print(f"\n{'='*80}")
+    print("📊 RESUMEN DE LA VISTA PREVIA")
+    print(f"{'='*80}")
+    total = f" de {'' if exacto else '~'}{total_estimado:,}" if total_estimado else ""
+    print(f"✅ Filas leídas: {filas_leidas:,}{total} en {segundos:.2f} s")
+    print(f"✅ Registros después del filtro de registros: {len(df_filtrados):,}")
+    print(f"✅ Registros después de limpieza: {len(df_limpios):,}")
+    print(f"✅ Filtro {plan['rama']}: {len(df_resultado):,} registros de {df_resultado['Numero_Documento_Paciente'].nunique() if len(df_resultado) else 0:,} pacientes")
+    if len(df_resultado) == 0:
+        print(f"⚠️  Ningún paciente cumple el filtro en las filas leídas")
+        return True
+    if df_resultado['Numero_Documento_Paciente'].nunique() < n_pacientes and not detenida:
+        print(f"⚠️  La entrada tiene menos de {n_pacientes:,} pacientes que cumplen el filtro")
+    
+    print(f"\n📊 Distribución de Codigo_Item:")
+    for codigo, count in df_resultado['Codigo_Item'].value_counts().head(20).items():
+        print(f"  {codigo}: {count:,} registros")
+    if 'Clasificacion_Perimetro' in df_resultado.columns:
+        print(f"\n📊 Clasificación de perímetro abdominal:")
+        for clase, count in df_resultado['Clasificacion_Perimetro'].value_counts().items():
+            print(f"  {clase}: {count:,} registros")
+    for columna in [c for c in df_resultado.columns if c.startswith('Indicador_')]:
+        print(f"📊 {columna}: {int(df_resultado[columna].sum()):,} registros")
+    
+    print(f"\n📋 Primeros {min(filas_mostradas, len(df_resultado)):,} registros (orden de la entrada, sin ordenar ni guardar):")
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(df_resultado.head(filas_mostradas).to_string(index=False))
+    return True
+
+def etapa_lectura(contexto, estado):
+    """
+    Etapa de lectura (PASO 2): registros del archivo de entrada (formato, compresión y motor detectados automáticamente)
+    Devuelve {'df', 'lectura', 'conteos', 'categorias_codigo'} o None si la entrada no se puede leer
+    """
+    config, excel_file = contexto['config'], contexto['excel_file']
+    print(f"\n📊 Leyendo archivo de entrada: {excel_file}")
+    try:
+        if detectar_formato(excel_file)[0] == 'sqlite':
+            df, lectura = leer_historial(excel_file, **predicados_historial(config))
+        elif contexto['entrada_precargada'] is not None:
+            df, lectura = contexto['entrada_precargada']
+            print(f"♻️  Entrada compartida con otros trabajos de la cola (ya leída)")
+        else:
+            df, lectura = leer_entrada(excel_file, config['lectura']['motor_excel'], config['lectura']['motor_csv'])
+    except (ErrorLector, ErrorHistorial) as e:
+        print(f"❌ Error: {e}")
+        return None
+    
+    print(f"✅ Formato y motor de lectura: {lectura}")
+    print(f"✅ Registros originales: {len(df):,}")
+    print(f"📋 Columnas originales: {len(df.columns)}")
+    return {'df': df, 'lectura': lectura, 'conteos': {'originales': len(df)},
+            'categorias_codigo': pd.unique(df['Codigo_Item'].dropna())}
+
+def etapa_limpieza(contexto, estado):
+    """
+    Etapa de limpieza (PASO 2.1 a 6): cohorte, filtro específico o por Tipo_Diagnostico, columnas y reglas de calidad
+    Devuelve {'df_clean', 'banderas', 'seleccion_procedencia', 'conteos', 'categorias_codigo'} o None si falla
+    """
+    config = contexto['config']
+    df, conteos, categorias_codigo = estado['df'], estado['conteos'], estado['categorias_codigo']
+    filtro_especifico = config['filtro_especifico']
+    aplicar_filtro_especifico = filtro_especifico['activo']
+    tipo_diagnostico = config['configuracion']['tipo_diagnostico']
+    columns_to_keep = config['columnas']
+    validaciones = config.get('validaciones', {})
+    aplicar_procedencia = config['procedencia']['activo']
+    cache_config, clave_limpios = contexto['cache_config'], contexto['clave_limpios']
+    
+    # PASO 2.1: Restringir a la cohorte externa (búsqueda binaria sobre los documentos distintos)
+    if config['cohorte']['incluir'] or config['cohorte']['excluir']:
+        try:
+            incluir, excluir = cohortes_config(config)
+        except ErrorCohorte as e:
+            print(f"❌ Error: {e}")
+            return None
+        for nombre, ids in (('incluir', incluir), ('excluir', excluir)):
+            if ids is not None:
+                print(f"\n👥 Cohorte a {nombre}: {len(ids):,} documentos ({ids.nbytes / 1024 / 1024:,.1f} MB)")
+        df = df[mascara_cohorte(df['Numero_Documento_Paciente'], incluir, excluir)]
+        print(f"📊 Registros de la cohorte: {len(df):,} ({df['Numero_Documento_Paciente'].nunique():,} pacientes)")
+    
+    # PASO 3: Aplicar filtro específico si está activo
+    if aplicar_filtro_especifico:
+        print(f"\n🎯 Aplicando filtro específico:")
+        print(f"   Tipo_Diagnostico: {filtro_especifico['tipo_diagnostico']}")
+        print(f"   Código_Item: {filtro_especifico['codigo_item_especifico']}")
+        if 'valor_lab_especifico' in filtro_especifico and filtro_especifico['valor_lab_especifico']:
+            print(f"   Valor_Lab: {filtro_especifico['valor_lab_especifico']}")
+    
+        # Aplicar filtros específicos básicos
+        df_filtered = df[
+            (df['Tipo_Diagnostico'].isin(filtro_especifico['tipo_diagnostico'])) &
+            (df['Codigo_Item'] == filtro_especifico['codigo_item_especifico'])
+        ].copy()
+    
+        # Aplicar filtro de Valor_Lab solo si está especificado
+        if 'valor_lab_especifico' in filtro_especifico and filtro_especifico['valor_lab_especifico']:
+            df_filtered = df_filtered[df_filtered['Valor_Lab'].isin(filtro_especifico['valor_lab_especifico'])].copy()
+    
+        print(f"📊 Registros después de filtros básicos: {len(df_filtered):,}")
+    
+        # Aplicar filtro por rango de fechas si está especificado
+        if filtro_especifico['fecha_atencion_rango'] and len(filtro_especifico['fecha_atencion_rango']) == 2:
+            fecha_inicio = filtro_especifico['fecha_atencion_rango'][0]
+            fecha_fin = filtro_especifico['fecha_atencion_rango'][1]
+            print(f"   Rango de fechas: {fecha_inicio} a {fecha_fin}")
+        
+            try:
+                # Convertir fechas a datetime
+                fecha_inicio_dt = pd.to_datetime(fecha_inicio)
+                fecha_fin_dt = pd.to_datetime(fecha_fin)
+            
+                # Convertir Fecha_Atencion a datetime si no lo está
+                df_filtered['Fecha_Atencion'] = pd.to_datetime(df_filtered['Fecha_Atencion'])
+            
+                # Aplicar filtro de rango de fechas
+                df_filtered = df_filtered[
+                    (df_filtered['Fecha_Atencion'] >= fecha_inicio_dt) &
+                    (df_filtered['Fecha_Atencion'] <= fecha_fin_dt)
+                ].copy()
+            
+                print(f"📊 Registros después del filtro de fechas: {len(df_filtered):,}")
+            
+                # Mostrar estadísticas de fechas
+                if len(df_filtered) > 0:
+                    min_date = df_filtered['Fecha_Atencion'].min()
+                    max_date = df_filtered['Fecha_Atencion'].max()
+                    print(f"📅 Rango de fechas en datos filtrados: {min_date.date()} a {max_date.date()}")
+            
+            except Exception as e:
+                print(f"⚠️  Error al procesar filtro de fechas: {e}")
+                print(f"📊 Continuando sin filtro de fechas...")
+        else:
+            print(f"   Rango de fechas: No especificado")
+    
+        # Aplicar filtro de presión arterial si está activo
+        if filtro_especifico['tipo_presion_arterial_activo']:
+            print(f"\n🩺 Aplicando filtro de presión arterial:")
+            print(f"   Tipos presión arterial: {filtro_especifico['tipo_presion_arterial']}")
+        
+            try:
+                # Verificar que Id_Correlativo existe
+                if 'Id_Correlativo' not in df_filtered.columns:
+                    print(f"❌ Error: Columna Id_Correlativo no encontrada")
+                    return None
+            
+                # Convertir Valor_Lab a numérico para cálculos
+                df_filtered['Valor_Lab_Numeric'] = pd.to_numeric(df_filtered['Valor_Lab'], errors='coerce')
+            
+                # Con la entrada ordenada cada visita es una corrida contigua: se reduce por tramos sin agrupar por hash
+                if len(df_filtered) > 0 and config['configuracion']['entrada_ordenada'] is not False and esta_ordenado(df_filtered):
+                    print(f"📊 Calculando tipo de presión arterial por paciente y fecha (corridas ordenadas)...")
+                    ids_visita, inicios_visita = ids_corridas(df_filtered)
+                
+                    # Sistólica = menor Id_Correlativo de la visita
+                    id_correlativo = pd.to_numeric(df_filtered['Id_Correlativo'], errors='coerce').to_numpy(dtype=np.float64)
+                    id_correlativo_min = np.fmin.reduceat(id_correlativo, inicios_visita)[ids_visita]
+                    df_filtered['tipo_presion'] = np.where(id_correlativo == id_correlativo_min, 'S', 'D')
+                
+                    # Calcular valor de presión con el umbral de cada registro (tipo, género y banda de edad)
+                    df_filtered['valor_presion'] = _valor_presion(df_filtered, df_filtered['tipo_presion'].to_numpy() == 'S', config)
+                
+                    # valor_presion_total: ANORMAL si algún registro de la visita es ANORMAL
+                    print(f"📊 Calculando valor_presion_total por paciente y fecha...")
+                    anormal = (df_filtered['valor_presion'] == 'ANORMAL').to_numpy()
+                    visita_anormal = np.logical_or.reduceat(anormal, inicios_visita)[ids_visita]
+                    df_filtered['valor_presion_total'] = np.where(visita_anormal, 'ANORMAL', 'NORMAL')
+                else:
+                    # Calcular tipo de presión arterial por paciente y fecha
+                    print(f"📊 Calculando tipo de presión arterial por paciente y fecha...")
+            
+                    # Obtener min y max Id_Correlativo por paciente y fecha
+                    patient_date_correlativo = df_filtered.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Id_Correlativo'].agg(['min', 'max']).reset_index()
+                    patient_date_correlativo.columns = ['Numero_Documento_Paciente', 'Fecha_Atencion', 'Id_Correlativo_Min', 'Id_Correlativo_Max']
+            
+                    # Crear mapeo de tipo de presión arterial
+                    df_filtered = df_filtered.merge(patient_date_correlativo, on=['Numero_Documento_Paciente', 'Fecha_Atencion'], how='left')
+            
+                    # Asignar tipo de presión arterial
+                    df_filtered['tipo_presion'] = 'D'  # Por defecto Diastólica
+                    df_filtered.loc[df_filtered['Id_Correlativo'] == df_filtered['Id_Correlativo_Min'], 'tipo_presion'] = 'S'
+            
+                    # Calcular valor de presión con el umbral de cada registro (tipo, género y banda de edad)
+                    df_filtered['valor_presion'] = _valor_presion(df_filtered, df_filtered['tipo_presion'].to_numpy() == 'S', config)
+            
+                    # Calcular valor_presion_total por paciente y fecha
+                    print(f"📊 Calculando valor_presion_total por paciente y fecha...")
+            
+                    # Crear agregación por paciente y fecha para determinar si hay algún valor ANORMAL
+                    patient_date_anormal = df_filtered.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['valor_presion'].apply(
+                        lambda x: 'ANORMAL' if 'ANORMAL' in x.values else 'NORMAL'
+                    ).reset_index()
+                    patient_date_anormal.columns = ['Numero_Documento_Paciente', 'Fecha_Atencion', 'valor_presion_total']
+            
+                    # Merge con el dataframe principal
+                    df_filtered = df_filtered.merge(patient_date_anormal, on=['Numero_Documento_Paciente', 'Fecha_Atencion'], how='left')
+            
+                # Barrido de umbrales candidatos con todos los registros S y D de cada visita que pasan las
+                # reglas de calidad (los mismos que llegan al resultado), antes de elegir los tipos
+                if config['barrido_umbrales']['activo']:
+                    columnas_barrido = [c for c in columns_to_keep if c in df_filtered.columns] + ['tipo_presion', 'Valor_Lab_Numeric']
+                    df_barrido = aplicar_reglas_calidad(df_filtered[columnas_barrido].copy(), validaciones, mostrar=False)
+                    ejecutar_barrido_umbrales(df_barrido, 'presion_arterial', config)
+            
+                # Filtrar solo los tipos de presión arterial especificados
+                df_filtered = df_filtered[df_filtered['tipo_presion'].isin(filtro_especifico['tipo_presion_arterial'])].copy()
+            
+                print(f"📊 Registros después del filtro de presión arterial: {len(df_filtered):,}")
+            
+                # Mostrar distribución de tipos de presión
+                print(f"\n📊 Distribución de tipos de presión arterial:")
+                presion_counts = df_filtered['tipo_presion'].value_counts()
+                for tipo, count in presion_counts.items():
+                    print(f"  {tipo}: {count:,} registros")
+            
+                # Mostrar distribución de valores de presión
+                print(f"\n📊 Distribución de valores de presión:")
+                valor_counts = df_filtered['valor_presion'].value_counts()
+                for valor, count in valor_counts.items():
+                    print(f"  {valor}: {count:,} registros")
+            
+                # Mostrar estadísticas por tipo
+                print(f"\n📊 Estadísticas por tipo de presión:")
+                for tipo in filtro_especifico['tipo_presion_arterial']:
+                    tipo_data = df_filtered[df_filtered['tipo_presion'] == tipo]
+                    if len(tipo_data) > 0:
+                        normal_count = len(tipo_data[tipo_data['valor_presion'] == 'NORMAL'])
+                        anormal_count = len(tipo_data[tipo_data['valor_presion'] == 'ANORMAL'])
+                        print(f"  {tipo}: Normal={normal_count}, Anormal={anormal_count}")
+            
+                # Mostrar distribución de valor_presion_total
+                print(f"\n📊 Distribución de valor_presion_total:")
+                total_counts = df_filtered['valor_presion_total'].value_counts()
+                for valor, count in total_counts.items():
+                    print(f"  {valor}: {count:,} registros")
+            
+            except Exception as e:
+                print(f"⚠️  Error al procesar filtro de presión arterial: {e}")
+                print(f"📊 Continuando sin filtro de presión arterial...")
+        else:
+            print(f"   Filtro presión arterial: INACTIVO")
+    
+        print(f"📊 Registros después del filtro específico completo: {len(df_filtered):,}")
+    
+        # Mostrar distribución de Tipo_Diagnostico
+        print(f"\n📊 Distribución de Tipo_Diagnostico:")
+        tipo_counts = df_filtered['Tipo_Diagnostico'].value_counts()
+        for tipo, count in tipo_counts.items():
+            print(f"  {tipo}: {count:,} registros")
+    
+        # Mostrar distribución de Valor_Lab
+        print(f"\n📊 Distribución de Valor_Lab:")
+        lab_counts = df_filtered['Valor_Lab'].value_counts()
+        for lab, count in lab_counts.items():
+            print(f"  {lab}: {count:,} registros")
+        
+    else:
+        # PASO 3: Filtrar por Tipo_Diagnostico (método original)
+        print(f"\n🔍 Filtrando registros con Tipo_Diagnostico = '{tipo_diagnostico}'")
+        df_filtered = df[df['Tipo_Diagnostico'] == tipo_diagnostico].copy()
+        print(f"📊 Registros con Tipo_Diagnostico = '{tipo_diagnostico}': {len(df_filtered):,}")
+
+    # PASO 4: Seleccionar columnas específicas
+    print(f"\n🔧 Seleccionando columnas específicas: {columns_to_keep}")
+
+    # Agregar columnas de presión arterial si el filtro está activo
+    if aplicar_filtro_especifico and filtro_especifico['tipo_presion_arterial_activo']:
+        additional_columns = ['tipo_presion', 'valor_presion', 'valor_presion_total']
+        columns_to_keep_extended = columns_to_keep + additional_columns
+        print(f"🔧 Agregando columnas de presión arterial: {additional_columns}")
+    else:
+        columns_to_keep_extended = columns_to_keep
+
+    # Verificar que las columnas existen
+    missing_columns = [col for col in columns_to_keep_extended if col not in df_filtered.columns]
+    if missing_columns:
+        print(f"❌ Error: Columnas no encontradas: {missing_columns}")
+        return None
+
+    df_selected = df_filtered[columns_to_keep_extended].copy()
+    print(f"📊 Registros después de seleccionar columnas: {len(df_selected):,}")
+
+    # PASO 5 y 6: Eliminar nulos y aplicar reglas de calidad de datos
+    # (con procedencia activa, las banderas de calidad se registran con las máscaras de cada regla)
+    if aplicar_procedencia:
+        df_clean, banderas = aplicar_reglas_calidad(df_selected, validaciones, procedencia=True)
+        columnas_excluidos = [c for c in ('Numero_Documento_Paciente', 'Fecha_Atencion', 'Codigo_Item', 'Valor_Lab') if c in df_selected.columns]
+        seleccion_procedencia = df_selected[columnas_excluidos]
+    else:
+        df_clean = aplicar_reglas_calidad(df_selected, validaciones)
+        banderas, seleccion_procedencia = None, None
+    
+    conteos['tipo_diagnostico'] = len(df_filtered)
+    conteos['limpieza'] = len(df_clean)
+    
+    # Registros limpios para otros perfiles con los mismos ajustes de limpieza
+    if clave_limpios:
+        try:
+            tamano, expulsadas = guardar_limpieza(clave_limpios, {
+                'df_clean': df_clean, 'conteos': dict(conteos), 'categorias_codigo': categorias_codigo}, cache_config)
+            print(f"🗄️  Registros limpios guardados en caché (clave {clave_limpios[:12]}…, {tamano / 1024 / 1024:,.1f} MB)")
+            if expulsadas:
+                print(f"🗄️  Entradas expulsadas de la caché: {expulsadas}")
+        except OSError as e:
+            print(f"⚠️  No se pudieron guardar los registros limpios en caché: {e}")
+    
+    return {'df_clean': df_clean, 'banderas': banderas, 'seleccion_procedencia': seleccion_procedencia,
+            'conteos': conteos, 'categorias_codigo': categorias_codigo}
+
+def etapa_filtrado(contexto, estado):
+    """
+    Etapa de filtrado (PASO 6.5 a 9): conjuntos de pacientes y filtro activo sobre los registros limpios
+    Devuelve {'df_final', 'procedencia', 'seleccion_procedencia', 'conteos', 'categorias_codigo'}
+    """
+    config = contexto['config']
+    df_clean, banderas, conteos = estado['df_clean'], estado['banderas'], estado['conteos']
+    codigos_obligatorios = codigos_planos(config['codigos_item']['obligatorios'])
+    codigos_opcionales = codigos_planos(config['codigos_item']['opcionales'])
+    todos_codigos = codigos_obligatorios + codigos_opcionales
+    valores_lab = config['valores_laboratorio']
+    modo_filtrado = config['filtrado_codigos']['modo']
+    entrada_ordenada = config['configuracion']['entrada_ordenada']
+    filtro_perimetro = config['filtro_perimetro']
+    aplicar_filtro_perimetro = filtro_perimetro['activo']
+    filtro_valoracion_clinica = config['filtro_valoracion_clinica']
+    aplicar_filtro_valoracion_clinica = filtro_valoracion_clinica['activo']
+    filtro_valoracion_clinica_con_riesgo = config['filtro_valoracion_clinica_con_riesgo']
+    aplicar_filtro_valoracion_clinica_con_riesgo = filtro_valoracion_clinica_con_riesgo['activo']
+    filtro_expresion = config['filtro_expresion']
+    aplicar_filtro_expresion = filtro_expresion['activo']
+    aplicar_filtro_especifico = config['filtro_especifico']['activo']
+    
+    # PASO 6.5: Detectar si los registros ya vienen ordenados por paciente y fecha
+    ordenado = entrada_ordenada is not False and esta_ordenado(df_clean)
+    if ordenado:
+        print(f"\n📋 Registros ordenados por Numero_Documento_Paciente y Fecha_Atencion: agrupación por corridas")
+    elif entrada_ordenada is True:
+        print(f"\n⚠️  entrada_ordenada es true, pero los registros no están ordenados: se usa agrupación por hash")
+    
+    # PASO 6.6: Conjuntos de pacientes por indicador (mapas de bits) y expresiones entre ellos
+    if config['conjuntos']['activo']:
+        ejecutar_conjuntos(df_clean, config, ordenado)
+
+    # PASO 7: Aplicar filtro de perímetro si está activo
+    if aplicar_filtro_perimetro:
+        print(f"\n📏 Aplicando filtro de perímetro abdominal:")
+        print(f"   Códigos requeridos: {filtro_perimetro['codigos_requeridos']}")
+        print(f"   Modo de filtrado: {filtro_perimetro['modo_filtrado']}")
+        if filtro_perimetro.get('fecha_atencion_activo', False):
+            print(f"   Filtro por fecha de atención: ACTIVO")
+        else:
+            print(f"   Filtro por fecha de atención: INACTIVO")
+    
+        # Filtrar por códigos requeridos
+        df_perimetro = df_clean[df_clean['Codigo_Item'].isin(codigos_planos(filtro_perimetro['codigos_requeridos']))].copy()
+        registrar_procedencia(banderas, 'CODIGO_FILTRO', df_perimetro.index)
+        print(f"📊 Registros con códigos de perímetro: {len(df_perimetro):,}")
+    
+        # Mostrar distribución de códigos
+        print(f"\n📊 Distribución de códigos de perímetro:")
+        code_counts = df_perimetro['Codigo_Item'].value_counts()
+        for code, count in code_counts.items():
+            print(f"  {code}: {count:,} registros")
+    
+        # Verificar completitud de códigos por paciente y fecha
+        if filtro_perimetro.get('fecha_atencion_activo', False):
+            print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
+        
+            # Agrupar por paciente y fecha y conservar solo grupos que tienen TODOS los códigos requeridos
+            complete_mask, total_groups_before, complete_groups = grupos_con_codigos(
+                df_perimetro, 'visita', requisitos_codigos(filtro_perimetro['codigos_requeridos']), ordenado)
+        
+            print(f"📊 Grupos (paciente-fecha) con TODOS los códigos: {complete_groups:,}")
+        
+            # Filtrar registros que pertenecen a grupos completos
+            df_perimetro = df_perimetro[complete_mask].copy()
+            registrar_procedencia(banderas, 'REQUERIDOS_VISITA', df_perimetro.index)
+        
+            print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_perimetro):,}")
+        
+            # Mostrar estadísticas de grupos eliminados
+            groups_removed = total_groups_before - complete_groups
+            print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
+    
+        # Aplicar filtrado de pacientes según modo
+        if filtro_perimetro['modo_filtrado'] == "todos":
+            print(f"📋 Filtrando pacientes con TODOS los códigos de perímetro: {filtro_perimetro['codigos_requeridos']}")
+            patients_mask, _, patients_with_all = grupos_con_codigos(
+                df_perimetro, 'paciente', requisitos_codigos(filtro_perimetro['codigos_requeridos']), ordenado)
+            print(f"👥 Pacientes con TODOS los códigos de perímetro: {patients_with_all:,}")
+        
+            # Filtrar solo los registros de pacientes que tienen todos los códigos
+            df_perimetro = df_perimetro[patients_mask].copy()
+            registrar_procedencia(banderas, 'REQUERIDOS_PACIENTE', df_perimetro.index)
+            print(f"📊 Registros después de filtrado de pacientes: {len(df_perimetro):,}")
+    
+        # Clasificar perímetro abdominal
+        df_perimetro = classify_perimeter_abdominal(df_perimetro, config)
+    
+        # Barrido de umbrales candidatos sobre los mismos registros (sin reprocesar por escenario)
+        if config['barrido_umbrales']['activo']:
+            ejecutar_barrido_umbrales(df_perimetro, 'perimetro', config)
+    
+        # Mostrar distribución de clasificación
+        print(f"\n📊 Distribución de clasificación de perímetro:")
+        clasif_counts = df_perimetro['Clasificacion_Perimetro'].value_counts()
+        for clasif, count in clasif_counts.items():
+            print(f"  {clasif}: {count:,} registros")
+    
+        # Mostrar estadísticas por género
+        print(f"\n📊 Estadísticas de perímetro por género:")
+        for genero in ['F', 'M']:
+            df_genero = df_perimetro[df_perimetro['Genero'] == genero]
+            if len(df_genero) > 0:
+                normal_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'NORMAL'])
+                anormal_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'ANORMAL'])
+                no_clasif_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'NO_CLASIFICADO'])
+                print(f"  Género {genero}: Normal={normal_count}, Anormal={anormal_count}, No clasificado={no_clasif_count}")
+    
+        # Usar datos del filtro de perímetro
+        df_final = df_perimetro.copy()
+        print(f"📊 Registros finales del filtro de perímetro: {len(df_final):,}")
+    
+    # PASO 8: Aplicar filtro de valoración clínica si está activo
+    elif aplicar_filtro_valoracion_clinica:
+        print(f"\n🏥 Aplicando filtro de valoración clínica sin factores de riesgo:")
+        print(f"   Códigos requeridos: {filtro_valoracion_clinica['codigos_requeridos']}")
+        print(f"   Modo de filtrado: {filtro_valoracion_clinica['modo_filtrado']}")
+        if filtro_valoracion_clinica.get('valor_lab_especifico'):
+            print(f"   Valor_Lab específico: {filtro_valoracion_clinica['valor_lab_especifico']}")
+        if filtro_valoracion_clinica.get('fecha_atencion_activo', False):
+            print(f"   Filtro por fecha de atención: ACTIVO")
+        else:
+            print(f"   Filtro por fecha de atención: INACTIVO")
+    
+        # Filtrar por códigos requeridos
+        df_valoracion = df_clean[df_clean['Codigo_Item'].isin(codigos_planos(filtro_valoracion_clinica['codigos_requeridos']))].copy()
+        registrar_procedencia(banderas, 'CODIGO_FILTRO', df_valoracion.index)
+        print(f"📊 Registros con códigos de valoración clínica: {len(df_valoracion):,}")
+    
+        # Mostrar distribución de códigos
+        print(f"\n📊 Distribución de códigos de valoración clínica:")
+        code_counts = df_valoracion['Codigo_Item'].value_counts()
+        for code, count in code_counts.items():
+            print(f"  {code}: {count:,} registros")
+    
+        # Aplicar filtro de Valor_Lab específico si está configurado
+        if filtro_valoracion_clinica.get('valor_lab_especifico'):
+            print(f"\n🔍 Aplicando filtro de Valor_Lab específico:")
+            print(f"   Valor_Lab requerido: {filtro_valoracion_clinica['valor_lab_especifico']}")
+        
+            # Filtrar registros Z006 que no tienen el Valor_Lab específico
+            z006_records = df_valoracion[df_valoracion['Codigo_Item'] == 'Z006']
+            z006_with_specific_lab = z006_records[z006_records['Valor_Lab'].isin(filtro_valoracion_clinica['valor_lab_especifico'])]
+        
+            print(f"📊 Registros Z006 con Valor_Lab específico: {len(z006_with_specific_lab):,}")
+            print(f"📊 Registros Z006 eliminados: {len(z006_records) - len(z006_with_specific_lab):,}")
+        
+            # Mantener solo registros Z006 con Valor_Lab específico y todos los otros códigos
+            # (sin reordenar, para conservar el orden por paciente y fecha)
+            df_valoracion = df_valoracion[(df_valoracion['Codigo_Item'] != 'Z006') |
+                                          df_valoracion['Valor_Lab'].isin(filtro_valoracion_clinica['valor_lab_especifico'])]
+            registrar_procedencia(banderas, 'VALOR_LAB', df_valoracion.index)
+            print(f"📊 Registros después de filtro Valor_Lab específico: {len(df_valoracion):,}")
+    
+        # Verificar completitud de códigos por paciente y fecha si está activo
+        if filtro_valoracion_clinica.get('fecha_atencion_activo', False):
+            print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
+        
+            # Agrupar por paciente y fecha y conservar solo grupos que tienen TODOS los códigos requeridos
+            complete_mask, total_groups_before, complete_groups = grupos_con_codigos(
+                df_valoracion, 'visita', requisitos_codigos(filtro_valoracion_clinica['codigos_requeridos']), ordenado)
+        
+            print(f"📊 Grupos (paciente-fecha) con TODOS los códigos: {complete_groups:,}")
+        
+            # Filtrar registros que pertenecen a grupos completos
+            df_valoracion = df_valoracion[complete_mask].copy()
+            registrar_procedencia(banderas, 'REQUERIDOS_VISITA', df_valoracion.index)
+        
+            print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_valoracion):,}")
+        
+            # Mostrar estadísticas de grupos eliminados
+            groups_removed = total_groups_before - complete_groups
+            print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
+    
+        # Aplicar filtrado de pacientes según modo
+        if filtro_valoracion_clinica['modo_filtrado'] == "todos":
+            print(f"📋 Filtrando pacientes con TODOS los códigos de valoración clínica: {filtro_valoracion_clinica['codigos_requeridos']}")
+            patients_mask, _, patients_with_all = grupos_con_codigos(
+                df_valoracion, 'paciente', requisitos_codigos(filtro_valoracion_clinica['codigos_requeridos']), ordenado)
+            print(f"👥 Pacientes con TODOS los códigos de valoración clínica: {patients_with_all:,}")
+        
+            # Filtrar solo los registros de pacientes que tienen todos los códigos
+            df_valoracion = df_valoracion[patients_mask].copy()
+            registrar_procedencia(banderas, 'REQUERIDOS_PACIENTE', df_valoracion.index)
+            print(f"📊 Registros después de filtrado de pacientes: {len(df_valoracion):,}")
+    
+        # Usar datos del filtro de valoración clínica
+        df_final = df_valoracion.copy()
+        print(f"📊 Registros finales del filtro de valoración clínica: {len(df_final):,}")
+    
+    # PASO 8.5: Aplicar filtro de valoración clínica con factores de riesgo si está activo
+    elif aplicar_filtro_valoracion_clinica_con_riesgo:
+        print(f"\n🏥 Aplicando filtro de valoración clínica con factores de riesgo:")
+        print(f"   Códigos requeridos: {filtro_valoracion_clinica_con_riesgo['codigos_requeridos']}")
+        print(f"   Códigos de factores de riesgo: {filtro_valoracion_clinica_con_riesgo['codigos_factores_riesgo']}")
+        print(f"   Modo de filtrado: {filtro_valoracion_clinica_con_riesgo['modo_filtrado']}")
+        if filtro_valoracion_clinica_con_riesgo.get('valor_lab_especifico'):
+            print(f"   Valor_Lab específico: {filtro_valoracion_clinica_con_riesgo['valor_lab_especifico']}")
+        if filtro_valoracion_clinica_con_riesgo.get('fecha_atencion_activo', False):
+            print(f"   Filtro por fecha de atención: ACTIVO")
+        else:
+            print(f"   Filtro por fecha de atención: INACTIVO")
+    
+        # Filtrar por códigos requeridos (Z019)
+        df_valoracion_con_riesgo = df_clean[df_clean['Codigo_Item'].isin(codigos_planos(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']))].copy()
+        print(f"📊 Registros con códigos requeridos (Z019): {len(df_valoracion_con_riesgo):,}")
+    
+        # Mostrar distribución de códigos requeridos
+        print(f"\n📊 Distribución de códigos requeridos:")
+        code_counts = df_valoracion_con_riesgo['Codigo_Item'].value_counts()
+        for code, count in code_counts.items():
+            print(f"  {code}: {count:,} registros")
+    
+        # Filtrar por códigos de factores de riesgo (solo si existen)
+        codigos_factores_riesgo = codigos_planos(filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', []))
+    
+        if codigos_factores_riesgo:
+            df_factores_riesgo = df_clean[df_clean['Codigo_Item'].isin(codigos_factores_riesgo)].copy()
+            print(f"📊 Registros con códigos de factores de riesgo: {len(df_factores_riesgo):,}")
+        
+            # Mostrar distribución de códigos de factores de riesgo
+            print(f"\n📊 Distribución de códigos de factores de riesgo:")
+            riesgo_counts = df_factores_riesgo['Codigo_Item'].value_counts()
+            for code, count in riesgo_counts.items():
+                print(f"  {code}: {count:,} registros")
+        
+            # Aplicar filtro de Valor_Lab específico si está configurado
+            if filtro_valoracion_clinica_con_riesgo.get('valor_lab_especifico'):
+                print(f"\n🔍 Aplicando filtro de Valor_Lab específico a códigos de factores de riesgo:")
+                print(f"   Valor_Lab requerido: {filtro_valoracion_clinica_con_riesgo['valor_lab_especifico']}")
+            
+                # Filtrar registros de factores de riesgo que no tienen el Valor_Lab específico
+                factores_riesgo_with_specific_lab = df_factores_riesgo[df_factores_riesgo['Valor_Lab'].isin(filtro_valoracion_clinica_con_riesgo['valor_lab_especifico'])]
+            
+                print(f"📊 Registros de factores de riesgo con Valor_Lab específico: {len(factores_riesgo_with_specific_lab):,}")
+                print(f"📊 Registros de factores de riesgo eliminados: {len(df_factores_riesgo) - len(factores_riesgo_with_specific_lab):,}")
+            
+                # Actualizar df_factores_riesgo con solo los registros que tienen el Valor_Lab específico
+                df_factores_riesgo = factores_riesgo_with_specific_lab.copy()
+                print(f"📊 Registros de factores de riesgo después de filtro Valor_Lab específico: {len(df_factores_riesgo):,}")
+        else:
+            print(f"⚠️  No hay códigos de factores de riesgo configurados, saltando filtrado de factores de riesgo")
+            df_factores_riesgo = pd.DataFrame()  # DataFrame vacío
+    
+        # Verificar completitud de códigos por paciente y fecha si está activo
+        if filtro_valoracion_clinica_con_riesgo.get('fecha_atencion_activo', False):
+            print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
+        
+            # Verificar si hay códigos de factores de riesgo
+            codigos_factores_riesgo = codigos_planos(filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', []))
+        
+            if codigos_factores_riesgo:
+                # Combinar códigos requeridos y de factores de riesgo para verificar completitud
+                todos_codigos_riesgo = codigos_planos(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']) + codigos_factores_riesgo
+            
+                # Filtrar registros que tienen códigos requeridos o de factores de riesgo
+                df_todos_codigos = df_clean[df_clean['Codigo_Item'].isin(todos_codigos_riesgo)].copy()
+                registrar_procedencia(banderas, 'CODIGO_FILTRO', df_todos_codigos.index)
+            
+                # Agrupar por paciente y fecha: al menos un código requerido Y al menos un factor de riesgo
+                complete_mask, total_groups_before, complete_groups, cumplen = grupos_con_codigos(
+                    df_todos_codigos, 'visita',
+                    [codigos_planos(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']), codigos_factores_riesgo], ordenado,
+                    por_requisito=True)
+                registrar_procedencia(banderas, 'REQUERIDOS_VISITA', df_todos_codigos.index[cumplen[0]])
+                registrar_procedencia(banderas, 'FACTOR_RIESGO', df_todos_codigos.index[cumplen[1]])
+            
+                print(f"📊 Grupos (paciente-fecha) con códigos requeridos Y factores de riesgo: {complete_groups:,}")
+            else:
+                # Si no hay códigos de factores de riesgo, solo verificar códigos requeridos
+                print(f"⚠️  No hay códigos de factores de riesgo configurados, solo verificando códigos requeridos")
+            
+                # Filtrar registros que tienen códigos requeridos
+                df_todos_codigos = df_clean[df_clean['Codigo_Item'].isin(codigos_planos(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']))].copy()
+                registrar_procedencia(banderas, 'CODIGO_FILTRO', df_todos_codigos.index)
+            
+                # Agrupar por paciente y fecha y conservar solo grupos que tienen TODOS los códigos requeridos
+                complete_mask, total_groups_before, complete_groups = grupos_con_codigos(
+                    df_todos_codigos, 'visita',
+                    requisitos_codigos(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']), ordenado)
+                registrar_procedencia(banderas, 'REQUERIDOS_VISITA', df_todos_codigos.index[complete_mask])
+            
+                print(f"📊 Grupos (paciente-fecha) con TODOS los códigos requeridos: {complete_groups:,}")
+        
+            # Filtrar registros que pertenecen a grupos completos
+            df_todos_codigos = df_todos_codigos[complete_mask].copy()
+        
+            print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_todos_codigos):,}")
+        
+            # Mostrar estadísticas de grupos eliminados
+            groups_removed = total_groups_before - complete_groups
+            print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
+        
+            # Usar los datos filtrados por fecha
+            df_final = df_todos_codigos.copy()
+        else:
+            # Obtener pacientes que tienen códigos requeridos
+            pacientes_con_requeridos = df_valoracion_con_riesgo['Numero_Documento_Paciente'].unique()
+            print(f"👥 Pacientes con códigos requeridos: {len(pacientes_con_requeridos):,}")
+        
+            # Verificar si hay códigos de factores de riesgo
+            codigos_factores_riesgo = codigos_planos(filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', []))
+        
+            if codigos_factores_riesgo:
+                # Obtener pacientes que tienen al menos un factor de riesgo
+                pacientes_con_riesgo = df_factores_riesgo['Numero_Documento_Paciente'].unique()
+                print(f"👥 Pacientes con factores de riesgo: {len(pacientes_con_riesgo):,}")
+            
+                # Pacientes que tienen códigos requeridos Y al menos un factor de riesgo
+                pacientes_finales = set(pacientes_con_requeridos) & set(pacientes_con_riesgo)
+                print(f"👥 Pacientes con códigos requeridos Y factores de riesgo: {len(pacientes_finales):,}")
+            else:
+                # Si no hay códigos de factores de riesgo, solo usar pacientes con códigos requeridos
+                print(f"⚠️  No hay códigos de factores de riesgo configurados, usando solo códigos requeridos")
+                pacientes_finales = set(pacientes_con_requeridos)
+                print(f"👥 Pacientes con códigos requeridos: {len(pacientes_finales):,}")
+        
+            # Filtrar registros de pacientes que cumplen los criterios
+            df_final = df_clean[df_clean['Numero_Documento_Paciente'].isin(pacientes_finales)].copy()
+            
+            # Banderas por paciente: todos sus registros se conservan, así que no se registran código ni Valor_Lab
+            if banderas is not None:
+                documentos = df_clean['Numero_Documento_Paciente']
+                registrar_procedencia(banderas, 'REQUERIDOS_PACIENTE', df_clean.index[documentos.isin(pacientes_con_requeridos).to_numpy()])
+                if codigos_factores_riesgo:
+                    registrar_procedencia(banderas, 'FACTOR_RIESGO', df_clean.index[documentos.isin(pacientes_con_riesgo).to_numpy()])
+    
+        print(f"📊 Registros finales del filtro de valoración clínica con factores de riesgo: {len(df_final):,}")
+
+    # PASO 8.6: Aplicar filtro por expresión de códigos si está activo
+    elif aplicar_filtro_expresion:
+        ambito = filtro_expresion['ambito']
+        print(f"\n🧮 Aplicando filtro por expresión de códigos:")
+        if filtro_expresion['expresion']:
+            print(f"   Expresión: {filtro_expresion['expresion']}")
+        for nombre, texto in filtro_expresion['indicadores'].items():
+            print(f"   Indicador {nombre}: {texto}")
+        print(f"   Ámbito: {ambito} ({'paciente y fecha de atención' if ambito == 'visita' else 'historial completo del paciente'})")
+
+        # Todos los indicadores se evalúan en un único recorrido agrupado
+        indicadores = dict(filtro_expresion['indicadores'])
+        if filtro_expresion['expresion']:
+            indicadores['__expresion__'] = filtro_expresion['expresion']
+        evaluacion = evaluar_indicadores(df_clean, indicadores, ambito, ordenado)
+        ids_grupo = evaluacion['ids']
+
+        # Mostrar registros encontrados por cada átomo de las expresiones
+        print(f"\n📊 Registros por átomo de la expresión:")
+        for atomo, count in evaluacion['conteos'].items():
+            print(f"  {describir_atomo(atomo)}: {count:,} registros")
+
+        # Grupos que cumplen: la expresión principal o, si no hay, cualquiera de los indicadores
+        if filtro_expresion['expresion']:
+            grupos_validos = evaluacion['resultados']['__expresion__']
+            filas_relevantes = evaluacion['relevantes']['__expresion__']
+        else:
+            grupos_validos = np.logical_or.reduce(list(evaluacion['resultados'].values()))
+            filas_relevantes = np.logical_or.reduce(list(evaluacion['relevantes'].values()))
+
+        nombre_grupo = "Grupos (paciente-fecha)" if ambito == 'visita' else "Pacientes"
+        print(f"📊 {nombre_grupo} evaluados: {len(grupos_validos):,}")
+        print(f"📊 {nombre_grupo} que cumplen la expresión: {int(grupos_validos.sum()):,}")
+
+        mascara_filas = grupos_validos[ids_grupo]
+        registrar_procedencia(banderas, 'REQUERIDOS_VISITA' if ambito == 'visita' else 'REQUERIDOS_PACIENTE', df_clean.index[mascara_filas])
+        if filtro_expresion['registros'] != "todos":
+            mascara_filas = mascara_filas & filas_relevantes
+            registrar_procedencia(banderas, 'CODIGO_FILTRO', df_clean.index[filas_relevantes])
+        df_final = df_clean[mascara_filas].copy()
+
+        # Una columna por indicador con el resultado de su grupo
+        for nombre, resultado in evaluacion['resultados'].items():
+            if nombre == '__expresion__':
+                continue
+            df_final[f"Indicador_{nombre}"] = resultado[ids_grupo][mascara_filas]
+            print(f"👥 {nombre_grupo} con indicador {nombre}: {int(resultado.sum()):,}")
+
+        print(f"📊 Registros finales del filtro por expresión: {len(df_final):,}")
+
+    # PASO 9: Aplicar filtros adicionales solo si no se aplicó ningún filtro específico
+    elif not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion:
+        # Filtrar por códigos específicos (si se especificaron)
+        if todos_codigos:
+            print(f"\n🎯 Filtrando registros con códigos:")
+            if codigos_obligatorios:
+                print(f"   Obligatorios: {codigos_obligatorios}")
+            if codigos_opcionales:
+                print(f"   Opcionales: {codigos_opcionales}")
+        
+            df_codes = df_clean[df_clean['Codigo_Item'].isin(todos_codigos)].copy()
+            registrar_procedencia(banderas, 'CODIGO_FILTRO', df_codes.index)
+            print(f"📊 Registros con códigos específicos: {len(df_codes):,}")
+        
+            # Mostrar distribución de códigos
+            print(f"\n📊 Distribución de códigos encontrados:")
+            code_counts = df_codes['Codigo_Item'].value_counts()
+            for code, count in code_counts.items():
+                status = "OBLIGATORIO" if code in codigos_obligatorios else "OPCIONAL"
+                print(f"  {code} ({status}): {count:,} registros")
+        else:
+            print(f"\n🎯 No se especificaron códigos de filtrado - considerando todos los códigos")
+            df_codes = df_clean.copy()
+            print(f"📊 Registros después de limpieza: {len(df_codes):,}")
+        
+            # Mostrar todos los códigos disponibles
+            print(f"\n📊 Todos los códigos disponibles:")
+            all_codes = df_codes['Codigo_Item'].value_counts()
+            for code, count in all_codes.head(10).items():
+                print(f"  {code}: {count:,} registros")
+            if len(all_codes) > 10:
+                print(f"  ... y {len(all_codes) - 10} códigos más")
+    
+        # Filtrar por valores de laboratorio (si se especificaron)
+        if valores_lab:
+            print(f"\n🔬 Filtrando registros con valores de laboratorio: {valores_lab}")
+            df_lab = df_codes[df_codes['Valor_Lab'].isin(valores_lab)].copy()
+            registrar_procedencia(banderas, 'VALOR_LAB', df_lab.index)
+            print(f"📊 Registros con valores de laboratorio específicos: {len(df_lab):,}")
+        
+            # Mostrar distribución de valores de laboratorio
+            print(f"\n📊 Distribución de valores de laboratorio encontrados:")
+            lab_counts = df_lab['Valor_Lab'].value_counts()
+            for lab, count in lab_counts.items():
+                print(f"  {lab}: {count:,} registros")
         else:
-            print(f"✅ Filtro de valoración clínica con factores de riesgo: INACTIVO")
+            print(f"\n🔬 No se especificaron valores de laboratorio - considerando todos los valores")
+            df_lab = df_codes.copy()
+            print(f"📊 Registros después de filtrado de códigos: {len(df_lab):,}")
+        
+            # Mostrar todos los valores de laboratorio disponibles
+            print(f"\n📊 Todos los valores de laboratorio disponibles:")
+            all_labs = df_lab['Valor_Lab'].value_counts()
+            for lab, count in all_labs.head(10).items():
+                print(f"  {lab}: {count:,} registros")
+            if len(all_labs) > 10:
+                print(f"  ... y {len(all_labs) - 10} valores más")
+    
+        # Aplicar filtrado de pacientes según códigos obligatorios y opcionales
+        if codigos_obligatorios and len(codigos_obligatorios) > 0:
+            print(f"\n🔍 Aplicando filtrado de pacientes por códigos obligatorios - Modo: {modo_filtrado}")
+            print(f"📋 Códigos obligatorios: {codigos_obligatorios}")
+            if codigos_opcionales:
+                print(f"📋 Códigos opcionales: {codigos_opcionales}")
+        
+            if modo_filtrado == "todos":
+                print(f"📋 Filtrando pacientes con TODOS los códigos obligatorios: {codigos_obligatorios}")
+                patients_mask, _, _ = grupos_con_codigos(df_lab, 'paciente', requisitos_codigos(config['codigos_item']['obligatorios']), ordenado)
+                patients_with_all = df_lab.loc[patients_mask, 'Numero_Documento_Paciente'].unique()
+                print(f"👥 Pacientes con TODOS los códigos obligatorios: {len(patients_with_all):,}")
             
-        print(f"✅ Tipo de diagnóstico: {config['configuracion']['tipo_diagnostico']}")
-        print(f"✅ Archivo de entrada: {config['configuracion']['archivo_entrada']}")
-        print(f"✅ Generar nombre único: {config['configuracion']['generar_nombre_unico']}")
-        print(f"✅ Columnas a mantener: {len(config['columnas'])} columnas")
-        
-        return config
+                # Si hay códigos opcionales, filtrar pacientes que tienen al menos uno de los opcionales
+                if codigos_opcionales and len(codigos_opcionales) > 0:
+                    print(f"📋 Filtrando pacientes con al menos UNO de los códigos opcionales: {codigos_opcionales}")
+                    patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
+                    print(f"👥 Pacientes con códigos opcionales: {len(patients_with_optional):,}")
+                
+                    # Pacientes que tienen TODOS los obligatorios Y al menos uno opcional
+                    patients_final = set(patients_with_all) & set(patients_with_optional)
+                    print(f"👥 Pacientes con TODOS los obligatorios Y al menos uno opcional: {len(patients_final):,}")
+                
+                    # Filtrar solo los registros de pacientes que cumplen ambos criterios
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
+                    print(f"📊 Registros finales (pacientes con obligatorios + opcionales): {len(df_final):,}")
+                else:
+                    # Solo códigos obligatorios, sin opcionales
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
+                    print(f"📊 Registros finales (pacientes con TODOS los códigos obligatorios): {len(df_final):,}")
+            
+            elif modo_filtrado == "cualquiera":
+                print(f"📋 Filtrando pacientes con CUALQUIERA de los códigos obligatorios: {codigos_obligatorios}")
+                patients_with_any = df_lab[df_lab['Codigo_Item'].isin(codigos_obligatorios)]['Numero_Documento_Paciente'].unique()
+                print(f"👥 Pacientes con CUALQUIERA de los códigos obligatorios: {len(patients_with_any):,}")
+            
+                # Si hay códigos opcionales, filtrar pacientes que tienen al menos uno de los opcionales
+                if codigos_opcionales and len(codigos_opcionales) > 0:
+                    print(f"📋 Filtrando pacientes con al menos UNO de los códigos opcionales: {codigos_opcionales}")
+                    patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
+                    print(f"👥 Pacientes con códigos opcionales: {len(patients_with_optional):,}")
+                
+                    # Pacientes que tienen CUALQUIERA de los obligatorios Y al menos uno opcional
+                    patients_final = set(patients_with_any) & set(patients_with_optional)
+                    print(f"👥 Pacientes con CUALQUIERA de los obligatorios Y al menos uno opcional: {len(patients_final):,}")
+                
+                    # Filtrar solo los registros de pacientes que cumplen ambos criterios
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
+                    print(f"📊 Registros finales (pacientes con obligatorios + opcionales): {len(df_final):,}")
+                else:
+                    # Solo códigos obligatorios, sin opcionales
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_any)].copy()
+                    print(f"📊 Registros finales (pacientes con CUALQUIERA de los códigos obligatorios): {len(df_final):,}")
+            
+            else:
+                print(f"⚠️  Modo de filtrado '{modo_filtrado}' no reconocido. Usando modo 'todos' por defecto.")
+                patients_mask, _, _ = grupos_con_codigos(df_lab, 'paciente', requisitos_codigos(config['codigos_item']['obligatorios']), ordenado)
+                patients_with_all = df_lab.loc[patients_mask, 'Numero_Documento_Paciente'].unique()
+            
+                # Si hay códigos opcionales, aplicar la misma lógica
+                if codigos_opcionales and len(codigos_opcionales) > 0:
+                    patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
+                    patients_final = set(patients_with_all) & set(patients_with_optional)
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
+                else:
+                    df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
+                print(f"📊 Registros finales (modo por defecto): {len(df_final):,}")
         
-    except yaml.YAMLError as e:
-        print(f"❌ Error al leer el archivo YAML: {e}")
-        return None
-    except Exception as e:
-        print(f"❌ Error inesperado al cargar configuración: {e}")
-        return None
+            # Pacientes que cumplen los códigos obligatorios (y los opcionales, si los hay)
+            registrar_procedencia(banderas, 'REQUERIDOS_PACIENTE', df_final.index)
+        else:
+            print(f"\n🔍 No se especificaron códigos obligatorios - no se aplica filtrado por códigos obligatorios")
+            df_final = df_lab.copy()
+            print(f"📊 Registros finales: {len(df_final):,}")
+    else:
+        # Si se aplicó algún filtro específico, usar directamente los datos filtrados
+        if aplicar_filtro_especifico:
+            print(f"\n🔍 Usando datos del filtro específico")
+        elif aplicar_filtro_perimetro:
+            print(f"\n🔍 Usando datos del filtro de perímetro")
+        elif aplicar_filtro_valoracion_clinica:
+            print(f"\n🔍 Usando datos del filtro de valoración clínica")
+        elif aplicar_filtro_valoracion_clinica_con_riesgo:
+            print(f"\n🔍 Usando datos del filtro de valoración clínica con factores de riesgo")
+        elif aplicar_filtro_expresion:
+            print(f"\n🔍 Usando datos del filtro por expresión")
+        else:
+            print(f"\n🔍 Usando datos sin filtros específicos")
+        df_final = df_clean.copy()
+        print(f"📊 Registros finales: {len(df_final):,}")
+    
+    if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion:
+        conteos['codigos'] = len(df_codes)
+        conteos['laboratorio'] = len(df_lab)
+    
+    # Columna de procedencia con las banderas que registraron la limpieza y las comprobaciones del filtro
+    procedencia = None
+    if banderas is not None:
+        procedencia = serie_procedencia(banderas)
+        print(f"\n🏷️  Banderas de procedencia registradas para {len(procedencia):,} registros")
+    
+    return {'df_final': df_final, 'procedencia': procedencia, 'seleccion_procedencia': estado['seleccion_procedencia'],
+            'conteos': conteos, 'categorias_codigo': estado['categorias_codigo']}
 
-def generate_unique_filename(base_filename):
-    """
-    Genera un nombre de archivo único con timestamp
-    """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    name, ext = os.path.splitext(base_filename)
-    return f"{name}_{timestamp}{ext}"
+# Etapas con punto de control, en orden (ver puntos_control.ETAPAS), y columna de registros de su estado
+ETAPAS_PROCESO = {
+    'lectura': (etapa_lectura, 'df', "Registros leídos"),
+    'limpieza': (etapa_limpieza, 'df_clean', "Registros limpios"),
+    'filtrado': (etapa_filtrado, 'df_final', "Registros filtrados"),
+}
 
-def classify_perimeter_abdominal(df, config):
+def ejecutar_etapas(contexto, etapa_reanudada, estado):
     """
-    Clasifica el perímetro abdominal según género y rangos específicos
-    Si fecha_atencion_activo es True, agrupa por paciente y fecha
+    Ejecuta las etapas con punto de control a partir de la siguiente a etapa_reanudada (estado: su estado guardado)
+    Cada etapa recibe el estado de la anterior y devuelve el suyo; después de cada una se guarda su punto de control.
+    Los patrones de códigos se resuelven en cuanto se conocen los códigos de los datos.
+    Devuelve el estado de la última etapa, o None si una etapa falla
     """
-    filtro_perimetro = config['filtro_perimetro']
-    clasificacion = filtro_perimetro['clasificacion_perimetro']
-    fecha_atencion_activo = filtro_perimetro.get('fecha_atencion_activo', False)
-    
-    # Crear nueva columna para clasificación
-    df['Clasificacion_Perimetro'] = 'NO_CLASIFICADO'
-    
-    if fecha_atencion_activo:
-        print(f"📅 Clasificando perímetro por paciente y fecha de atención...")
-        
-        # Agrupar por paciente y fecha para clasificación
-        for (patient_id, fecha), group in df.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion']):
-            # Clasificar por género femenino
-            mask_f = (group['Genero'] == 'F') & (group['Perimetro_Abdominal'].notna())
-            df.loc[(df['Numero_Documento_Paciente'] == patient_id) & 
-                   (df['Fecha_Atencion'] == fecha) & 
-                   mask_f & (df['Perimetro_Abdominal'] <= clasificacion['genero_femenino']['normal']), 
-                   'Clasificacion_Perimetro'] = 'NORMAL'
-            df.loc[(df['Numero_Documento_Paciente'] == patient_id) & 
-                   (df['Fecha_Atencion'] == fecha) & 
-                   mask_f & (df['Perimetro_Abdominal'] > clasificacion['genero_femenino']['anormal']), 
-                   'Clasificacion_Perimetro'] = 'ANORMAL'
-            
-            # Clasificar por género masculino
-            mask_m = (group['Genero'] == 'M') & (group['Perimetro_Abdominal'].notna())
-            df.loc[(df['Numero_Documento_Paciente'] == patient_id) & 
-                   (df['Fecha_Atencion'] == fecha) & 
-                   mask_m & (df['Perimetro_Abdominal'] <= clasificacion['genero_masculino']['normal']), 
-                   'Clasificacion_Perimetro'] = 'NORMAL'
-            df.loc[(df['Numero_Documento_Paciente'] == patient_id) & 
-                   (df['Fecha_Atencion'] == fecha) & 
-                   mask_m & (df['Perimetro_Abdominal'] > clasificacion['genero_masculino']['anormal']), 
-                   'Clasificacion_Perimetro'] = 'ANORMAL'
-    else:
-        print(f"📅 Clasificando perímetro por registro individual...")
-        
-        # Clasificar por género femenino
-        mask_f = (df['Genero'] == 'F') & (df['Perimetro_Abdominal'].notna())
-        df.loc[mask_f & (df['Perimetro_Abdominal'] <= clasificacion['genero_femenino']['normal']), 'Clasificacion_Perimetro'] = 'NORMAL'
-        df.loc[mask_f & (df['Perimetro_Abdominal'] > clasificacion['genero_femenino']['anormal']), 'Clasificacion_Perimetro'] = 'ANORMAL'
-        
-        # Clasificar por género masculino
-        mask_m = (df['Genero'] == 'M') & (df['Perimetro_Abdominal'].notna())
-        df.loc[mask_m & (df['Perimetro_Abdominal'] <= clasificacion['genero_masculino']['normal']), 'Clasificacion_Perimetro'] = 'NORMAL'
-        df.loc[mask_m & (df['Perimetro_Abdominal'] > clasificacion['genero_masculino']['anormal']), 'Clasificacion_Perimetro'] = 'ANORMAL'
-    
-    return df
+    config = contexto['config']
+    pendientes = ETAPAS if etapa_reanudada is None else ETAPAS[ETAPAS.index(etapa_reanudada) + 1:]
+    if etapa_reanudada is not None:
+        _, columna, texto = ETAPAS_PROCESO[etapa_reanudada]
+        print(f"✅ {texto} reutilizados: {len(estado[columna]):,}")
+        resolver_patrones_config(config, estado['categorias_codigo'])
+    for etapa in pendientes:
+        funcion, _, _ = ETAPAS_PROCESO[etapa]
+        estado = funcion(contexto, estado)
+        if estado is None:
+            return None
+        if contexto['claves_control']:
+            guardar_punto_control(contexto['puntos_control'], contexto['claves_control'], etapa, estado)
+        if etapa == 'lectura':
+            resolver_patrones_config(config, estado['categorias_codigo'])
+    return estado
 
-def process_medical_data():
+def process_medical_data(config_file="config.yaml", entrada_precargada=None):
     """
     Función principal que procesa los datos médicos completos
+    entrada_precargada: (df, lectura) ya leídos del archivo de entrada (cola de trabajos que comparten la
+    entrada); el DataFrame no se modifica. Se ignora con el historial SQLite y en modo fuera de memoria
     """
     try:
         print("=" * 80)
@@ -295,22 +2783,18 @@ def process_medical_data():
         print("=" * 80)
         
         # Cargar configuración desde YAML
-        config = load_config()
+        config = load_config(config_file)
         if config is None:
             print("❌ Error: No se pudo cargar la configuración")
             return False
         
         # Extraer valores de la configuración
-        codigos_obligatorios = config['codigos_item']['obligatorios']
-        codigos_opcionales = config['codigos_item']['opcionales']
-        todos_codigos = codigos_obligatorios + codigos_opcionales
         valores_lab = config['valores_laboratorio']
         modo_filtrado = config['filtrado_codigos']['modo']
         tipo_diagnostico = config['configuracion']['tipo_diagnostico']
         excel_file = config['configuracion']['archivo_entrada']
         base_output_file = config['configuracion']['archivo_salida']
         generar_nombre_unico = config['configuracion']['generar_nombre_unico']
-        columns_to_keep = config['columnas']
         validaciones = config.get('validaciones', {})
         
         # Configurar filtros
@@ -326,6 +2810,9 @@ def process_medical_data():
         filtro_valoracion_clinica_con_riesgo = config['filtro_valoracion_clinica_con_riesgo']
         aplicar_filtro_valoracion_clinica_con_riesgo = filtro_valoracion_clinica_con_riesgo['activo']
         
+        filtro_expresion = config['filtro_expresion']
+        aplicar_filtro_expresion = filtro_expresion['activo']
+        
         # Generar nombre único si está habilitado
         if generar_nombre_unico:
             final_file = generate_unique_filename(base_output_file)
@@ -341,665 +2828,95 @@ def process_medical_data():
             print(f"📁 Archivos disponibles en files/: {os.listdir('files') if os.path.exists('files') else 'Carpeta files/ no existe'}")
             return False
         
-        # PASO 2: Leer archivo Excel
-        print(f"\n📊 Leyendo archivo Excel: {excel_file}")
-        df = pd.read_excel(excel_file)
-        
-        print(f"✅ Registros originales: {len(df):,}")
-        print(f"📋 Columnas originales: {len(df.columns)}")
-        
-        # PASO 3: Aplicar filtro específico si está activo
-        if aplicar_filtro_especifico:
-            print(f"\n🎯 Aplicando filtro específico:")
-            print(f"   Tipo_Diagnostico: {filtro_especifico['tipo_diagnostico']}")
-            print(f"   Código_Item: {filtro_especifico['codigo_item_especifico']}")
-            if 'valor_lab_especifico' in filtro_especifico and filtro_especifico['valor_lab_especifico']:
-                print(f"   Valor_Lab: {filtro_especifico['valor_lab_especifico']}")
-            
-            # Aplicar filtros específicos básicos
-            df_filtered = df[
-                (df['Tipo_Diagnostico'].isin(filtro_especifico['tipo_diagnostico'])) &
-                (df['Codigo_Item'] == filtro_especifico['codigo_item_especifico'])
-            ].copy()
-            
-            # Aplicar filtro de Valor_Lab solo si está especificado
-            if 'valor_lab_especifico' in filtro_especifico and filtro_especifico['valor_lab_especifico']:
-                df_filtered = df_filtered[df_filtered['Valor_Lab'].isin(filtro_especifico['valor_lab_especifico'])].copy()
-            
-            print(f"📊 Registros después de filtros básicos: {len(df_filtered):,}")
-            
-            # Aplicar filtro por rango de fechas si está especificado
-            if filtro_especifico['fecha_atencion_rango'] and len(filtro_especifico['fecha_atencion_rango']) == 2:
-                fecha_inicio = filtro_especifico['fecha_atencion_rango'][0]
-                fecha_fin = filtro_especifico['fecha_atencion_rango'][1]
-                print(f"   Rango de fechas: {fecha_inicio} a {fecha_fin}")
-                
-                try:
-                    # Convertir fechas a datetime
-                    fecha_inicio_dt = pd.to_datetime(fecha_inicio)
-                    fecha_fin_dt = pd.to_datetime(fecha_fin)
-                    
-                    # Convertir Fecha_Atencion a datetime si no lo está
-                    df_filtered['Fecha_Atencion'] = pd.to_datetime(df_filtered['Fecha_Atencion'])
-                    
-                    # Aplicar filtro de rango de fechas
-                    df_filtered = df_filtered[
-                        (df_filtered['Fecha_Atencion'] >= fecha_inicio_dt) &
-                        (df_filtered['Fecha_Atencion'] <= fecha_fin_dt)
-                    ].copy()
-                    
-                    print(f"📊 Registros después del filtro de fechas: {len(df_filtered):,}")
-                    
-                    # Mostrar estadísticas de fechas
-                    if len(df_filtered) > 0:
-                        min_date = df_filtered['Fecha_Atencion'].min()
-                        max_date = df_filtered['Fecha_Atencion'].max()
-                        print(f"📅 Rango de fechas en datos filtrados: {min_date.date()} a {max_date.date()}")
-                    
-                except Exception as e:
-                    print(f"⚠️  Error al procesar filtro de fechas: {e}")
-                    print(f"📊 Continuando sin filtro de fechas...")
-            else:
-                print(f"   Rango de fechas: No especificado")
-            
-            # Aplicar filtro de presión arterial si está activo
-            if filtro_especifico['tipo_presion_arterial_activo']:
-                print(f"\n🩺 Aplicando filtro de presión arterial:")
-                print(f"   Tipos presión arterial: {filtro_especifico['tipo_presion_arterial']}")
-                
-                try:
-                    # Verificar que Id_Correlativo existe
-                    if 'Id_Correlativo' not in df_filtered.columns:
-                        print(f"❌ Error: Columna Id_Correlativo no encontrada")
-                        return False
-                    
-                    # Convertir Valor_Lab a numérico para cálculos
-                    df_filtered['Valor_Lab_Numeric'] = pd.to_numeric(df_filtered['Valor_Lab'], errors='coerce')
-                    
-                    # Calcular tipo de presión arterial por paciente y fecha
-                    print(f"📊 Calculando tipo de presión arterial por paciente y fecha...")
-                    
-                    # Obtener min y max Id_Correlativo por paciente y fecha
-                    patient_date_correlativo = df_filtered.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Id_Correlativo'].agg(['min', 'max']).reset_index()
-                    patient_date_correlativo.columns = ['Numero_Documento_Paciente', 'Fecha_Atencion', 'Id_Correlativo_Min', 'Id_Correlativo_Max']
-                    
-                    # Crear mapeo de tipo de presión arterial
-                    df_filtered = df_filtered.merge(patient_date_correlativo, on=['Numero_Documento_Paciente', 'Fecha_Atencion'], how='left')
-                    
-                    # Asignar tipo de presión arterial
-                    df_filtered['tipo_presion'] = 'D'  # Por defecto Diastólica
-                    df_filtered.loc[df_filtered['Id_Correlativo'] == df_filtered['Id_Correlativo_Min'], 'tipo_presion'] = 'S'
-                    
-                    # Calcular valor de presión
-                    df_filtered['valor_presion'] = 'NORMAL'
-                    df_filtered.loc[(df_filtered['tipo_presion'] == 'S') & (df_filtered['Valor_Lab_Numeric'] >= 140), 'valor_presion'] = 'ANORMAL'
-                    df_filtered.loc[(df_filtered['tipo_presion'] == 'D') & (df_filtered['Valor_Lab_Numeric'] >= 90), 'valor_presion'] = 'ANORMAL'
-                    
-                    # Calcular valor_presion_total por paciente y fecha
-                    print(f"📊 Calculando valor_presion_total por paciente y fecha...")
-                    
-                    # Crear agregación por paciente y fecha para determinar si hay algún valor ANORMAL
-                    patient_date_anormal = df_filtered.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['valor_presion'].apply(
-                        lambda x: 'ANORMAL' if 'ANORMAL' in x.values else 'NORMAL'
-                    ).reset_index()
-                    patient_date_anormal.columns = ['Numero_Documento_Paciente', 'Fecha_Atencion', 'valor_presion_total']
-                    
-                    # Merge con el dataframe principal
-                    df_filtered = df_filtered.merge(patient_date_anormal, on=['Numero_Documento_Paciente', 'Fecha_Atencion'], how='left')
-                    
-                    # Filtrar solo los tipos de presión arterial especificados
-                    df_filtered = df_filtered[df_filtered['tipo_presion'].isin(filtro_especifico['tipo_presion_arterial'])].copy()
-                    
-                    print(f"📊 Registros después del filtro de presión arterial: {len(df_filtered):,}")
-                    
-                    # Mostrar distribución de tipos de presión
-                    print(f"\n📊 Distribución de tipos de presión arterial:")
-                    presion_counts = df_filtered['tipo_presion'].value_counts()
-                    for tipo, count in presion_counts.items():
-                        print(f"  {tipo}: {count:,} registros")
-                    
-                    # Mostrar distribución de valores de presión
-                    print(f"\n📊 Distribución de valores de presión:")
-                    valor_counts = df_filtered['valor_presion'].value_counts()
-                    for valor, count in valor_counts.items():
-                        print(f"  {valor}: {count:,} registros")
-                    
-                    # Mostrar estadísticas por tipo
-                    print(f"\n📊 Estadísticas por tipo de presión:")
-                    for tipo in filtro_especifico['tipo_presion_arterial']:
-                        tipo_data = df_filtered[df_filtered['tipo_presion'] == tipo]
-                        if len(tipo_data) > 0:
-                            normal_count = len(tipo_data[tipo_data['valor_presion'] == 'NORMAL'])
-                            anormal_count = len(tipo_data[tipo_data['valor_presion'] == 'ANORMAL'])
-                            print(f"  {tipo}: Normal={normal_count}, Anormal={anormal_count}")
-                    
-                    # Mostrar distribución de valor_presion_total
-                    print(f"\n📊 Distribución de valor_presion_total:")
-                    total_counts = df_filtered['valor_presion_total'].value_counts()
-                    for valor, count in total_counts.items():
-                        print(f"  {valor}: {count:,} registros")
-                    
-                except Exception as e:
-                    print(f"⚠️  Error al procesar filtro de presión arterial: {e}")
-                    print(f"📊 Continuando sin filtro de presión arterial...")
-            else:
-                print(f"   Filtro presión arterial: INACTIVO")
-            
-            print(f"📊 Registros después del filtro específico completo: {len(df_filtered):,}")
-            
-            # Mostrar distribución de Tipo_Diagnostico
-            print(f"\n📊 Distribución de Tipo_Diagnostico:")
-            tipo_counts = df_filtered['Tipo_Diagnostico'].value_counts()
-            for tipo, count in tipo_counts.items():
-                print(f"  {tipo}: {count:,} registros")
-            
-            # Mostrar distribución de Valor_Lab
-            print(f"\n📊 Distribución de Valor_Lab:")
-            lab_counts = df_filtered['Valor_Lab'].value_counts()
-            for lab, count in lab_counts.items():
-                print(f"  {lab}: {count:,} registros")
-                
-        else:
-            # PASO 3: Filtrar por Tipo_Diagnostico (método original)
-            print(f"\n🔍 Filtrando registros con Tipo_Diagnostico = '{tipo_diagnostico}'")
-            df_filtered = df[df['Tipo_Diagnostico'] == tipo_diagnostico].copy()
-            print(f"📊 Registros con Tipo_Diagnostico = '{tipo_diagnostico}': {len(df_filtered):,}")
-        
-        # PASO 4: Seleccionar columnas específicas
-        print(f"\n🔧 Seleccionando columnas específicas: {columns_to_keep}")
-        
-        # Agregar columnas de presión arterial si el filtro está activo
-        if aplicar_filtro_especifico and filtro_especifico['tipo_presion_arterial_activo']:
-            additional_columns = ['tipo_presion', 'valor_presion', 'valor_presion_total']
-            columns_to_keep_extended = columns_to_keep + additional_columns
-            print(f"🔧 Agregando columnas de presión arterial: {additional_columns}")
-        else:
-            columns_to_keep_extended = columns_to_keep
-        
-        # Verificar que las columnas existen
-        missing_columns = [col for col in columns_to_keep_extended if col not in df_filtered.columns]
-        if missing_columns:
-            print(f"❌ Error: Columnas no encontradas: {missing_columns}")
+        # PASO 1.5: Buscar un resultado previo con la misma entrada y configuración
+        cache_config = config['cache_resultados']
+        clave_cache = None
+        if cache_config['activo'] and config['barrido_umbrales']['activo']:
+            print(f"\n🗄️  Caché de resultados omitida: el barrido de umbrales necesita procesar los registros")
+        elif cache_config['activo'] and config['transiciones']['activo']:
+            print(f"\n🗄️  Caché de resultados omitida: las transiciones necesitan procesar los registros")
+        elif cache_config['activo'] and config['conjuntos']['activo']:
+            print(f"\n🗄️  Caché de resultados omitida: los conjuntos de pacientes necesitan los registros limpios")
+        elif cache_config['activo']:
+            print(f"\n🗄️  Calculando huella de entrada y configuración...")
+            clave_cache = clave_resultado(excel_file, config, cache_config['directorio'])
+            entrada_cache = buscar_resultado(clave_cache, cache_config)
+            if entrada_cache:
+                ruta_resultado = entregar_resultado(entrada_cache, final_file, cache_config)
+                print(f"✅ Resultado encontrado en caché (clave {clave_cache[:12]}…)")
+                print(f"✅ Archivo final: {ruta_resultado} ({entrada_cache['bytes']:,} bytes)")
+                print(f"📊 Se omite el procesamiento: la entrada y la configuración no cambiaron")
+                return True
+            print(f"📊 Sin resultado en caché (clave {clave_cache[:12]}…), procesando...")
+        
+        # PASO 1.6: Modo fuera de memoria (dos pasadas por bloques, sin cargar el archivo completo)
+        if config['fuera_de_memoria']['activo']:
+            if config['barrido_umbrales']['activo']:
+                print(f"⚠️  El barrido de umbrales no está disponible en modo fuera de memoria; se omite")
+            if config['procedencia']['activo']:
+                print(f"⚠️  Las banderas de procedencia no están disponibles en modo fuera de memoria; se omiten")
+            if config['puntos_control']['activo']:
+                print(f"⚠️  Los puntos de control no están disponibles en modo fuera de memoria; se omiten")
+            if config['conjuntos']['activo']:
+                print(f"⚠️  Los conjuntos de pacientes no están disponibles en modo fuera de memoria; se omiten")
+            if not procesar_fuera_de_memoria(config, excel_file, final_file):
+                return False
+            if config['transiciones']['activo']:
+                columnas_transiciones = ['Numero_Documento_Paciente', 'Fecha_Atencion', 'valor_presion_total', 'Clasificacion_Perimetro']
+                ejecutar_transiciones(pd.read_csv(final_file, usecols=lambda columna: columna in columnas_transiciones), config)
+            if clave_cache:
+                expulsadas = guardar_resultado(clave_cache, final_file, cache_config)
+                print(f"🗄️  Resultado guardado en caché (clave {clave_cache[:12]}…)")
+                if expulsadas:
+                    print(f"🗄️  Entradas expulsadas de la caché: {expulsadas}")
+            return True
+        
+        # PASO 1.7: Puntos de control: continuar desde la última etapa guardada con la misma entrada y configuración
+        puntos_control = config['puntos_control']
+        claves_control = None
+        etapa_reanudada, estado_control = None, None
+        if puntos_control['activo']:
+            dependencias_lectura = predicados_historial(config) if detectar_formato(excel_file)[0] == 'sqlite' else None
+            claves_control = claves_puntos(excel_file, config, puntos_control['directorio'], dependencias_lectura)
+            if puntos_control['reanudar']:
+                etapa_reanudada, estado_control = ultimo_punto(puntos_control['directorio'], claves_control)
+            if etapa_reanudada:
+                print(f"\n⏯️  Reanudando desde el punto de control '{etapa_reanudada}' (clave {claves_control[etapa_reanudada][:12]}…)")
+                if config['barrido_umbrales']['activo'] and etapa_reanudada != 'lectura':
+                    print(f"⚠️  El barrido de umbrales se generó en la ejecución anterior y no se repite")
+                if config['conjuntos']['activo'] and etapa_reanudada == 'filtrado':
+                    print(f"⚠️  Los conjuntos de pacientes se generaron en la ejecución anterior y no se repiten")
+        
+        # PASO 1.8: Registros limpios compartidos por los perfiles con la misma entrada y los mismos ajustes de limpieza
+        clave_limpios = None
+        if (etapa_reanudada is None and cache_config['activo'] and cache_config['limpieza']
+                and not config['barrido_umbrales']['activo'] and not config['procedencia']['activo']):
+            clave_limpios = clave_limpieza(excel_file, ajustes_limpieza(config), cache_config['directorio'])
+            estado_limpio = buscar_limpieza(clave_limpios, cache_config)
+            if estado_limpio is not None:
+                print(f"\n🗄️  Registros limpios encontrados en caché (clave {clave_limpios[:12]}…): se omiten la lectura y la limpieza")
+                etapa_reanudada = 'limpieza'
+                estado_control = dict(estado_limpio, banderas=None, seleccion_procedencia=None)
+                clave_limpios = None
+        
+        # PASO 2 a 9: etapas de lectura, limpieza y filtrado, desde la siguiente a la reanudada
+        contexto = {'config': config, 'excel_file': excel_file, 'entrada_precargada': entrada_precargada,
+                    'cache_config': cache_config, 'clave_limpios': clave_limpios,
+                    'puntos_control': puntos_control, 'claves_control': claves_control}
+        estado = ejecutar_etapas(contexto, etapa_reanudada, estado_control)
+        if estado is None:
             return False
+        df_final, conteos = estado['df_final'], estado['conteos']
+        procedencia, seleccion_procedencia = estado['procedencia'], estado['seleccion_procedencia']
         
-        df_selected = df_filtered[columns_to_keep_extended].copy()
-        print(f"📊 Registros después de seleccionar columnas: {len(df_selected):,}")
-        
-        # PASO 5: Eliminar registros nulos de Numero_Documento_Paciente
-        print(f"\n🧹 Eliminando registros nulos de Numero_Documento_Paciente")
-        null_count = df_selected['Numero_Documento_Paciente'].isnull().sum()
-        print(f"📊 Registros nulos en Numero_Documento_Paciente: {null_count:,}")
-        
-        df_clean = df_selected.dropna(subset=['Numero_Documento_Paciente'])
-        print(f"📊 Registros después de eliminar nulos: {len(df_clean):,}")
-        
-        # PASO 6: Aplicar reglas de calidad de datos
-        print(f"\n🔧 Aplicando reglas de calidad de datos...")
-        
-        # Regla 1: Convertir Numero_Documento_Paciente a numérico
-        df_clean['Numero_Documento_Paciente'] = pd.to_numeric(df_clean['Numero_Documento_Paciente'], errors='coerce')
-        df_clean = df_clean.dropna(subset=['Numero_Documento_Paciente'])
-        print(f"📊 Registros después de conversión numérica: {len(df_clean):,}")
-        
-        # Regla 2: Validar rango de edad
+        # Códigos con los patrones ya resueltos, para las reglas finales y el resumen
+        codigos_obligatorios = codigos_planos(config['codigos_item']['obligatorios'])
+        codigos_opcionales = codigos_planos(config['codigos_item']['opcionales'])
+        todos_codigos = codigos_obligatorios + codigos_opcionales
+        aplicar_procedencia = config['procedencia']['activo']
         edad_min = validaciones.get('edad_minima', 0)
         edad_max = validaciones.get('edad_maxima', 120)
-        if 'Edad_Reg' in df_clean.columns:
-            df_clean = df_clean[(df_clean['Edad_Reg'] >= edad_min) & (df_clean['Edad_Reg'] <= edad_max)]
-            print(f"📊 Registros después de validación de edad ({edad_min}-{edad_max}): {len(df_clean):,}")
-        
-        # Regla 3: Validar género
-        generos_validos = validaciones.get('generos_validos', ['M', 'F'])
-        if 'Genero' in df_clean.columns:
-            df_clean = df_clean[df_clean['Genero'].isin(generos_validos)]
-            print(f"📊 Registros después de validación de género: {len(df_clean):,}")
-        
-        # Regla 4: Validar formato de fecha
-        if 'Fecha_Atencion' in df_clean.columns:
-            # Convertir a datetime y verificar fechas válidas
-            df_clean['Fecha_Atencion'] = pd.to_datetime(df_clean['Fecha_Atencion'], errors='coerce')
-            df_clean = df_clean.dropna(subset=['Fecha_Atencion'])
-            print(f"📊 Registros después de validación de fecha: {len(df_clean):,}")
-        
-        # PASO 7: Aplicar filtro de perímetro si está activo
-        if aplicar_filtro_perimetro:
-            print(f"\n📏 Aplicando filtro de perímetro abdominal:")
-            print(f"   Códigos requeridos: {filtro_perimetro['codigos_requeridos']}")
-            print(f"   Modo de filtrado: {filtro_perimetro['modo_filtrado']}")
-            if filtro_perimetro.get('fecha_atencion_activo', False):
-                print(f"   Filtro por fecha de atención: ACTIVO")
-            else:
-                print(f"   Filtro por fecha de atención: INACTIVO")
-            
-            # Filtrar por códigos requeridos
-            df_perimetro = df_clean[df_clean['Codigo_Item'].isin(filtro_perimetro['codigos_requeridos'])].copy()
-            print(f"📊 Registros con códigos de perímetro: {len(df_perimetro):,}")
-            
-            # Mostrar distribución de códigos
-            print(f"\n📊 Distribución de códigos de perímetro:")
-            code_counts = df_perimetro['Codigo_Item'].value_counts()
-            for code, count in code_counts.items():
-                print(f"  {code}: {count:,} registros")
-            
-            # Verificar completitud de códigos por paciente y fecha
-            if filtro_perimetro.get('fecha_atencion_activo', False):
-                print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
-                
-                # Agrupar por paciente y fecha para verificar códigos
-                patient_date_codes = df_perimetro.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Codigo_Item'].apply(set)
-                
-                # Filtrar solo grupos que tienen TODOS los códigos requeridos
-                complete_groups = patient_date_codes[patient_date_codes.apply(lambda x: set(filtro_perimetro['codigos_requeridos']).issubset(x))]
-                
-                print(f"📊 Grupos (paciente-fecha) con TODOS los códigos: {len(complete_groups):,}")
-                
-                # Crear lista de (paciente, fecha) que tienen todos los códigos
-                complete_patient_dates = complete_groups.index.tolist()
-                
-                # Filtrar registros que pertenecen a grupos completos
-                df_perimetro = df_perimetro[df_perimetro.set_index(['Numero_Documento_Paciente', 'Fecha_Atencion']).index.isin(complete_patient_dates)].copy()
-                
-                print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_perimetro):,}")
-                
-                # Mostrar estadísticas de grupos eliminados
-                total_groups_before = len(patient_date_codes)
-                groups_removed = total_groups_before - len(complete_groups)
-                print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
-            
-            # Aplicar filtrado de pacientes según modo
-            if filtro_perimetro['modo_filtrado'] == "todos":
-                print(f"📋 Filtrando pacientes con TODOS los códigos de perímetro: {filtro_perimetro['codigos_requeridos']}")
-                patients_with_codes = df_perimetro.groupby('Numero_Documento_Paciente')['Codigo_Item'].apply(set)
-                patients_with_all = patients_with_codes[patients_with_codes.apply(lambda x: set(filtro_perimetro['codigos_requeridos']).issubset(x))].index
-                print(f"👥 Pacientes con TODOS los códigos de perímetro: {len(patients_with_all):,}")
-                
-                # Filtrar solo los registros de pacientes que tienen todos los códigos
-                df_perimetro = df_perimetro[df_perimetro['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
-                print(f"📊 Registros después de filtrado de pacientes: {len(df_perimetro):,}")
-            
-            # Clasificar perímetro abdominal
-            df_perimetro = classify_perimeter_abdominal(df_perimetro, config)
-            
-            # Mostrar distribución de clasificación
-            print(f"\n📊 Distribución de clasificación de perímetro:")
-            clasif_counts = df_perimetro['Clasificacion_Perimetro'].value_counts()
-            for clasif, count in clasif_counts.items():
-                print(f"  {clasif}: {count:,} registros")
-            
-            # Mostrar estadísticas por género
-            print(f"\n📊 Estadísticas de perímetro por género:")
-            for genero in ['F', 'M']:
-                df_genero = df_perimetro[df_perimetro['Genero'] == genero]
-                if len(df_genero) > 0:
-                    normal_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'NORMAL'])
-                    anormal_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'ANORMAL'])
-                    no_clasif_count = len(df_genero[df_genero['Clasificacion_Perimetro'] == 'NO_CLASIFICADO'])
-                    print(f"  Género {genero}: Normal={normal_count}, Anormal={anormal_count}, No clasificado={no_clasif_count}")
-            
-            # Usar datos del filtro de perímetro
-            df_final = df_perimetro.copy()
-            print(f"📊 Registros finales del filtro de perímetro: {len(df_final):,}")
-            
-        # PASO 8: Aplicar filtro de valoración clínica si está activo
-        elif aplicar_filtro_valoracion_clinica:
-            print(f"\n🏥 Aplicando filtro de valoración clínica sin factores de riesgo:")
-            print(f"   Códigos requeridos: {filtro_valoracion_clinica['codigos_requeridos']}")
-            print(f"   Modo de filtrado: {filtro_valoracion_clinica['modo_filtrado']}")
-            if filtro_valoracion_clinica.get('valor_lab_especifico'):
-                print(f"   Valor_Lab específico: {filtro_valoracion_clinica['valor_lab_especifico']}")
-            if filtro_valoracion_clinica.get('fecha_atencion_activo', False):
-                print(f"   Filtro por fecha de atención: ACTIVO")
-            else:
-                print(f"   Filtro por fecha de atención: INACTIVO")
-            
-            # Filtrar por códigos requeridos
-            df_valoracion = df_clean[df_clean['Codigo_Item'].isin(filtro_valoracion_clinica['codigos_requeridos'])].copy()
-            print(f"📊 Registros con códigos de valoración clínica: {len(df_valoracion):,}")
-            
-            # Mostrar distribución de códigos
-            print(f"\n📊 Distribución de códigos de valoración clínica:")
-            code_counts = df_valoracion['Codigo_Item'].value_counts()
-            for code, count in code_counts.items():
-                print(f"  {code}: {count:,} registros")
-            
-            # Aplicar filtro de Valor_Lab específico si está configurado
-            if filtro_valoracion_clinica.get('valor_lab_especifico'):
-                print(f"\n🔍 Aplicando filtro de Valor_Lab específico:")
-                print(f"   Valor_Lab requerido: {filtro_valoracion_clinica['valor_lab_especifico']}")
-                
-                # Filtrar registros Z006 que no tienen el Valor_Lab específico
-                z006_records = df_valoracion[df_valoracion['Codigo_Item'] == 'Z006']
-                z006_with_specific_lab = z006_records[z006_records['Valor_Lab'].isin(filtro_valoracion_clinica['valor_lab_especifico'])]
-                
-                print(f"📊 Registros Z006 con Valor_Lab específico: {len(z006_with_specific_lab):,}")
-                print(f"📊 Registros Z006 eliminados: {len(z006_records) - len(z006_with_specific_lab):,}")
-                
-                # Mantener solo registros Z006 con Valor_Lab específico y todos los otros códigos
-                other_codes = df_valoracion[df_valoracion['Codigo_Item'] != 'Z006']
-                df_valoracion = pd.concat([other_codes, z006_with_specific_lab], ignore_index=True)
-                print(f"📊 Registros después de filtro Valor_Lab específico: {len(df_valoracion):,}")
-            
-            # Verificar completitud de códigos por paciente y fecha si está activo
-            if filtro_valoracion_clinica.get('fecha_atencion_activo', False):
-                print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
-                
-                # Agrupar por paciente y fecha para verificar códigos
-                patient_date_codes = df_valoracion.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Codigo_Item'].apply(set)
-                
-                # Filtrar solo grupos que tienen TODOS los códigos requeridos
-                complete_groups = patient_date_codes[patient_date_codes.apply(lambda x: set(filtro_valoracion_clinica['codigos_requeridos']).issubset(x))]
-                
-                print(f"📊 Grupos (paciente-fecha) con TODOS los códigos: {len(complete_groups):,}")
-                
-                # Crear lista de (paciente, fecha) que tienen todos los códigos
-                complete_patient_dates = complete_groups.index.tolist()
-                
-                # Filtrar registros que pertenecen a grupos completos
-                df_valoracion = df_valoracion[df_valoracion.set_index(['Numero_Documento_Paciente', 'Fecha_Atencion']).index.isin(complete_patient_dates)].copy()
-                
-                print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_valoracion):,}")
-                
-                # Mostrar estadísticas de grupos eliminados
-                total_groups_before = len(patient_date_codes)
-                groups_removed = total_groups_before - len(complete_groups)
-                print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
-            
-            # Aplicar filtrado de pacientes según modo
-            if filtro_valoracion_clinica['modo_filtrado'] == "todos":
-                print(f"📋 Filtrando pacientes con TODOS los códigos de valoración clínica: {filtro_valoracion_clinica['codigos_requeridos']}")
-                patients_with_codes = df_valoracion.groupby('Numero_Documento_Paciente')['Codigo_Item'].apply(set)
-                patients_with_all = patients_with_codes[patients_with_codes.apply(lambda x: set(filtro_valoracion_clinica['codigos_requeridos']).issubset(x))].index
-                print(f"👥 Pacientes con TODOS los códigos de valoración clínica: {len(patients_with_all):,}")
-                
-                # Filtrar solo los registros de pacientes que tienen todos los códigos
-                df_valoracion = df_valoracion[df_valoracion['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
-                print(f"📊 Registros después de filtrado de pacientes: {len(df_valoracion):,}")
-            
-            # Usar datos del filtro de valoración clínica
-            df_final = df_valoracion.copy()
-            print(f"📊 Registros finales del filtro de valoración clínica: {len(df_final):,}")
-            
-        # PASO 8.5: Aplicar filtro de valoración clínica con factores de riesgo si está activo
-        elif aplicar_filtro_valoracion_clinica_con_riesgo:
-            print(f"\n🏥 Aplicando filtro de valoración clínica con factores de riesgo:")
-            print(f"   Códigos requeridos: {filtro_valoracion_clinica_con_riesgo['codigos_requeridos']}")
-            print(f"   Códigos de factores de riesgo: {filtro_valoracion_clinica_con_riesgo['codigos_factores_riesgo']}")
-            print(f"   Modo de filtrado: {filtro_valoracion_clinica_con_riesgo['modo_filtrado']}")
-            if filtro_valoracion_clinica_con_riesgo.get('valor_lab_especifico'):
-                print(f"   Valor_Lab específico: {filtro_valoracion_clinica_con_riesgo['valor_lab_especifico']}")
-            if filtro_valoracion_clinica_con_riesgo.get('fecha_atencion_activo', False):
-                print(f"   Filtro por fecha de atención: ACTIVO")
-            else:
-                print(f"   Filtro por fecha de atención: INACTIVO")
-            
-            # Filtrar por códigos requeridos (Z019)
-            df_valoracion_con_riesgo = df_clean[df_clean['Codigo_Item'].isin(filtro_valoracion_clinica_con_riesgo['codigos_requeridos'])].copy()
-            print(f"📊 Registros con códigos requeridos (Z019): {len(df_valoracion_con_riesgo):,}")
-            
-            # Mostrar distribución de códigos requeridos
-            print(f"\n📊 Distribución de códigos requeridos:")
-            code_counts = df_valoracion_con_riesgo['Codigo_Item'].value_counts()
-            for code, count in code_counts.items():
-                print(f"  {code}: {count:,} registros")
-            
-            # Filtrar por códigos de factores de riesgo (solo si existen)
-            codigos_factores_riesgo = filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', [])
-            
-            if codigos_factores_riesgo:
-                df_factores_riesgo = df_clean[df_clean['Codigo_Item'].isin(codigos_factores_riesgo)].copy()
-                print(f"📊 Registros con códigos de factores de riesgo: {len(df_factores_riesgo):,}")
-                
-                # Mostrar distribución de códigos de factores de riesgo
-                print(f"\n📊 Distribución de códigos de factores de riesgo:")
-                riesgo_counts = df_factores_riesgo['Codigo_Item'].value_counts()
-                for code, count in riesgo_counts.items():
-                    print(f"  {code}: {count:,} registros")
-                
-                # Aplicar filtro de Valor_Lab específico si está configurado
-                if filtro_valoracion_clinica_con_riesgo.get('valor_lab_especifico'):
-                    print(f"\n🔍 Aplicando filtro de Valor_Lab específico a códigos de factores de riesgo:")
-                    print(f"   Valor_Lab requerido: {filtro_valoracion_clinica_con_riesgo['valor_lab_especifico']}")
-                    
-                    # Filtrar registros de factores de riesgo que no tienen el Valor_Lab específico
-                    factores_riesgo_with_specific_lab = df_factores_riesgo[df_factores_riesgo['Valor_Lab'].isin(filtro_valoracion_clinica_con_riesgo['valor_lab_especifico'])]
-                    
-                    print(f"📊 Registros de factores de riesgo con Valor_Lab específico: {len(factores_riesgo_with_specific_lab):,}")
-                    print(f"📊 Registros de factores de riesgo eliminados: {len(df_factores_riesgo) - len(factores_riesgo_with_specific_lab):,}")
-                    
-                    # Actualizar df_factores_riesgo con solo los registros que tienen el Valor_Lab específico
-                    df_factores_riesgo = factores_riesgo_with_specific_lab.copy()
-                    print(f"📊 Registros de factores de riesgo después de filtro Valor_Lab específico: {len(df_factores_riesgo):,}")
-            else:
-                print(f"⚠️  No hay códigos de factores de riesgo configurados, saltando filtrado de factores de riesgo")
-                df_factores_riesgo = pd.DataFrame()  # DataFrame vacío
-            
-            # Verificar completitud de códigos por paciente y fecha si está activo
-            if filtro_valoracion_clinica_con_riesgo.get('fecha_atencion_activo', False):
-                print(f"\n📅 Verificando completitud de códigos por paciente y fecha...")
-                
-                # Verificar si hay códigos de factores de riesgo
-                codigos_factores_riesgo = filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', [])
-                
-                if codigos_factores_riesgo:
-                    # Combinar códigos requeridos y de factores de riesgo para verificar completitud
-                    todos_codigos_riesgo = filtro_valoracion_clinica_con_riesgo['codigos_requeridos'] + codigos_factores_riesgo
-                    
-                    # Filtrar registros que tienen códigos requeridos o de factores de riesgo
-                    df_todos_codigos = df_clean[df_clean['Codigo_Item'].isin(todos_codigos_riesgo)].copy()
-                    
-                    # Agrupar por paciente y fecha para verificar códigos
-                    patient_date_codes = df_todos_codigos.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Codigo_Item'].apply(set)
-                    
-                    # Filtrar solo grupos que tienen al menos un código requerido Y al menos un factor de riesgo
-                    def has_required_and_risk_codes(codes):
-                        has_required = any(code in codes for code in filtro_valoracion_clinica_con_riesgo['codigos_requeridos'])
-                        has_risk = any(code in codes for code in codigos_factores_riesgo)
-                        return has_required and has_risk
-                    
-                    complete_groups = patient_date_codes[patient_date_codes.apply(has_required_and_risk_codes)]
-                    
-                    print(f"📊 Grupos (paciente-fecha) con códigos requeridos Y factores de riesgo: {len(complete_groups):,}")
-                else:
-                    # Si no hay códigos de factores de riesgo, solo verificar códigos requeridos
-                    print(f"⚠️  No hay códigos de factores de riesgo configurados, solo verificando códigos requeridos")
-                    
-                    # Filtrar registros que tienen códigos requeridos
-                    df_todos_codigos = df_clean[df_clean['Codigo_Item'].isin(filtro_valoracion_clinica_con_riesgo['codigos_requeridos'])].copy()
-                    
-                    # Agrupar por paciente y fecha para verificar códigos
-                    patient_date_codes = df_todos_codigos.groupby(['Numero_Documento_Paciente', 'Fecha_Atencion'])['Codigo_Item'].apply(set)
-                    
-                    # Filtrar solo grupos que tienen TODOS los códigos requeridos
-                    def has_all_required_codes(codes):
-                        return set(filtro_valoracion_clinica_con_riesgo['codigos_requeridos']).issubset(codes)
-                    
-                    complete_groups = patient_date_codes[patient_date_codes.apply(has_all_required_codes)]
-                    
-                    print(f"📊 Grupos (paciente-fecha) con TODOS los códigos requeridos: {len(complete_groups):,}")
-                
-                # Crear lista de (paciente, fecha) que tienen códigos completos
-                complete_patient_dates = complete_groups.index.tolist()
-                
-                # Filtrar registros que pertenecen a grupos completos
-                df_todos_codigos = df_todos_codigos[df_todos_codigos.set_index(['Numero_Documento_Paciente', 'Fecha_Atencion']).index.isin(complete_patient_dates)].copy()
-                
-                print(f"📊 Registros después de filtrado por completitud de códigos por fecha: {len(df_todos_codigos):,}")
-                
-                # Mostrar estadísticas de grupos eliminados
-                total_groups_before = len(patient_date_codes)
-                groups_removed = total_groups_before - len(complete_groups)
-                print(f"📊 Grupos (paciente-fecha) eliminados por códigos incompletos: {groups_removed:,}")
-                
-                # Usar los datos filtrados por fecha
-                df_final = df_todos_codigos.copy()
-            else:
-                # Obtener pacientes que tienen códigos requeridos
-                pacientes_con_requeridos = df_valoracion_con_riesgo['Numero_Documento_Paciente'].unique()
-                print(f"👥 Pacientes con códigos requeridos: {len(pacientes_con_requeridos):,}")
-                
-                # Verificar si hay códigos de factores de riesgo
-                codigos_factores_riesgo = filtro_valoracion_clinica_con_riesgo.get('codigos_factores_riesgo', [])
-                
-                if codigos_factores_riesgo:
-                    # Obtener pacientes que tienen al menos un factor de riesgo
-                    pacientes_con_riesgo = df_factores_riesgo['Numero_Documento_Paciente'].unique()
-                    print(f"👥 Pacientes con factores de riesgo: {len(pacientes_con_riesgo):,}")
-                    
-                    # Pacientes que tienen códigos requeridos Y al menos un factor de riesgo
-                    pacientes_finales = set(pacientes_con_requeridos) & set(pacientes_con_riesgo)
-                    print(f"👥 Pacientes con códigos requeridos Y factores de riesgo: {len(pacientes_finales):,}")
-                else:
-                    # Si no hay códigos de factores de riesgo, solo usar pacientes con códigos requeridos
-                    print(f"⚠️  No hay códigos de factores de riesgo configurados, usando solo códigos requeridos")
-                    pacientes_finales = set(pacientes_con_requeridos)
-                    print(f"👥 Pacientes con códigos requeridos: {len(pacientes_finales):,}")
-                
-                # Filtrar registros de pacientes que cumplen los criterios
-                df_final = df_clean[df_clean['Numero_Documento_Paciente'].isin(pacientes_finales)].copy()
-            
-            print(f"📊 Registros finales del filtro de valoración clínica con factores de riesgo: {len(df_final):,}")
-            
-        # PASO 9: Aplicar filtros adicionales solo si no se aplicó ningún filtro específico
-        elif not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo:
-            # Filtrar por códigos específicos (si se especificaron)
-            if todos_codigos:
-                print(f"\n🎯 Filtrando registros con códigos:")
-                if codigos_obligatorios:
-                    print(f"   Obligatorios: {codigos_obligatorios}")
-                if codigos_opcionales:
-                    print(f"   Opcionales: {codigos_opcionales}")
-                
-                df_codes = df_clean[df_clean['Codigo_Item'].isin(todos_codigos)].copy()
-                print(f"📊 Registros con códigos específicos: {len(df_codes):,}")
-                
-                # Mostrar distribución de códigos
-                print(f"\n📊 Distribución de códigos encontrados:")
-                code_counts = df_codes['Codigo_Item'].value_counts()
-                for code, count in code_counts.items():
-                    status = "OBLIGATORIO" if code in codigos_obligatorios else "OPCIONAL"
-                    print(f"  {code} ({status}): {count:,} registros")
-            else:
-                print(f"\n🎯 No se especificaron códigos de filtrado - considerando todos los códigos")
-                df_codes = df_clean.copy()
-                print(f"📊 Registros después de limpieza: {len(df_codes):,}")
-                
-                # Mostrar todos los códigos disponibles
-                print(f"\n📊 Todos los códigos disponibles:")
-                all_codes = df_codes['Codigo_Item'].value_counts()
-                for code, count in all_codes.head(10).items():
-                    print(f"  {code}: {count:,} registros")
-                if len(all_codes) > 10:
-                    print(f"  ... y {len(all_codes) - 10} códigos más")
-            
-            # Filtrar por valores de laboratorio (si se especificaron)
-            if valores_lab:
-                print(f"\n🔬 Filtrando registros con valores de laboratorio: {valores_lab}")
-                df_lab = df_codes[df_codes['Valor_Lab'].isin(valores_lab)].copy()
-                print(f"📊 Registros con valores de laboratorio específicos: {len(df_lab):,}")
-                
-                # Mostrar distribución de valores de laboratorio
-                print(f"\n📊 Distribución de valores de laboratorio encontrados:")
-                lab_counts = df_lab['Valor_Lab'].value_counts()
-                for lab, count in lab_counts.items():
-                    print(f"  {lab}: {count:,} registros")
-            else:
-                print(f"\n🔬 No se especificaron valores de laboratorio - considerando todos los valores")
-                df_lab = df_codes.copy()
-                print(f"📊 Registros después de filtrado de códigos: {len(df_lab):,}")
-                
-                # Mostrar todos los valores de laboratorio disponibles
-                print(f"\n📊 Todos los valores de laboratorio disponibles:")
-                all_labs = df_lab['Valor_Lab'].value_counts()
-                for lab, count in all_labs.head(10).items():
-                    print(f"  {lab}: {count:,} registros")
-                if len(all_labs) > 10:
-                    print(f"  ... y {len(all_labs) - 10} valores más")
-            
-            # Aplicar filtrado de pacientes según códigos obligatorios y opcionales
-            if codigos_obligatorios and len(codigos_obligatorios) > 0:
-                print(f"\n🔍 Aplicando filtrado de pacientes por códigos obligatorios - Modo: {modo_filtrado}")
-                print(f"📋 Códigos obligatorios: {codigos_obligatorios}")
-                if codigos_opcionales:
-                    print(f"📋 Códigos opcionales: {codigos_opcionales}")
-                
-                if modo_filtrado == "todos":
-                    print(f"📋 Filtrando pacientes con TODOS los códigos obligatorios: {codigos_obligatorios}")
-                    patients_with_codes = df_lab.groupby('Numero_Documento_Paciente')['Codigo_Item'].apply(set)
-                    patients_with_all = patients_with_codes[patients_with_codes.apply(lambda x: set(codigos_obligatorios).issubset(x))].index
-                    print(f"👥 Pacientes con TODOS los códigos obligatorios: {len(patients_with_all):,}")
-                    
-                    # Si hay códigos opcionales, filtrar pacientes que tienen al menos uno de los opcionales
-                    if codigos_opcionales and len(codigos_opcionales) > 0:
-                        print(f"📋 Filtrando pacientes con al menos UNO de los códigos opcionales: {codigos_opcionales}")
-                        patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
-                        print(f"👥 Pacientes con códigos opcionales: {len(patients_with_optional):,}")
-                        
-                        # Pacientes que tienen TODOS los obligatorios Y al menos uno opcional
-                        patients_final = set(patients_with_all) & set(patients_with_optional)
-                        print(f"👥 Pacientes con TODOS los obligatorios Y al menos uno opcional: {len(patients_final):,}")
-                        
-                        # Filtrar solo los registros de pacientes que cumplen ambos criterios
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
-                        print(f"📊 Registros finales (pacientes con obligatorios + opcionales): {len(df_final):,}")
-                    else:
-                        # Solo códigos obligatorios, sin opcionales
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
-                        print(f"📊 Registros finales (pacientes con TODOS los códigos obligatorios): {len(df_final):,}")
-                    
-                elif modo_filtrado == "cualquiera":
-                    print(f"📋 Filtrando pacientes con CUALQUIERA de los códigos obligatorios: {codigos_obligatorios}")
-                    patients_with_any = df_lab[df_lab['Codigo_Item'].isin(codigos_obligatorios)]['Numero_Documento_Paciente'].unique()
-                    print(f"👥 Pacientes con CUALQUIERA de los códigos obligatorios: {len(patients_with_any):,}")
-                    
-                    # Si hay códigos opcionales, filtrar pacientes que tienen al menos uno de los opcionales
-                    if codigos_opcionales and len(codigos_opcionales) > 0:
-                        print(f"📋 Filtrando pacientes con al menos UNO de los códigos opcionales: {codigos_opcionales}")
-                        patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
-                        print(f"👥 Pacientes con códigos opcionales: {len(patients_with_optional):,}")
-                        
-                        # Pacientes que tienen CUALQUIERA de los obligatorios Y al menos uno opcional
-                        patients_final = set(patients_with_any) & set(patients_with_optional)
-                        print(f"👥 Pacientes con CUALQUIERA de los obligatorios Y al menos uno opcional: {len(patients_final):,}")
-                        
-                        # Filtrar solo los registros de pacientes que cumplen ambos criterios
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
-                        print(f"📊 Registros finales (pacientes con obligatorios + opcionales): {len(df_final):,}")
-                    else:
-                        # Solo códigos obligatorios, sin opcionales
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_any)].copy()
-                        print(f"📊 Registros finales (pacientes con CUALQUIERA de los códigos obligatorios): {len(df_final):,}")
-                    
-                else:
-                    print(f"⚠️  Modo de filtrado '{modo_filtrado}' no reconocido. Usando modo 'todos' por defecto.")
-                    patients_with_codes = df_lab.groupby('Numero_Documento_Paciente')['Codigo_Item'].apply(set)
-                    patients_with_all = patients_with_codes[patients_with_codes.apply(lambda x: set(codigos_obligatorios).issubset(x))].index
-                    
-                    # Si hay códigos opcionales, aplicar la misma lógica
-                    if codigos_opcionales and len(codigos_opcionales) > 0:
-                        patients_with_optional = df_lab[df_lab['Codigo_Item'].isin(codigos_opcionales)]['Numero_Documento_Paciente'].unique()
-                        patients_final = set(patients_with_all) & set(patients_with_optional)
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_final)].copy()
-                    else:
-                        df_final = df_lab[df_lab['Numero_Documento_Paciente'].isin(patients_with_all)].copy()
-                    print(f"📊 Registros finales (modo por defecto): {len(df_final):,}")
-            else:
-                print(f"\n🔍 No se especificaron códigos obligatorios - no se aplica filtrado por códigos obligatorios")
-                df_final = df_lab.copy()
-                print(f"📊 Registros finales: {len(df_final):,}")
-        else:
-            # Si se aplicó algún filtro específico, usar directamente los datos filtrados
-            if aplicar_filtro_especifico:
-                print(f"\n🔍 Usando datos del filtro específico")
-            elif aplicar_filtro_perimetro:
-                print(f"\n🔍 Usando datos del filtro de perímetro")
-            elif aplicar_filtro_valoracion_clinica:
-                print(f"\n🔍 Usando datos del filtro de valoración clínica")
-            elif aplicar_filtro_valoracion_clinica_con_riesgo:
-                print(f"\n🔍 Usando datos del filtro de valoración clínica con factores de riesgo")
-            else:
-                print(f"\n🔍 Usando datos sin filtros específicos")
-            df_final = df_clean.copy()
-            print(f"📊 Registros finales: {len(df_final):,}")
+        entrada_ordenada = config['configuracion']['entrada_ordenada']
         
         # PASO 9: Aplicar formato numérico entero
         print(f"\n🔧 Aplicando formato numérico entero a Numero_Documento_Paciente...")
@@ -1007,8 +2924,11 @@ def process_medical_data():
         
         # PASO 10: Ordenar por Numero_Documento_Paciente y 
         
-        print(f"\n📋 Ordenando registros por Numero_Documento_Paciente y Fecha_Atencion...")
-        df_final = df_final.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'])
+        if entrada_ordenada is not False and esta_ordenado(df_final):
+            print(f"\n📋 Registros ya ordenados por Numero_Documento_Paciente y Fecha_Atencion: se omite el ordenamiento")
+        else:
+            print(f"\n📋 Ordenando registros por Numero_Documento_Paciente y Fecha_Atencion...")
+            df_final = df_final.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'])
         
         # PASO 11: Aplicar reglas finales de calidad
         print(f"\n🔧 Aplicando reglas finales de calidad...")
@@ -1028,21 +2948,21 @@ def process_medical_data():
                 df_final = df_final[(df_final['Edad_Reg'] >= edad_min) & (df_final['Edad_Reg'] <= edad_max)]
         
         # Verificar formato de códigos (solo si se especificaron y no se aplicó filtro específico)
-        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and todos_codigos and 'Codigo_Item' in df_final.columns:
+        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion and todos_codigos and 'Codigo_Item' in df_final.columns:
             invalid_codes = df_final[~df_final['Codigo_Item'].isin(todos_codigos)]
             if len(invalid_codes) > 0:
                 print(f"⚠️  Registros con códigos inválidos: {len(invalid_codes)}")
                 df_final = df_final[df_final['Codigo_Item'].isin(todos_codigos)]
         
         # Verificar valores de laboratorio (solo si se especificaron y no se aplicó filtro específico)
-        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and valores_lab and 'Valor_Lab' in df_final.columns:
+        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion and valores_lab and 'Valor_Lab' in df_final.columns:
             invalid_labs = df_final[~df_final['Valor_Lab'].isin(valores_lab)]
             if len(invalid_labs) > 0:
                 print(f"⚠️  Registros con valores de laboratorio inválidos: {len(invalid_labs)}")
                 df_final = df_final[df_final['Valor_Lab'].isin(valores_lab)]
         
         # Verificar Tipo_Diagnostico (solo si no se aplicó filtro específico)
-        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and 'Tipo_Diagnostico' in df_final.columns:
+        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion and 'Tipo_Diagnostico' in df_final.columns:
             invalid_types = df_final[df_final['Tipo_Diagnostico'] != tipo_diagnostico]
             if len(invalid_types) > 0:
                 print(f"⚠️  Registros con Tipo_Diagnostico inválido: {len(invalid_types)}")
@@ -1055,6 +2975,21 @@ def process_medical_data():
                 print(f"⚠️  Registros con fecha inválida: {len(invalid_dates)}")
                 df_final = df_final.dropna(subset=['Fecha_Atencion'])
         
+        # PASO 11.5: Columna de procedencia y registros excluidos con sus banderas
+        if aplicar_procedencia:
+            df_final[COLUMNA_PROCEDENCIA] = procedencia.loc[df_final.index].to_numpy()
+            archivo_excluidos = config['procedencia']['archivo_excluidos']
+            if archivo_excluidos:
+                excluidos = seleccion_procedencia.loc[~seleccion_procedencia.index.isin(df_final.index)].copy()
+                excluidos[COLUMNA_PROCEDENCIA] = procedencia.loc[excluidos.index].to_numpy()
+                if generar_nombre_unico:
+                    archivo_excluidos = generate_unique_filename(archivo_excluidos)
+                if os.path.dirname(archivo_excluidos):
+                    os.makedirs(os.path.dirname(archivo_excluidos), exist_ok=True)
+                excluidos.to_csv(archivo_excluidos, index=False, encoding='utf-8')
+                print(f"🏷️  Registros excluidos con sus banderas: {len(excluidos):,} en {archivo_excluidos}")
+            print(f"🏷️  Decodificar: python src/procedencia.py <archivo> --paciente <documento>")
+        
         # PASO 12: Mostrar información final
         print(f"\n📋 Información del dataset final:")
         print(f"📊 Registros finales: {len(df_final):,}")
@@ -1073,7 +3008,7 @@ def process_medical_data():
         print(f"\n📊 Distribución final de códigos:")
         final_code_counts = df_final['Codigo_Item'].value_counts()
         for code, count in final_code_counts.head(10).items():
-            if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo:
+            if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion:
                 status = "OBLIGATORIO" if code in codigos_obligatorios else "OPCIONAL" if code in codigos_opcionales else "OTRO"
                 print(f"  {code} ({status}): {count:,} registros")
             else:
@@ -1110,22 +3045,38 @@ def process_medical_data():
         
         # PASO 13: Guardar archivo final
         print(f"\n💾 Guardando archivo final: {final_file}")
+        # Se elimina el archivo previo para no sobrescribir en sitio un resultado enlazado desde la caché
+        if os.path.exists(final_file):
+            os.remove(final_file)
         df_final.to_csv(final_file, index=False, encoding='utf-8')
         
         # Verificar que el archivo se guardó correctamente
         if os.path.exists(final_file):
             file_size = os.path.getsize(final_file)
             print(f"✅ Archivo final creado exitosamente ({file_size:,} bytes)")
+            if clave_cache:
+                expulsadas = guardar_resultado(clave_cache, final_file, cache_config)
+                print(f"🗄️  Resultado guardado en caché (clave {clave_cache[:12]}…)")
+                if expulsadas:
+                    print(f"🗄️  Entradas expulsadas de la caché: {expulsadas}")
+            if claves_control and not puntos_control['conservar']:
+                eliminados = borrar_puntos(puntos_control['directorio'], claves_control)
+                if eliminados:
+                    print(f"⏯️  Puntos de control eliminados: {eliminados}")
         else:
             print("❌ Error: No se pudo crear el archivo final")
             return False
         
+        # PASO 13.5: Transiciones de clasificación entre ventanas de fechas (una sola pasada agrupada)
+        if config['transiciones']['activo']:
+            ejecutar_transiciones(df_final, config)
+        
         # RESUMEN FINAL
         print(f"\n{'='*80}")
         print("📊 RESUMEN FINAL DEL PROCESAMIENTO")
         print(f"{'='*80}")
         print(f"✅ Archivo Excel original: {excel_file}")
-        print(f"✅ Registros originales: {len(df):,}")
+        print(f"✅ Registros originales: {conteos['originales']:,}")
         if aplicar_filtro_especifico:
             print(f"✅ Filtro específico aplicado: ✅")
             print(f"   Tipo_Diagnostico: {filtro_especifico['tipo_diagnostico']}")
@@ -1148,17 +3099,25 @@ def process_medical_data():
             print(f"   Códigos requeridos: {filtro_valoracion_clinica_con_riesgo['codigos_requeridos']}")
             print(f"   Códigos de factores de riesgo: {filtro_valoracion_clinica_con_riesgo['codigos_factores_riesgo']}")
             print(f"   Modo de filtrado: {filtro_valoracion_clinica_con_riesgo['modo_filtrado']}")
+        elif aplicar_filtro_expresion:
+            print(f"✅ Filtro por expresión aplicado: ✅")
+            if filtro_expresion['expresion']:
+                print(f"   Expresión: {filtro_expresion['expresion']}")
+            for nombre, texto in filtro_expresion['indicadores'].items():
+                print(f"   Indicador {nombre}: {texto}")
+            print(f"   Ámbito: {filtro_expresion['ambito']}")
         else:
-            print(f"✅ Registros con Tipo_Diagnostico = '{tipo_diagnostico}': {len(df_filtered):,}")
-        print(f"✅ Registros después de limpieza: {len(df_clean):,}")
-        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo:
+            print(f"✅ Registros con Tipo_Diagnostico = '{tipo_diagnostico}': {conteos['tipo_diagnostico']:,}")
+        print(f"✅ Registros después de limpieza: {conteos['limpieza']:,}")
+        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion:
             if todos_codigos:
-                print(f"✅ Registros con códigos específicos: {len(df_codes):,}")
+                print(f"✅ Registros con códigos específicos: {conteos['codigos']:,}")
             if valores_lab:
-                print(f"✅ Registros con valores de laboratorio específicos: {len(df_lab):,}")
+                print(f"✅ Registros con valores de laboratorio específicos: {conteos['laboratorio']:,}")
         print(f"✅ Registros finales: {len(df_final):,}")
+        mostrar_escala_muestra(excel_file, len(df_final), unique_patients)
         print(f"✅ Archivo final: {final_file}")
-        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo:
+        if not aplicar_filtro_especifico and not aplicar_filtro_perimetro and not aplicar_filtro_valoracion_clinica and not aplicar_filtro_valoracion_clinica_con_riesgo and not aplicar_filtro_expresion:
             if codigos_obligatorios or codigos_opcionales:
                 if codigos_obligatorios:
                     print(f"✅ Códigos obligatorios: {codigos_obligatorios}")
@@ -1182,10 +3141,12 @@ def process_medical_data():
             print(f"✅ Filtro de valoración clínica aplicado: ✅")
         if aplicar_filtro_valoracion_clinica_con_riesgo:
             print(f"✅ Filtro de valoración clínica con factores de riesgo aplicado: ✅")
+        if aplicar_filtro_expresion:
+            print(f"✅ Filtro por expresión aplicado: ✅")
         print(f"{'='*80}")
         
         # Mostrar estadísticas de reducción
-        reduction_total = ((len(df) - len(df_final)) / len(df)) * 100
+        reduction_total = ((conteos['originales'] - len(df_final)) / conteos['originales']) * 100
         print(f"📈 Reducción total de registros: {reduction_total:.2f}%")
         print(f"{'='*80}")
         
@@ -1196,6 +3157,28 @@ def process_medical_data():
         return False
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Procesador de datos médicos (configuración en config.yaml)")
+    parser.add_argument('--explain', '--explicar', dest='explicar', action='store_true',
+                        help="Mostrar el plan de etapas y estimar registros, pacientes y tiempo con una muestra, sin procesar")
+    parser.add_argument('--muestra', type=float, default=0.05, help="Fracción de pacientes de la muestra (por defecto 0.05)")
+    parser.add_argument('--max-filas', type=int, default=50000, help="Filas del archivo a explorar; 0 = archivo completo")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla del muestreo por paciente")
+    parser.add_argument('--preview', '--vista-previa', dest='vista_previa', type=int, metavar='N',
+                        help="Detenerse al encontrar N pacientes completos y mostrarlos, sin ordenar ni guardar el resultado")
+    parser.add_argument('--mostrar', type=int, default=50, help="Registros a mostrar en --preview (por defecto 50)")
+    parser.add_argument('--memoria-preview-mb', type=int, default=1024,
+                        help="Memoria máxima de las filas que --preview guarda con la entrada sin ordenar (por defecto 1024)")
+    args = parser.parse_args()
+    if args.explicar:
+        sys.exit(0 if explicar_procesamiento(args.muestra, args.max_filas, args.semilla) else 1)
+    if args.vista_previa is not None:
+        if args.vista_previa < 1:
+            parser.error("--preview debe ser un número positivo de pacientes")
+        if args.memoria_preview_mb < 1:
+            parser.error("--memoria-preview-mb debe ser un número positivo")
+        sys.exit(0 if vista_previa(args.vista_previa, args.mostrar, args.memoria_preview_mb) else 1)
+    
     success = process_medical_data()
     if success:
         print("\n🎉 Procesamiento completado exitosamente!")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Generador de registros sintéticos con la misma estructura que el archivo de entrada
+Se usa para pruebas de rendimiento y comparaciones sin depender de datos reales de pacientes
+"""
+
+import numpy as np
+import pandas as pd
+
+CODIGOS_SINTETICOS = [
+    "Z019", "Z006", "E669", "E6690", "E6691", "E6692", "E6693", "E65X",
+    "E785", "E780", "99209.04", "99199.22", "99401.13", "Z017", "99199.23", "E119"
+]
+VALORES_LAB_SINTETICOS = ["N", "A", "IMC", "", "120", "145", "85", "95"]
+ESTABLECIMIENTOS_SINTETICOS = ["Hospital Central", "Clínica Norte", "Centro Médico"]
+
+
+def generar_registros(filas=100000, semilla=0, registros_por_paciente=8):
+    """
+    Genera un DataFrame de atenciones sintéticas (un registro por código atendido)
+    Los pacientes, códigos, valores de laboratorio y fechas se eligen al azar con semilla fija
+    """
+    rng = np.random.default_rng(semilla)
+    pacientes = rng.integers(10_000_000, 10_000_000 + max(filas // registros_por_paciente, 1), filas)
+    dias = rng.integers(0, 270, filas) // 30 * 30
+    return pd.DataFrame({
+        'Numero_Documento_Paciente': pacientes,
+        'Genero': np.where(pacientes % 2 == 0, 'M', 'F'),
+        'Edad_Reg': pacientes % 90 + 5,
+        'Codigo_Item': rng.choice(CODIGOS_SINTETICOS, filas),
+        'Tipo_Diagnostico': rng.choice(['D', 'R'], filas, p=[0.9, 0.1]),
+        'Valor_Lab': rng.choice(VALORES_LAB_SINTETICOS, filas),
+        'Id_Correlativo': rng.integers(1, 5, filas),
+        'Perimetro_Abdominal': np.round(rng.normal(95, 12, filas), 1),
+        'Fecha_Atencion': pd.Timestamp('2025-01-01') + pd.to_timedelta(dias, unit='D'),
+        'Nombre_Establecimiento': rng.choice(ESTABLECIMIENTOS_SINTETICOS, filas),
+    })
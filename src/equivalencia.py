@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Arnés de equivalencia diferencial entre motores de procesamiento
+Ejecuta una implementación de referencia y uno o más motores candidatos sobre las mismas entradas
+(sintéticas o anonimizadas) y perfiles de filtro, compara los CSV fila por fila y reporta la
+relación de tiempo y de memoria máxima de cada candidato respecto de la referencia.
+
+Cada ejecución es un proceso independiente de data_processor.py con su propio config.yaml. La memoria
+máxima la mide el propio proceso al terminar (VmHWM de su espacio de memoria, creado en el exec): el
+ru_maxrss que devuelve wait4 arrastra la memoria del arnés a través del fork y no sirve para comparar.
+La referencia es el código congelado de la revisión de git indicada con --referencia-rev (obligatoria,
+por ejemplo el commit anterior a la optimización que se valida); "actual" usa el código del árbol de
+trabajo. Una revisión con el mismo código que el candidato (HEAD sin cambios locales) es un error: la
+comparación sería del código consigo mismo.
+
+Uso: python src/equivalencia.py --referencia-rev REV|actual [--filas N] [--entrada archivo ...]
+                                [--perfil perfil.yaml ...] [--motor corridas|fuera_de_memoria ...]
+                                [--informe informe.csv]
+"""
+
+import argparse
+import copy
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from datos_sinteticos import generar_registros
+
+DIRECTORIO_SRC = os.path.dirname(os.path.abspath(__file__))
+
+CONFIGURACION_BASE = {
+    'configuracion': {'tipo_diagnostico': "D", 'generar_nombre_unico': False},
+    'columnas': [
+        'Numero_Documento_Paciente', 'Genero', 'Edad_Reg', 'Codigo_Item', 'Tipo_Diagnostico',
+        'Valor_Lab', 'Id_Correlativo', 'Perimetro_Abdominal', 'Fecha_Atencion', 'Nombre_Establecimiento'
+    ],
+    'validaciones': {'edad_minima': 0, 'edad_maxima': 120, 'generos_validos': ['M', 'F']},
+    'cache_resultados': {'activo': False},
+}
+
+CLASIFICACION_PERIMETRO = {
+    'genero_femenino': {'normal': 88, 'anormal': 88},
+    'genero_masculino': {'normal': 102, 'anormal': 102},
+}
+
+# Un perfil por rama de filtro y por variante de agrupación (visita / paciente)
+PERFILES = {
+    'basico': {},
+    # Códigos con aspecto numérico: en CSV deben leerse como texto para coincidir con la configuración
+    'codigos_numericos': {'codigos_item': {'obligatorios': ['99199.22', '99401.13'], 'opcionales': ['99209.04']}},
+    'obligatorios_todos': {'codigos_item': {'obligatorios': ['Z019', 'E6690']}},
+    'obligatorios_opcionales': {'codigos_item': {'obligatorios': ['Z019'], 'opcionales': ['E780', 'E785']}},
+    'patrones_todos': {'codigos_item': {'obligatorios': ['Z019', 'E66*'], 'opcionales': ['E78[0-5]']}},
+    'obligatorios_cualquiera': {
+        'codigos_item': {'obligatorios': ['Z019', 'E6690']},
+        'filtrado_codigos': {'modo': 'cualquiera'},
+        'valores_laboratorio': ['N', 'A'],
+    },
+    'presion_arterial': {'filtro_especifico': {
+        'activo': True, 'tipo_diagnostico': ['D', 'R'], 'codigo_item_especifico': '99199.22',
+        'tipo_presion_arterial_activo': True, 'tipo_presion_arterial': ['S', 'D'],
+        'fecha_atencion_rango': ['2025-01-01', '2025-06-30'],
+    }},
+    'especifico_lab': {'filtro_especifico': {
+        'activo': True, 'tipo_diagnostico': ['D', 'R'], 'codigo_item_especifico': '99199.22',
+        'valor_lab_especifico': ['N', 'A'], 'fecha_atencion_rango': ['2025-01-01', '2025-06-30'],
+    }},
+    'perimetro_visita': {'filtro_perimetro': {
+        'activo': True, 'codigos_requeridos': ['Z019', '99209.04'], 'clasificacion_perimetro': CLASIFICACION_PERIMETRO,
+        'fecha_atencion_activo': True, 'modo_filtrado': 'todos',
+    }},
+    'perimetro_paciente': {'filtro_perimetro': {
+        'activo': True, 'codigos_requeridos': ['Z019', '99209.04'], 'clasificacion_perimetro': CLASIFICACION_PERIMETRO,
+        'fecha_atencion_activo': False, 'modo_filtrado': 'todos',
+    }},
+    'valoracion_visita': {'filtro_valoracion_clinica': {
+        'activo': True, 'codigos_requeridos': ['Z019', 'Z006'], 'valor_lab_especifico': ['IMC'],
+        'fecha_atencion_activo': True, 'modo_filtrado': 'todos',
+    }},
+    'valoracion_paciente': {'filtro_valoracion_clinica': {
+        'activo': True, 'codigos_requeridos': ['Z019', 'Z006'], 'valor_lab_especifico': ['IMC'],
+        'fecha_atencion_activo': False, 'modo_filtrado': 'todos',
+    }},
+    'riesgo_visita': {'filtro_valoracion_clinica_con_riesgo': {
+        'activo': True, 'codigos_requeridos': ['Z019'], 'codigos_factores_riesgo': ['E65X', 'E669', 'E6691'],
+        'valor_lab_especifico': ['IMC'], 'fecha_atencion_activo': True, 'modo_filtrado': 'todos',
+    }},
+    'riesgo_paciente': {'filtro_valoracion_clinica_con_riesgo': {
+        'activo': True, 'codigos_requeridos': ['Z019'], 'codigos_factores_riesgo': ['E65X', 'E669', 'E6691'],
+        'valor_lab_especifico': ['IMC'], 'fecha_atencion_activo': False, 'modo_filtrado': 'todos',
+    }},
+    'riesgo_sin_factores': {'filtro_valoracion_clinica_con_riesgo': {
+        'activo': True, 'codigos_requeridos': ['Z019', 'Z017'], 'codigos_factores_riesgo': [],
+        'fecha_atencion_activo': True, 'modo_filtrado': 'todos',
+    }},
+    'expresion_visita': {'filtro_expresion': {
+        'activo': True, 'ambito': 'visita', 'expresion': 'Z019 AND Z006[Valor_Lab=IMC]',
+    }},
+    'expresion_indicadores': {'filtro_expresion': {
+        'activo': True, 'ambito': 'paciente', 'indicadores': {
+            'obesidad': 'Z019 AND (E669 OR E6691..E6693)',
+            'imc': 'Z006[Valor_Lab=IMC]',
+            'hta': '99199.22[Valor_Lab>=140] AND NOT 99401.13',
+        },
+    }},
+}
+
+# Motores: ajustes de configuración aplicados sobre cada perfil
+MOTOR_REFERENCIA = {'configuracion': {'entrada_ordenada': False}, 'fuera_de_memoria': {'activo': False}}
+MOTORES_CANDIDATOS = {
+    'corridas': {'configuracion': {'entrada_ordenada': "auto"}, 'fuera_de_memoria': {'activo': False}},
+    'fuera_de_memoria': {'fuera_de_memoria': {'activo': True, 'filas_por_bloque': 5000}},
+}
+
+
+# Lanzador de cada ejecución: corre data_processor.py y al salir escribe su memoria máxima (KB) en un archivo
+LANZADOR = """
+import atexit, os, runpy, sys
+script, ruta_memoria = sys.argv[1], sys.argv[2]
+
+def registrar_memoria():
+    memoria_kb = None
+    try:
+        with open('/proc/self/status') as estado:
+            for linea in estado:
+                if linea.startswith('VmHWM:'):
+                    memoria_kb = int(linea.split()[1])
+    except OSError:
+        import resource
+        uso = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memoria_kb = uso // 1024 if sys.platform == 'darwin' else uso
+    if memoria_kb is not None:
+        with open(ruta_memoria, 'w') as archivo:
+            archivo.write(str(memoria_kb))
+
+atexit.register(registrar_memoria)
+sys.argv = [script]
+sys.path[0] = os.path.dirname(os.path.abspath(script))
+runpy.run_path(script, run_name='__main__')
+"""
+
+
+def combinar(base, cambios):
+    """
+    Combina dos configuraciones: las secciones anidadas se mezclan clave a clave
+    """
+    resultado = copy.deepcopy(base)
+    for clave, valor in cambios.items():
+        if isinstance(valor, dict) and isinstance(resultado.get(clave), dict):
+            resultado[clave] = combinar(resultado[clave], valor)
+        else:
+            resultado[clave] = copy.deepcopy(valor)
+    return resultado
+
+
+def preparar_entradas_sinteticas(filas, directorio):
+    """
+    Escribe los registros sintéticos sin ordenar y ordenados por paciente y fecha
+    (el motor por corridas solo se ejercita con la entrada ordenada)
+    Devuelve {nombre: (entrada de la referencia, entrada de los candidatos)}: en 'sinteticos_csv' los
+    candidatos leen los mismos registros desde CSV comprimido y la referencia desde Excel, de modo que una
+    diferencia de tipos entre lectores (códigos leídos como números) aparece como diferencia de filas.
+    El CSV va ordenado por código: los bloques con solo códigos numéricos (99199.22) son los que exponen
+    la inferencia de tipos de pandas
+    """
+    df = generar_registros(filas)
+    rutas = {}
+    ruta = os.path.join(directorio, "sinteticos.xlsx")
+    df.to_excel(ruta, index=False)
+    rutas['sinteticos'] = (ruta, ruta)
+    ruta_csv = os.path.join(directorio, "sinteticos.csv.gz")
+    df.sort_values('Codigo_Item', kind='stable').to_csv(ruta_csv, index=False)
+    rutas['sinteticos_csv'] = (ruta, ruta_csv)
+    ruta = os.path.join(directorio, "sinteticos_ordenados.xlsx")
+    df.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'], kind='stable').to_excel(ruta, index=False)
+    rutas['sinteticos_ordenados'] = (ruta, ruta)
+    return rutas
+
+
+def _git(*argumentos):
+    proceso = subprocess.run(['git', *argumentos], cwd=DIRECTORIO_SRC, capture_output=True, text=True)
+    return proceso.stdout.strip() if proceso.returncode == 0 else None
+
+
+def resolver_referencia(revision):
+    """
+    Commit de la revisión de referencia; devuelve (commit, None) o (None, mensaje de error)
+    Se rechaza la revisión que es HEAD sin cambios locales en src/: la referencia sería el mismo código que el candidato
+    """
+    commit = _git('rev-parse', '--verify', '--quiet', f"{revision}^{{commit}}")
+    if not commit:
+        return None, f"la revisión '{revision}' no existe"
+    if commit == _git('rev-parse', 'HEAD') and _git('status', '--porcelain', '--', '.') == '':
+        return None, (f"la revisión '{revision}' es HEAD y src/ no tiene cambios: la referencia sería el mismo código "
+                      f"que el candidato. Indique el commit anterior a la optimización que se valida")
+    return commit, None
+
+
+def extraer_revision(revision, directorio):
+    """
+    Extrae src/ de una revisión de git (referencia congelada); devuelve la ruta de su data_processor.py
+    """
+    raiz = subprocess.run(['git', 'rev-parse', '--show-toplevel'], cwd=DIRECTORIO_SRC,
+                          capture_output=True, text=True, check=True).stdout.strip()
+    archivo = subprocess.run(['git', 'archive', '--format=tar', revision, 'src'], cwd=raiz,
+                             capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archivo)) as tar:
+        if hasattr(tarfile, 'data_filter'):
+            tar.extractall(directorio, filter='data')
+        else:
+            tar.extractall(directorio)
+    return os.path.join(directorio, 'src', 'data_processor.py')
+
+
+def ejecutar(script, config, directorio):
+    """
+    Ejecuta data_processor.py en un directorio propio con el config.yaml indicado
+    Devuelve {'codigo', 'segundos', 'memoria_mb', 'salida', 'log'}; memoria_mb es la memoria máxima medida
+    dentro del proceso (None si no pudo medirse)
+    """
+    os.makedirs(directorio, exist_ok=True)
+    salida = os.path.join(directorio, "salida.csv")
+    config = combinar(config, {'configuracion': {'archivo_salida': salida, 'generar_nombre_unico': False}})
+    with open(os.path.join(directorio, "config.yaml"), 'w', encoding='utf-8') as file:
+        yaml.safe_dump(config, file, allow_unicode=True, sort_keys=False)
+
+    ruta_log = os.path.join(directorio, "ejecucion.log")
+    ruta_memoria = os.path.join(directorio, "memoria_kb.txt")
+    with open(ruta_log, 'w', encoding='utf-8') as log:
+        inicio = time.perf_counter()
+        proceso = subprocess.run([sys.executable, '-c', LANZADOR, script, ruta_memoria], cwd=directorio,
+                                 stdout=log, stderr=subprocess.STDOUT)
+        segundos = time.perf_counter() - inicio
+
+    memoria_mb = None
+    if os.path.exists(ruta_memoria):
+        with open(ruta_memoria, 'r', encoding='utf-8') as file:
+            memoria_mb = int(file.read()) / 1024
+    return {'codigo': proceso.returncode, 'segundos': segundos, 'memoria_mb': memoria_mb,
+            'salida': salida if os.path.exists(salida) else None, 'log': ruta_log}
+
+
+def comparar_salidas(ruta_referencia, ruta_candidato, mostrar_filas=5):
+    """
+    Compara dos CSV como multiconjuntos de filas (el orden entre registros empatados no importa)
+    Devuelve un diccionario con las diferencias de columnas, filas y pacientes
+    """
+    referencia = pd.read_csv(ruta_referencia, dtype=str, keep_default_na=False)
+    candidato = pd.read_csv(ruta_candidato, dtype=str, keep_default_na=False)
+    resultado = {
+        'filas_referencia': len(referencia),
+        'filas_candidato': len(candidato),
+        'columnas_iguales': list(referencia.columns) == list(candidato.columns),
+        'solo_referencia': 0,
+        'solo_candidato': 0,
+        'pacientes_solo_referencia': 0,
+        'pacientes_solo_candidato': 0,
+        'ejemplos': None,
+    }
+    if not resultado['columnas_iguales']:
+        return resultado
+
+    # Cada fila repetida se numera para comparar multiconjuntos con un merge exacto
+    columnas = list(referencia.columns)
+    referencia['_ocurrencia'] = referencia.groupby(columnas).cumcount()
+    candidato['_ocurrencia'] = candidato.groupby(columnas).cumcount()
+    union = referencia.merge(candidato, how='outer', on=columnas + ['_ocurrencia'], indicator=True)
+    diferentes = union[union['_merge'] != 'both']
+    resultado['solo_referencia'] = int((diferentes['_merge'] == 'left_only').sum())
+    resultado['solo_candidato'] = int((diferentes['_merge'] == 'right_only').sum())
+
+    pacientes_referencia = set(referencia['Numero_Documento_Paciente'])
+    pacientes_candidato = set(candidato['Numero_Documento_Paciente'])
+    resultado['pacientes_solo_referencia'] = len(pacientes_referencia - pacientes_candidato)
+    resultado['pacientes_solo_candidato'] = len(pacientes_candidato - pacientes_referencia)
+    if len(diferentes):
+        resultado['ejemplos'] = diferentes.drop(columns='_ocurrencia').head(mostrar_filas)
+    return resultado
+
+
+def parsear_argumentos():
+    parser = argparse.ArgumentParser(description="Compara motores de procesamiento contra una referencia")
+    parser.add_argument('--filas', type=int, default=50000, help="Registros sintéticos a generar (0 = no generar)")
+    parser.add_argument('--entrada', action='append', default=[], help="Archivo de entrada anonimizado adicional")
+    parser.add_argument('--perfil', action='append', default=[], help="Perfil YAML adicional (secciones de filtro)")
+    parser.add_argument('--solo-perfil', action='append', default=[], help="Ejecutar solo estos perfiles")
+    parser.add_argument('--motor', action='append', default=[], choices=sorted(MOTORES_CANDIDATOS),
+                        help="Motores candidatos (por defecto todos)")
+    parser.add_argument('--referencia-rev', required=True,
+                        help="Revisión de git usada como referencia congelada, por ejemplo el commit anterior a la "
+                             "optimización (\"actual\" = código del árbol de trabajo)")
+    parser.add_argument('--informe', help="Guardar el informe en CSV")
+    parser.add_argument('--conservar', action='store_true', help="No borrar el directorio de trabajo")
+    return parser.parse_args()
+
+
+def main():
+    argumentos = parsear_argumentos()
+    if argumentos.referencia_rev != 'actual':
+        revision, error = resolver_referencia(argumentos.referencia_rev)
+        if error:
+            print(f"❌ Error en --referencia-rev: {error}")
+            return 2
+    directorio = tempfile.mkdtemp(prefix="equivalencia_")
+    script_candidato = os.path.join(DIRECTORIO_SRC, 'data_processor.py')
+    try:
+        if argumentos.referencia_rev == 'actual':
+            script_referencia = script_candidato
+            print(f"⚠️  Referencia: código actual del árbol de trabajo (no congelada)")
+        else:
+            script_referencia = extraer_revision(revision, os.path.join(directorio, 'referencia'))
+            print(f"🧊 Referencia congelada: revisión {revision[:12]} ({argumentos.referencia_rev})")
+
+        entradas = {}
+        if argumentos.filas:
+            print(f"🧪 Generando {argumentos.filas:,} registros sintéticos...")
+            entradas.update(preparar_entradas_sinteticas(argumentos.filas, directorio))
+        for ruta in argumentos.entrada:
+            entradas[os.path.basename(ruta)] = (os.path.abspath(ruta), os.path.abspath(ruta))
+
+        perfiles = dict(PERFILES)
+        for ruta in argumentos.perfil:
+            with open(ruta, 'r', encoding='utf-8') as file:
+                perfiles[os.path.splitext(os.path.basename(ruta))[0]] = yaml.safe_load(file) or {}
+        if argumentos.solo_perfil:
+            perfiles = {nombre: perfil for nombre, perfil in perfiles.items() if nombre in argumentos.solo_perfil}
+        motores = argumentos.motor or sorted(MOTORES_CANDIDATOS)
+
+        filas_informe = []
+        for nombre_entrada, (entrada_referencia, entrada_candidato) in entradas.items():
+            for nombre_perfil, perfil in perfiles.items():
+                config = combinar(CONFIGURACION_BASE, perfil)
+                carpeta = os.path.join(directorio, nombre_entrada, nombre_perfil)
+
+                config_referencia = combinar(config, {'configuracion': {'archivo_entrada': entrada_referencia}})
+                referencia = ejecutar(script_referencia, combinar(config_referencia, MOTOR_REFERENCIA), os.path.join(carpeta, 'referencia'))
+                config = combinar(config, {'configuracion': {'archivo_entrada': entrada_candidato}})
+                for motor in motores:
+                    candidato = ejecutar(script_candidato, combinar(config, MOTORES_CANDIDATOS[motor]), os.path.join(carpeta, motor))
+                    fila = {'entrada': nombre_entrada, 'perfil': nombre_perfil, 'motor': motor}
+                    if referencia['codigo'] != 0 or candidato['codigo'] != 0 or not referencia['salida'] or not candidato['salida']:
+                        fila['estado'] = 'ERROR'
+                        print(f"❌ {nombre_entrada} / {nombre_perfil} / {motor}: error de ejecución "
+                              f"(referencia={referencia['codigo']}, candidato={candidato['codigo']}; ver {candidato['log']})")
+                        filas_informe.append(fila)
+                        continue
+
+                    diferencias = comparar_salidas(referencia['salida'], candidato['salida'])
+                    iguales = diferencias['columnas_iguales'] and not diferencias['solo_referencia'] and not diferencias['solo_candidato']
+                    fila.update({
+                        'estado': 'IGUAL' if iguales else 'DIFERENTE',
+                        'filas': diferencias['filas_referencia'],
+                        'solo_referencia': diferencias['solo_referencia'],
+                        'solo_candidato': diferencias['solo_candidato'],
+                        'pacientes_difieren': diferencias['pacientes_solo_referencia'] + diferencias['pacientes_solo_candidato'],
+                        'tiempo_ref_s': round(referencia['segundos'], 2),
+                        'tiempo_cand_s': round(candidato['segundos'], 2),
+                        'ratio_tiempo': round(candidato['segundos'] / referencia['segundos'], 2),
+                        'memoria_ref_mb': round(referencia['memoria_mb'], 1) if referencia['memoria_mb'] else None,
+                        'memoria_cand_mb': round(candidato['memoria_mb'], 1) if candidato['memoria_mb'] else None,
+                        'ratio_memoria': round(candidato['memoria_mb'] / referencia['memoria_mb'], 2)
+                                         if referencia['memoria_mb'] and candidato['memoria_mb'] else None,
+                    })
+                    filas_informe.append(fila)
+
+                    icono = "✅" if iguales else "❌"
+                    print(f"{icono} {nombre_entrada} / {nombre_perfil} / {motor}: {fila['estado']} "
+                          f"(tiempo x{fila['ratio_tiempo']}, memoria x{fila['ratio_memoria']})")
+                    if not diferencias['columnas_iguales']:
+                        print(f"   Columnas distintas entre referencia y candidato")
+                    elif diferencias['ejemplos'] is not None:
+                        print(f"   Filas solo en referencia: {diferencias['solo_referencia']:,}, "
+                              f"solo en candidato: {diferencias['solo_candidato']:,}")
+                        print(diferencias['ejemplos'].to_string(index=False))
+
+        informe = pd.DataFrame(filas_informe)
+        print(f"\n📊 Informe de equivalencia:")
+        print(informe.to_string(index=False))
+        if argumentos.informe:
+            informe.to_csv(argumentos.informe, index=False, encoding='utf-8')
+            print(f"💾 Informe guardado en {argumentos.informe}")
+
+        distintos = int((informe['estado'] != 'IGUAL').sum()) if len(informe) else 0
+        if distintos:
+            print(f"\n❌ {distintos} combinaciones con diferencias o errores")
+            return 1
+        print(f"\n✅ Todas las combinaciones son equivalentes a la referencia")
+        return 0
+    finally:
+        if argumentos.conservar:
+            print(f"📁 Directorio de trabajo conservado: {directorio}")
+        else:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
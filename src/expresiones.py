@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Lenguaje de expresiones booleanas sobre códigos de item
+Permite escribir un indicador completo en una sola línea, por ejemplo:
+    Z019 AND (E669 OR E6691..E6693) AND Z006[Valor_Lab=IMC]
+También admite predicados temporales entre dos átomos del mismo paciente, por ejemplo:
+    Z019 THEN 99401.13 WITHIN 30 DAYS      (99401.13 entre 0 y 30 días después de Z019)
+    E669 THEN Z006 WITHIN 1..90            (E669 diagnosticado entre 1 y 90 días antes de Z006)
+Los códigos pueden ser patrones jerárquicos CIE-10 (ver codigos.py), por ejemplo:
+    Z019 AND E66* AND NOT E78[0-5]
+La expresión se compila a una evaluación vectorizada por grupo (paciente o paciente-fecha),
+de modo que varios indicadores se resuelven en un único recorrido agrupado de los datos
+"""
+
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from codigos import tabla_codigos
+from corridas import ids_corridas, ids_hash, presencia_por_grupo
+
+# Átomo de la expresión: especificación de código + condiciones sobre otras columnas
+# codigo: ('codigo', 'Z019') | ('rango', 'E6691', 'E6693') | ('patron', 'E66*')
+# condiciones: tupla de (columna, operador, valores)
+Atomo = namedtuple('Atomo', ['codigo', 'condiciones'])
+
+# Predicado temporal: algún registro del consecuente entre dias_min y dias_max días
+# después de algún registro del antecedente, para el mismo paciente
+Temporal = namedtuple('Temporal', ['antecedente', 'consecuente', 'dias_min', 'dias_max'])
+
+NANOSEGUNDOS_DIA = 86400 * 10**9
+
+AMBITOS_VALIDOS = ('paciente', 'visita')
+
+OPERADORES_NUMERICOS = ('>', '>=', '<', '<=')
+
+_CLASE_RE = r"\[!?[A-Za-z0-9-]+\]"
+
+_TOKEN_RE = re.compile(r"""
+    (?P<espacio>\s+)
+  | (?P<parentesis_abre>\()
+  | (?P<parentesis_cierra>\))
+  | (?P<corchete_abre>\[)
+  | (?P<corchete_cierra>\])
+  | (?P<rango>\.\.)
+  | (?P<coma>,)
+  | (?P<barra>\|)
+  | (?P<operador>!=|>=|<=|=|>|<)
+  | (?P<cadena>"[^"]*"|'[^']*')
+  | (?P<patron>[A-Za-z0-9_.]*(?:\*|\?|""" + _CLASE_RE + r""")(?:[A-Za-z0-9_.*?]|""" + _CLASE_RE + r""")*)
+  | (?P<palabra>[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*)
+""", re.VERBOSE)
+
+_PALABRAS_RESERVADAS = {'AND', 'OR', 'NOT', 'THEN', 'WITHIN', 'DAYS'}
+
+
+class ErrorExpresion(ValueError):
+    """
+    Error de sintaxis o de evaluación en una expresión de códigos
+    """
+
+
+def _tokenizar(texto):
+    """
+    Convierte el texto de la expresión en una lista de tokens (tipo, valor, posición)
+    """
+    tokens = []
+    pos = 0
+    while pos < len(texto):
+        match = _TOKEN_RE.match(texto, pos)
+        if not match:
+            raise ErrorExpresion(f"Carácter inesperado '{texto[pos]}' en la posición {pos}: {texto}")
+        tipo = match.lastgroup
+        valor = match.group(tipo)
+        if tipo == 'cadena':
+            tokens.append(('palabra', valor[1:-1], pos))
+        elif tipo == 'palabra' and valor.upper() in _PALABRAS_RESERVADAS:
+            tokens.append((valor.upper(), valor, pos))
+        elif tipo != 'espacio':
+            tokens.append((tipo, valor, pos))
+        pos = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Parser descendente recursivo:
+        expr     := termino ('OR' termino)*
+        termino  := factor ('AND' factor)*
+        factor   := 'NOT' factor | '(' expr ')' | atomo ['THEN' atomo 'WITHIN' DIAS ['..' DIAS] ['DAYS']]
+        atomo    := (CODIGO ['..' CODIGO] | PATRON) ['[' condicion (',' condicion)* ']']
+        condicion:= COLUMNA OPERADOR VALOR ('|' VALOR)*
+    """
+
+    def __init__(self, texto):
+        self.texto = texto
+        self.tokens = _tokenizar(texto)
+        self.pos = 0
+
+    def _actual(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None, len(self.texto))
+
+    def _consumir(self, tipo):
+        token = self._actual()
+        if token[0] != tipo:
+            encontrado = token[1] if token[0] else 'fin de la expresión'
+            raise ErrorExpresion(f"Se esperaba '{tipo}' y se encontró '{encontrado}' en la posición {token[2]}: {self.texto}")
+        self.pos += 1
+        return token
+
+    def parsear(self):
+        if not self.tokens:
+            raise ErrorExpresion("La expresión está vacía")
+        arbol = self._expr()
+        if self.pos < len(self.tokens):
+            token = self._actual()
+            raise ErrorExpresion(f"Token inesperado '{token[1]}' en la posición {token[2]}: {self.texto}")
+        return arbol
+
+    def _expr(self):
+        nodos = [self._termino()]
+        while self._actual()[0] == 'OR':
+            self.pos += 1
+            nodos.append(self._termino())
+        return nodos[0] if len(nodos) == 1 else ('o', *nodos)
+
+    def _termino(self):
+        nodos = [self._factor()]
+        while self._actual()[0] == 'AND':
+            self.pos += 1
+            nodos.append(self._factor())
+        return nodos[0] if len(nodos) == 1 else ('y', *nodos)
+
+    def _factor(self):
+        tipo = self._actual()[0]
+        if tipo == 'NOT':
+            self.pos += 1
+            return ('no', self._factor())
+        if tipo == 'parentesis_abre':
+            self.pos += 1
+            nodo = self._expr()
+            self._consumir('parentesis_cierra')
+            return nodo
+        atomo = self._atomo()
+        if self._actual()[0] == 'THEN':
+            self.pos += 1
+            atomo = self._temporal(atomo)
+        return ('atomo', atomo)
+
+    def _dias(self):
+        token = self._consumir('palabra')
+        if not token[1].isdigit():
+            raise ErrorExpresion(f"Se esperaba un número de días y se encontró '{token[1]}' en la posición {token[2]}: {self.texto}")
+        return int(token[1])
+
+    def _temporal(self, antecedente):
+        consecuente = self._atomo()
+        self._consumir('WITHIN')
+        dias_min, dias_max = 0, self._dias()
+        if self._actual()[0] == 'rango':
+            self.pos += 1
+            dias_min, dias_max = dias_max, self._dias()
+        if dias_min > dias_max:
+            raise ErrorExpresion(f"Ventana de días inválida {dias_min}..{dias_max}: {self.texto}")
+        if self._actual()[0] == 'DAYS':
+            self.pos += 1
+        return Temporal(antecedente, consecuente, dias_min, dias_max)
+
+    def _atomo(self):
+        if self._actual()[0] == 'patron':
+            codigo = self._consumir('patron')[1]
+            especificacion = ('patron', codigo)
+            return Atomo(especificacion, self._condiciones())
+        codigo = self._consumir('palabra')[1]
+        if self._actual()[0] == 'rango':
+            self.pos += 1
+            hasta = self._consumir('palabra')[1]
+            if len(codigo) != len(hasta) or codigo > hasta:
+                raise ErrorExpresion(f"Rango de códigos inválido '{codigo}..{hasta}': los extremos deben tener igual longitud y estar en orden")
+            especificacion = ('rango', codigo, hasta)
+        else:
+            especificacion = ('codigo', codigo)
+        return Atomo(especificacion, self._condiciones())
+
+    def _condiciones(self):
+        condiciones = []
+        if self._actual()[0] == 'corchete_abre':
+            self.pos += 1
+            condiciones.append(self._condicion())
+            while self._actual()[0] == 'coma':
+                self.pos += 1
+                condiciones.append(self._condicion())
+            self._consumir('corchete_cierra')
+        return tuple(condiciones)
+
+    def _condicion(self):
+        columna = self._consumir('palabra')[1]
+        operador = self._consumir('operador')[1]
+        valores = [self._consumir('palabra')[1]]
+        while self._actual()[0] == 'barra':
+            self.pos += 1
+            valores.append(self._consumir('palabra')[1])
+        if operador in OPERADORES_NUMERICOS:
+            if len(valores) != 1:
+                raise ErrorExpresion(f"El operador '{operador}' admite un solo valor en la condición sobre {columna}")
+            try:
+                float(valores[0])
+            except ValueError:
+                raise ErrorExpresion(f"El operador '{operador}' requiere un valor numérico en la condición sobre {columna}")
+        return (columna, operador, tuple(valores))
+
+
+def parsear_expresion(texto):
+    """
+    Parsea una expresión de códigos y devuelve su árbol sintáctico
+    """
+    if not isinstance(texto, str):
+        raise ErrorExpresion(f"La expresión debe ser texto, se recibió: {texto!r}")
+    return _Parser(texto).parsear()
+
+
+def atomos_de(arbol, negado=False, resultado=None):
+    """
+    Devuelve los átomos de un árbol como diccionario {atomo: aparece_sin_negar}
+    Un átomo que aparece solo bajo NOT no aporta registros a la salida
+    """
+    if resultado is None:
+        resultado = {}
+    tipo = arbol[0]
+    if tipo == 'atomo':
+        resultado[arbol[1]] = resultado.get(arbol[1], False) or not negado
+    elif tipo == 'no':
+        atomos_de(arbol[1], not negado, resultado)
+    else:
+        for hijo in arbol[1:]:
+            atomos_de(hijo, negado, resultado)
+    return resultado
+
+
+def describir_atomo(atomo):
+    """
+    Representación legible de un átomo (para logs)
+    """
+    if isinstance(atomo, Temporal):
+        return (f"{describir_atomo(atomo.antecedente)} THEN {describir_atomo(atomo.consecuente)} "
+                f"WITHIN {atomo.dias_min}..{atomo.dias_max} DAYS")
+    if atomo.codigo[0] == 'rango':
+        texto = f"{atomo.codigo[1]}..{atomo.codigo[2]}"
+    else:
+        texto = atomo.codigo[1]
+    if atomo.condiciones:
+        partes = [f"{col}{op}{'|'.join(vals)}" for col, op, vals in atomo.condiciones]
+        texto += f"[{', '.join(partes)}]"
+    return texto
+
+
+def describir_arbol(arbol):
+    """
+    Representación legible de un árbol de expresión (para logs y el plan de --explain)
+    """
+    tipo = arbol[0]
+    if tipo == 'atomo':
+        return describir_atomo(arbol[1])
+    if tipo == 'no':
+        return f"NOT {describir_arbol(arbol[1])}"
+    operador = ' AND ' if tipo == 'y' else ' OR '
+    partes = [describir_arbol(hijo) if hijo[0] in ('atomo', 'no') else f"({describir_arbol(hijo)})" for hijo in arbol[1:]]
+    return operador.join(partes)
+
+
+def resolver_codigos(especificacion, categorias):
+    """
+    Resuelve la especificación de código de un átomo contra los valores distintos de Codigo_Item
+    Devuelve un array booleano sobre las categorías
+    """
+    if especificacion[0] == 'patron':
+        return tabla_codigos([especificacion[1]], categorias)[:-1]
+    textos = np.array([str(c) for c in categorias], dtype=object)
+    if especificacion[0] == 'rango':
+        desde, hasta = especificacion[1], especificacion[2]
+        longitudes = np.array([len(t) for t in textos], dtype=np.int64)
+        return (longitudes == len(desde)) & (textos >= desde) & (textos <= hasta)
+    return textos == especificacion[1]
+
+
+def _mascara_condicion(df, columna, operador, valores):
+    """
+    Máscara por fila para una condición [Columna op valor] de un átomo
+    """
+    if columna not in df.columns:
+        raise ErrorExpresion(f"La columna '{columna}' usada en la expresión no existe en los datos")
+    serie = df[columna]
+    if operador in OPERADORES_NUMERICOS:
+        numerico = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        umbral = float(valores[0])
+        with np.errstate(invalid='ignore'):
+            if operador == '>':
+                return numerico > umbral
+            if operador == '>=':
+                return numerico >= umbral
+            if operador == '<':
+                return numerico < umbral
+            return numerico <= umbral
+    mascara = serie.astype(str).isin(valores).to_numpy()
+    return ~mascara if operador == '!=' else mascara
+
+
+def ids_grupo(df, ambito, ordenado=False):
+    """
+    Asigna un id de grupo denso a cada fila según el ámbito:
+    'paciente' = Numero_Documento_Paciente, 'visita' = paciente + Fecha_Atencion
+    Con ordenado=True los grupos se delimitan por corridas (entrada ya ordenada)
+    Devuelve (ids_por_fila, numero_de_grupos, inicios de corrida o None)
+    """
+    if ambito not in AMBITOS_VALIDOS:
+        raise ErrorExpresion(f"Ámbito '{ambito}' no reconocido. Use uno de: {list(AMBITOS_VALIDOS)}")
+    if ordenado:
+        ids, inicios = ids_corridas(df, ambito)
+        return ids, len(inicios), inicios
+    ids, n_grupos = ids_hash(df, ambito)
+    return ids, n_grupos, None
+
+
+def tiene_temporales(atomos):
+    """
+    Indica si alguno de los átomos es un predicado temporal
+    """
+    return any(isinstance(atomo, Temporal) for atomo in atomos)
+
+
+def _claves_tiempo(pacientes, fechas):
+    """
+    Claves (paciente, fecha) como array estructurado: np.sort y np.searchsorted las comparan
+    en orden lexicográfico, es decir, por paciente y luego por fecha
+    """
+    claves = np.empty(len(pacientes), dtype=[('paciente', np.float64), ('fecha', np.int64)])
+    claves['paciente'] = pacientes
+    claves['fecha'] = fechas
+    return claves
+
+
+def _mascara_temporal(df, antecedente, consecuente, dias_min, dias_max):
+    """
+    Registros que forman parte de un par (antecedente, consecuente) del mismo paciente con
+    dias_min <= fecha del consecuente - fecha del antecedente <= dias_max
+    Cada antecedente busca con searchsorted el primer consecuente desde su fecha + dias_min, y cada
+    consecuente el último antecedente hasta su fecha - dias_min: O(n log n), sin cruces por paciente
+    """
+    pacientes = pd.to_numeric(df['Numero_Documento_Paciente'], errors='coerce').to_numpy(dtype=np.float64)
+    fechas = pd.to_datetime(df['Fecha_Atencion'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+    validos = ~np.isnan(pacientes) & ~np.isnat(fechas)
+    fechas = fechas.view(np.int64)
+    filas_a = np.flatnonzero(antecedente & validos)
+    filas_b = np.flatnonzero(consecuente & validos)
+    mascara = np.zeros(len(df), dtype=bool)
+    if len(filas_a) == 0 or len(filas_b) == 0:
+        return mascara
+    desde = dias_min * NANOSEGUNDOS_DIA
+    hasta = dias_max * NANOSEGUNDOS_DIA
+
+    # Antecedentes con algún consecuente en [fecha + dias_min, fecha + dias_max]
+    claves_b = np.sort(_claves_tiempo(pacientes[filas_b], fechas[filas_b]))
+    buscadas = _claves_tiempo(pacientes[filas_a], fechas[filas_a] + desde)
+    posicion = np.searchsorted(claves_b, buscadas, side='left')
+    encontrada = np.minimum(posicion, len(claves_b) - 1)
+    cumple = (posicion < len(claves_b)) & (claves_b['paciente'][encontrada] == buscadas['paciente']) & \
+             (claves_b['fecha'][encontrada] <= fechas[filas_a] + hasta)
+    mascara[filas_a[cumple]] = True
+
+    # Consecuentes con algún antecedente en [fecha - dias_max, fecha - dias_min]
+    claves_a = np.sort(_claves_tiempo(pacientes[filas_a], fechas[filas_a]))
+    buscadas = _claves_tiempo(pacientes[filas_b], fechas[filas_b] - desde)
+    posicion = np.searchsorted(claves_a, buscadas, side='right') - 1
+    encontrada = np.maximum(posicion, 0)
+    cumple = (posicion >= 0) & (claves_a['paciente'][encontrada] == buscadas['paciente']) & \
+             (claves_a['fecha'][encontrada] >= fechas[filas_b] - hasta)
+    mascara[filas_b[cumple]] = True
+    return mascara
+
+
+def mascaras_atomos(df, atomos):
+    """
+    Calcula la máscara por fila de cada átomo, factorizando Codigo_Item una sola vez
+    Un predicado temporal marca los registros de ambos extremos de los pares que cumplen la ventana
+    """
+    ids_codigo, categorias = pd.factorize(df['Codigo_Item'])
+    mascaras = {}
+
+    def mascara_de(atomo):
+        if atomo in mascaras:
+            return mascaras[atomo]
+        if isinstance(atomo, Temporal):
+            mascara = _mascara_temporal(df, mascara_de(atomo.antecedente), mascara_de(atomo.consecuente),
+                                        atomo.dias_min, atomo.dias_max)
+        else:
+            tabla = resolver_codigos(atomo.codigo, categorias)
+            # Las filas con Codigo_Item nulo tienen id -1: se añade una posición False al final
+            tabla = np.append(tabla, False)
+            mascara = tabla[ids_codigo]
+            for columna, operador, valores in atomo.condiciones:
+                mascara &= _mascara_condicion(df, columna, operador, valores)
+        mascaras[atomo] = mascara
+        return mascara
+
+    for atomo in atomos:
+        mascara_de(atomo)
+    return {atomo: mascaras[atomo] for atomo in atomos}
+
+
+def evaluar_arbol(arbol, presencia):
+    """
+    Evalúa el árbol sobre arrays booleanos por grupo: presencia = {atomo: array}
+    """
+    tipo = arbol[0]
+    if tipo == 'atomo':
+        return presencia[arbol[1]]
+    if tipo == 'no':
+        return ~evaluar_arbol(arbol[1], presencia)
+    resultados = [evaluar_arbol(hijo, presencia) for hijo in arbol[1:]]
+    operacion = np.logical_and if tipo == 'y' else np.logical_or
+    return operacion.reduce(resultados)
+
+
+def evaluar_indicadores(df, indicadores, ambito='paciente', ordenado=False):
+    """
+    Evalúa varios indicadores {nombre: expresión} en un solo recorrido agrupado
+    Con ordenado=True (entrada ordenada por paciente y fecha) se agrupa por corridas
+    Cada átomo distinto se calcula una única vez aunque aparezca en varios indicadores
+    Devuelve un diccionario con:
+        ids: id de grupo por fila
+        resultados: {nombre: array booleano por grupo}
+        relevantes: {nombre: máscara por fila de los átomos no negados del indicador}
+        conteos: {atomo: número de filas que cumplen el átomo}
+    """
+    arboles = {nombre: parsear_expresion(texto) for nombre, texto in indicadores.items()}
+    atomos_por_indicador = {nombre: atomos_de(arbol) for nombre, arbol in arboles.items()}
+    todos_atomos = {}
+    for atomos in atomos_por_indicador.values():
+        for atomo, positivo in atomos.items():
+            todos_atomos[atomo] = todos_atomos.get(atomo, False) or positivo
+
+    ids, n_grupos, inicios = ids_grupo(df, ambito, ordenado)
+    mascaras = mascaras_atomos(df, todos_atomos)
+
+    # Reducción por grupo: un átomo está presente si alguna fila del grupo lo cumple
+    presencia = {atomo: presencia_por_grupo(mascara, ids, n_grupos, inicios) for atomo, mascara in mascaras.items()}
+
+    resultados = {}
+    relevantes = {}
+    for nombre, arbol in arboles.items():
+        resultados[nombre] = evaluar_arbol(arbol, presencia)
+        positivos = [mascaras[a] for a, positivo in atomos_por_indicador[nombre].items() if positivo]
+        relevantes[nombre] = np.logical_or.reduce(positivos) if positivos else np.zeros(len(df), dtype=bool)
+
+    conteos = {atomo: int(mascara.sum()) for atomo, mascara in mascaras.items()}
+    return {'ids': ids, 'resultados': resultados, 'relevantes': relevantes, 'conteos': conteos}
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Flujo de registros por paciente
+Entrega los registros que cumplen el filtro paciente por paciente, en orden de Numero_Documento_Paciente
+(y de Fecha_Atencion dentro de cada paciente), mientras el procesamiento sigue en curso. El consumidor empieza
+a trabajar con el primer paciente sin esperar el CSV final y la memoria queda acotada por el tamaño de bloque:
+    Entrada ordenada por paciente (historial SQLite o entrada_ordenada: true): cada bloque leído se procesa
+        con la cadena del modo fuera de memoria y sus pacientes completos se entregan de inmediato; el último
+        paciente del bloque continúa en el siguiente
+    Entrada sin orden garantizado: las dos pasadas del modo fuera de memoria se ejecutan en un hilo y la
+        mezcla final de las corridas ordenadas se entrega por paciente a través de una cola acotada en lugar
+        de escribir el archivo final (el primer paciente llega al terminar la segunda pasada)
+Solo se entrega el resultado del filtro: las salidas complementarias (barrido, transiciones, conjuntos,
+procedencia) se generan con la ejecución normal.
+
+Uso como API:
+    from flujo_pacientes import iterar_pacientes
+    for documento, registros in iterar_pacientes("config.yaml"):
+        ...                                   # registros: DataFrame de un paciente
+    for documento, lote in iterar_pacientes("config.yaml", formato='arrow'):
+        ...                                   # lote: pyarrow.RecordBatch (requiere pyarrow)
+
+Uso:
+    python src/flujo_pacientes.py [--config config.yaml] [--limite N] [--formato pandas|arrow]
+"""
+
+import argparse
+import csv
+import io
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_processor import (load_config, plan_fuera_de_memoria, predicados_historial, leer_entrada_por_bloques,
+                            procesar_fuera_de_memoria, _procesar_pacientes)
+from lectores import COLUMNAS_TEXTO, detectar_formato, modulo_disponible
+
+FORMATOS = ('pandas', 'arrow')
+_FIN = object()
+
+
+class ErrorFlujo(ValueError):
+    """Configuración o entrada que no permite entregar los registros por paciente"""
+
+
+class _Cancelado(Exception):
+    """El consumidor dejó de iterar: el hilo productor termina sin entregar más lotes"""
+
+
+def _por_paciente(df, formato):
+    """
+    Separa un DataFrame ordenado por paciente en (documento, registros del paciente)
+    """
+    if len(df) == 0:
+        return
+    df = df.sort_values(['Numero_Documento_Paciente', 'Fecha_Atencion'], kind='stable').reset_index(drop=True)
+    df['Numero_Documento_Paciente'] = pd.to_numeric(df['Numero_Documento_Paciente']).astype(np.int64)
+    df['Fecha_Atencion'] = pd.to_datetime(df['Fecha_Atencion'], errors='coerce')
+    documentos = df['Numero_Documento_Paciente'].to_numpy()
+    limites = np.concatenate(([0], np.flatnonzero(documentos[1:] != documentos[:-1]) + 1, [len(df)]))
+    if formato == 'arrow':
+        import pyarrow as pa
+        tabla = pa.Table.from_pandas(df, preserve_index=False)
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        if formato == 'arrow':
+            yield int(documentos[inicio]), tabla.slice(inicio, fin - inicio).combine_chunks().to_batches()[0]
+        else:
+            yield int(documentos[inicio]), df.iloc[inicio:fin].reset_index(drop=True)
+
+
+def _flujo_ordenado(config, archivo_entrada, plan, formato):
+    """
+    Entrada ordenada por paciente: procesa bloque a bloque y entrega los pacientes completos de cada bloque
+    """
+    filas_por_bloque = config['fuera_de_memoria']['filas_por_bloque']
+    pendiente = None
+    bloques = leer_entrada_por_bloques(archivo_entrada, filas_por_bloque, predicados_historial(config))
+    try:
+        for bloque in bloques:
+            if pendiente is not None:
+                bloque = pd.concat([pendiente, bloque], ignore_index=True)
+            documentos = pd.to_numeric(bloque['Numero_Documento_Paciente'], errors='coerce').to_numpy(dtype=np.float64)
+            # Los documentos nulos se descartan en la limpieza y no cuentan para el orden
+            validos = documentos[~np.isnan(documentos)]
+            if len(validos) == 0:
+                pendiente = None
+                continue
+            if (validos[1:] < validos[:-1]).any():
+                raise ErrorFlujo("la entrada no está ordenada por Numero_Documento_Paciente "
+                                 "(use entrada_ordenada: auto o false para entregar desde la mezcla ordenada)")
+            # Los registros del último paciente del bloque pueden continuar en el siguiente
+            completos = documentos != validos[-1]
+            pendiente = bloque[~completos]
+            yield from _por_paciente(_procesar_pacientes(bloque[completos], config, plan, config['columnas'])[2], formato)
+        if pendiente is not None and len(pendiente):
+            yield from _por_paciente(_procesar_pacientes(pendiente, config, plan, config['columnas'])[2], formato)
+    finally:
+        bloques.close()
+
+
+def _flujo_mezcla(config, archivo_entrada, formato, registros_por_lote, lotes_en_cola):
+    """
+    Entrada sin orden garantizado: las dos pasadas del modo fuera de memoria corren en un hilo y la mezcla
+    final llega en lotes de pacientes completos (como máximo lotes_en_cola lotes en memoria)
+    """
+    cola = queue.Queue(maxsize=lotes_en_cola)
+    detener = threading.Event()
+
+    def poner(elemento):
+        # Espera mientras la cola está llena (el consumidor marca el ritmo de la mezcla)
+        while True:
+            if detener.is_set():
+                raise _Cancelado()
+            try:
+                cola.put(elemento, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def entregar_lote(encabezado, filas):
+        texto = io.StringIO()
+        escritor = csv.writer(texto, lineterminator='\n')
+        escritor.writerow(encabezado)
+        escritor.writerows(filas)
+        texto.seek(0)
+        poner(pd.read_csv(texto, dtype=COLUMNAS_TEXTO))
+
+    def destino(filas):
+        encabezado = next(filas)
+        i_paciente = encabezado.index('Numero_Documento_Paciente')
+        lote = []
+        registros = 0
+        pacientes = 0
+        anterior = None
+        for fila in filas:
+            if fila[i_paciente] != anterior:
+                # Un lote solo se corta entre pacientes
+                if len(lote) >= registros_por_lote:
+                    entregar_lote(encabezado, lote)
+                    lote = []
+                pacientes += 1
+                anterior = fila[i_paciente]
+            lote.append(fila)
+            registros += 1
+        if lote:
+            entregar_lote(encabezado, lote)
+        return registros, pacientes
+
+    def producir():
+        try:
+            if procesar_fuera_de_memoria(config, archivo_entrada, None, destino=destino):
+                poner(_FIN)
+            else:
+                poner(ErrorFlujo("el procesamiento por bloques no pudo completarse (ver mensajes anteriores)"))
+        except _Cancelado:
+            pass
+        except Exception as e:
+            try:
+                poner(e)
+            except _Cancelado:
+                pass
+
+    hilo = threading.Thread(target=producir, name="flujo_pacientes", daemon=True)
+    hilo.start()
+    try:
+        while True:
+            elemento = cola.get()
+            if elemento is _FIN:
+                break
+            if isinstance(elemento, Exception):
+                raise elemento
+            yield from _por_paciente(elemento, formato)
+    finally:
+        detener.set()
+        hilo.join()
+
+
+def iterar_pacientes(config_file="config.yaml", formato='pandas', registros_por_lote=50000, lotes_en_cola=4):
+    """
+    Generador de (documento, registros) de los pacientes que cumplen el filtro, en orden de documento
+    formato: 'pandas' (DataFrame por paciente) o 'arrow' (pyarrow.RecordBatch por paciente)
+    registros_por_lote y lotes_en_cola acotan la memoria del flujo desde la mezcla ordenada
+    Cerrar el generador antes de terminar (break) detiene el procesamiento y elimina los temporales
+    """
+    if formato not in FORMATOS:
+        raise ErrorFlujo(f"formato '{formato}' no válido (opciones: {', '.join(FORMATOS)})")
+    if formato == 'arrow' and not modulo_disponible('pyarrow'):
+        raise ErrorFlujo("el formato 'arrow' requiere pyarrow (pip install pyarrow)")
+    config = load_config(config_file)
+    if config is None:
+        raise ErrorFlujo(f"configuración no válida: {config_file}")
+    archivo_entrada = config['configuracion']['archivo_entrada']
+    if not os.path.exists(archivo_entrada):
+        raise ErrorFlujo(f"el archivo {archivo_entrada} no existe")
+    plan = plan_fuera_de_memoria(config)
+
+    if detectar_formato(archivo_entrada)[0] == 'sqlite' or config['configuracion']['entrada_ordenada'] is True:
+        print(f"📤 Entregando pacientes de {archivo_entrada} a medida que se leen (entrada ordenada por paciente)")
+        yield from _flujo_ordenado(config, archivo_entrada, plan, formato)
+    else:
+        print(f"📤 Entregando pacientes de {archivo_entrada} desde la mezcla ordenada del modo fuera de memoria")
+        yield from _flujo_mezcla(config, archivo_entrada, formato, registros_por_lote, lotes_en_cola)
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Registros que cumplen el filtro, entregados paciente por paciente")
+    parser.add_argument('--config', default="config.yaml", help="Archivo de configuración")
+    parser.add_argument('--limite', type=int, help="Detenerse después de N pacientes")
+    parser.add_argument('--formato', choices=FORMATOS, default='pandas', help="Formato de cada paciente")
+    argumentos = parser.parse_args(argumentos)
+
+    inicio = time.perf_counter()
+    primero = None
+    pacientes = 0
+    registros = 0
+    try:
+        for documento, datos in iterar_pacientes(argumentos.config, argumentos.formato):
+            if primero is None:
+                primero = time.perf_counter() - inicio
+            pacientes += 1
+            registros += datos.num_rows if argumentos.formato == 'arrow' else len(datos)
+            if argumentos.limite and pacientes >= argumentos.limite:
+                break
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        return 1
+    print(f"\n✅ {pacientes:,} pacientes y {registros:,} registros entregados en {time.perf_counter() - inicio:.2f} s")
+    if primero is not None:
+        print(f"⏱️  Primer paciente disponible a los {primero:.2f} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Historial local en SQLite con los registros ya limpios, para consultas puntuales y como entrada del procesador
+Cada archivo mensual se carga una sola vez (se reconoce por su huella SHA-256) con inserciones masivas
+en una transacción y el diario en modo WAL. Índices:
+    (Numero_Documento_Paciente, Fecha_Atencion)  consultas por paciente y lectura ordenada
+    (Codigo_Item, Fecha_Atencion)                consultas y lecturas por código
+    (Nombre_Establecimiento)                     consultas por establecimiento
+
+Uso:
+    python src/historial.py cargar files/atenciones_2025_01.xlsx [--db files/historial.sqlite] [--forzar]
+    python src/historial.py consultar [--paciente N] [--codigo C ...] [--desde F] [--hasta F] [--establecimiento E]
+    python src/historial.py cargas
+    python src/historial.py eliminar ID_CARGA
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from codigos import es_patron
+
+TABLA = "atenciones"
+TABLA_CARGAS = "cargas"
+
+INDICES = {
+    'idx_paciente_fecha': ('Numero_Documento_Paciente', 'Fecha_Atencion'),
+    'idx_codigo_fecha': ('Codigo_Item', 'Fecha_Atencion'),
+    'idx_establecimiento': ('Nombre_Establecimiento',),
+}
+
+FORMATO_FECHA = '%Y-%m-%d %H:%M:%S'
+
+
+class ErrorHistorial(ValueError):
+    """Historial inexistente o incompatible con los registros a cargar"""
+
+
+def _q(nombre):
+    """
+    Identificador SQL entre comillas (los nombres de columna vienen de la configuración)
+    """
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+def conectar(ruta_db):
+    """
+    Abre el historial en modo WAL: las lecturas no se bloquean mientras se carga un mes nuevo
+    """
+    directorio = os.path.dirname(ruta_db)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+    conexion = sqlite3.connect(ruta_db)
+    conexion.execute("PRAGMA journal_mode=WAL")
+    conexion.execute("PRAGMA synchronous=NORMAL")
+    conexion.execute("PRAGMA temp_store=MEMORY")
+    conexion.execute("PRAGMA cache_size=-65536")
+    return conexion
+
+
+def columnas_historial(conexion):
+    """
+    Columnas de registros del historial (sin id_carga), o [] si aún no se creó
+    """
+    filas = conexion.execute(f"PRAGMA table_info({_q(TABLA)})").fetchall()
+    return [fila[1] for fila in filas if fila[1] != 'id_carga']
+
+
+def _tipo_sql(serie):
+    """
+    Afinidad SQLite de una columna; las columnas object no declaran tipo para conservar el de cada valor
+    (Valor_Lab mezcla números y textos y debe salir igual que en el archivo original)
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return "TEXT"
+    if pd.api.types.is_integer_dtype(serie) or pd.api.types.is_bool_dtype(serie):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(serie):
+        return "REAL"
+    return ""
+
+
+def _valores_sql(serie):
+    """
+    Valores de una columna como tipos nativos de Python (None para nulos, fechas ISO como texto)
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return [None if pd.isna(valor) else valor for valor in serie.dt.strftime(FORMATO_FECHA).tolist()]
+    if pd.api.types.is_float_dtype(serie):
+        valores = serie.to_numpy(dtype=np.float64)
+        # Los documentos enteros se guardan como INTEGER para que el índice por paciente compare enteros
+        if serie.name == 'Numero_Documento_Paciente' and np.all(np.mod(valores[~np.isnan(valores)], 1) == 0):
+            return [None if np.isnan(valor) else int(valor) for valor in valores]
+        return [None if np.isnan(valor) else valor for valor in valores.tolist()]
+    return [None if pd.isna(valor) else (valor.item() if isinstance(valor, np.generic) else valor)
+            for valor in serie.tolist()]
+
+
+def crear_tablas(conexion, df):
+    """
+    Crea la tabla de registros (columnas del DataFrame limpio) y la de cargas si no existen
+    """
+    conexion.execute(f"""
+        CREATE TABLE IF NOT EXISTS {_q(TABLA_CARGAS)} (
+            id_carga INTEGER PRIMARY KEY,
+            archivo TEXT NOT NULL,
+            huella TEXT NOT NULL UNIQUE,
+            periodo TEXT,
+            registros INTEGER NOT NULL,
+            fecha_carga TEXT NOT NULL
+        )""")
+    existentes = columnas_historial(conexion)
+    if existentes:
+        faltantes = [columna for columna in df.columns if columna not in existentes]
+        if faltantes:
+            raise ErrorHistorial(f"El historial no tiene las columnas {faltantes}; cree un historial nuevo para esta configuración")
+        return
+    definiciones = ", ".join(f"{_q(columna)} {_tipo_sql(df[columna])}".strip() for columna in df.columns)
+    conexion.execute(f"CREATE TABLE {_q(TABLA)} ({definiciones}, id_carga INTEGER NOT NULL)")
+
+
+def crear_indices(conexion):
+    """
+    Crea los índices de consulta (después de la primera carga masiva, que así no los mantiene fila a fila)
+    """
+    existentes = set(columnas_historial(conexion))
+    for nombre, columnas in INDICES.items():
+        if all(columna in existentes for columna in columnas):
+            conexion.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {_q(TABLA)} ({', '.join(_q(c) for c in columnas)})")
+
+
+def periodo_de(df):
+    """
+    Periodo cubierto por los registros: '2025-01' si es un solo mes, '2025-01..2025-03' si son varios
+    """
+    if 'Fecha_Atencion' not in df.columns or len(df) == 0:
+        return None
+    fechas = pd.to_datetime(df['Fecha_Atencion'], errors='coerce').dropna()
+    if len(fechas) == 0:
+        return None
+    inicio, fin = fechas.min().strftime('%Y-%m'), fechas.max().strftime('%Y-%m')
+    return inicio if inicio == fin else f"{inicio}..{fin}"
+
+
+def cargar_registros(ruta_db, df, archivo, huella, forzar=False):
+    """
+    Agrega los registros limpios de un archivo al historial en una sola transacción
+    Devuelve el id de la carga, o None si el archivo (misma huella) ya estaba cargado y no se fuerza
+    """
+    conexion = conectar(ruta_db)
+    try:
+        crear_tablas(conexion, df)
+        previa = conexion.execute(f"SELECT id_carga FROM {_q(TABLA_CARGAS)} WHERE huella = ?", (huella,)).fetchone()
+        if previa and not forzar:
+            return None
+        columnas = list(df.columns)
+        with conexion:
+            if previa:
+                conexion.execute(f"DELETE FROM {_q(TABLA)} WHERE id_carga = ?", (previa[0],))
+                conexion.execute(f"DELETE FROM {_q(TABLA_CARGAS)} WHERE id_carga = ?", (previa[0],))
+            cursor = conexion.execute(
+                f"INSERT INTO {_q(TABLA_CARGAS)} (archivo, huella, periodo, registros, fecha_carga) VALUES (?, ?, ?, ?, ?)",
+                (os.path.basename(archivo), huella, periodo_de(df), len(df), time.strftime(FORMATO_FECHA)))
+            id_carga = cursor.lastrowid
+            valores = [_valores_sql(df[columna]) for columna in columnas]
+            marcadores = ", ".join("?" for _ in range(len(columnas) + 1))
+            conexion.executemany(
+                f"INSERT INTO {_q(TABLA)} ({', '.join(_q(c) for c in columnas)}, id_carga) VALUES ({marcadores})",
+                zip(*valores, [id_carga] * len(df)))
+        crear_indices(conexion)
+        conexion.execute("ANALYZE")
+        # Vuelca el WAL al archivo principal: la huella del archivo (caché de resultados) refleja la carga
+        conexion.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return id_carga
+    finally:
+        conexion.close()
+
+
+def eliminar_carga(ruta_db, id_carga):
+    """
+    Elimina los registros de una carga (para volver a cargar un mes corregido); devuelve filas eliminadas
+    """
+    conexion = conectar(ruta_db)
+    try:
+        with conexion:
+            eliminadas = conexion.execute(f"DELETE FROM {_q(TABLA)} WHERE id_carga = ?", (id_carga,)).rowcount
+            conexion.execute(f"DELETE FROM {_q(TABLA_CARGAS)} WHERE id_carga = ?", (id_carga,))
+        conexion.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return eliminadas
+    finally:
+        conexion.close()
+
+
+def listar_cargas(ruta_db):
+    """
+    Cargas registradas en el historial, en orden de carga
+    """
+    conexion = conectar(ruta_db)
+    try:
+        return pd.read_sql_query(f"SELECT * FROM {_q(TABLA_CARGAS)} ORDER BY id_carga", conexion)
+    finally:
+        conexion.close()
+
+
+def _condiciones(paciente=None, codigos=None, tipos=None, desde=None, hasta=None, establecimiento=None):
+    """
+    Cláusula WHERE y parámetros para los predicados indicados (cada uno aprovecha un índice)
+    """
+    condiciones, parametros = [], []
+    if paciente is not None:
+        condiciones.append(f"{_q('Numero_Documento_Paciente')} = ?")
+        parametros.append(int(float(paciente)))
+    if codigos:
+        # Los patrones (E66*, E78[0-5]) usan GLOB, con los mismos comodines que codigos.py salvo la negación [^...]
+        exactos = [str(codigo) for codigo in codigos if not es_patron(codigo)]
+        patrones = [codigo.replace('[!', '[^') for codigo in codigos if es_patron(codigo)]
+        alternativas = [f"{_q('Codigo_Item')} IN ({', '.join('?' for _ in exactos)})"] if exactos else []
+        alternativas += [f"{_q('Codigo_Item')} GLOB ?" for _ in patrones]
+        condiciones.append(f"({' OR '.join(alternativas)})")
+        parametros.extend(exactos + patrones)
+    if tipos:
+        condiciones.append(f"{_q('Tipo_Diagnostico')} IN ({', '.join('?' for _ in tipos)})")
+        parametros.extend(str(tipo) for tipo in tipos)
+    if desde is not None:
+        condiciones.append(f"{_q('Fecha_Atencion')} >= ?")
+        parametros.append(pd.to_datetime(desde).strftime(FORMATO_FECHA))
+    if hasta is not None:
+        condiciones.append(f"{_q('Fecha_Atencion')} <= ?")
+        parametros.append(pd.to_datetime(hasta).strftime(FORMATO_FECHA))
+    if establecimiento is not None:
+        condiciones.append(f"{_q('Nombre_Establecimiento')} = ?")
+        parametros.append(establecimiento)
+    return (" WHERE " + " AND ".join(condiciones) if condiciones else ""), parametros
+
+
+def _sql_lectura(conexion, **predicados):
+    columnas = columnas_historial(conexion)
+    if not columnas:
+        raise ErrorHistorial("El historial está vacío: cargue al menos un archivo con 'python src/historial.py cargar'")
+    donde, parametros = _condiciones(**predicados)
+    # Orden por el índice (paciente, fecha) y rowid: equivale al orden estable del archivo ordenado por paciente y fecha
+    orden = f" ORDER BY {_q('Numero_Documento_Paciente')}, {_q('Fecha_Atencion')}, rowid"
+    return f"SELECT {', '.join(_q(c) for c in columnas)} FROM {_q(TABLA)}{donde}{orden}", parametros
+
+
+def contar_registros(ruta_db):
+    """
+    Número de registros del historial
+    """
+    conexion = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True)
+    try:
+        if not columnas_historial(conexion):
+            return 0
+        return conexion.execute(f"SELECT COUNT(*) FROM {_q(TABLA)}").fetchone()[0]
+    finally:
+        conexion.close()
+
+
+def _convertir_fechas(df):
+    if 'Fecha_Atencion' in df.columns:
+        df['Fecha_Atencion'] = pd.to_datetime(df['Fecha_Atencion'], format='ISO8601')
+    return df
+
+
+def leer_historial(ruta_db, **predicados):
+    """
+    Lee del historial los registros que cumplen los predicados (paciente, codigos, tipos, desde, hasta,
+    establecimiento), ordenados por paciente y fecha. Devuelve (DataFrame, descripción de la lectura)
+    """
+    if not os.path.exists(ruta_db):
+        raise ErrorHistorial(f"El historial {ruta_db} no existe")
+    conexion = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True)
+    try:
+        sql, parametros = _sql_lectura(conexion, **predicados)
+        df = _convertir_fechas(pd.read_sql_query(sql, conexion, params=parametros))
+    finally:
+        conexion.close()
+    aplicados = [nombre for nombre, valor in predicados.items() if valor not in (None, [], ())]
+    return df, f"Historial SQLite ({', '.join(aplicados) if aplicados else 'sin predicados'})"
+
+
+def leer_historial_por_bloques(ruta_db, filas_por_bloque, **predicados):
+    """
+    Lee el historial por bloques de filas (modo fuera de memoria), en orden de paciente y fecha
+    """
+    if not os.path.exists(ruta_db):
+        raise ErrorHistorial(f"El historial {ruta_db} no existe")
+    conexion = sqlite3.connect(f"file:{ruta_db}?mode=ro", uri=True)
+    try:
+        sql, parametros = _sql_lectura(conexion, **predicados)
+        for bloque in pd.read_sql_query(sql, conexion, params=parametros, chunksize=filas_por_bloque):
+            yield _convertir_fechas(bloque)
+    finally:
+        conexion.close()
+
+
+def cargar_archivo(archivo, ruta_db=None, forzar=False):
+    """
+    Lee un archivo de entrada, aplica la selección de columnas y las reglas de calidad de config.yaml
+    y lo agrega al historial. Todos los Tipo_Diagnostico se conservan: el filtro se aplica al procesar
+    """
+    # Importación diferida: data_processor importa este módulo para leer el historial como entrada
+    from cache_resultados import hash_archivo
+    from data_processor import load_config, aplicar_reglas_calidad
+    from lectores import leer_entrada
+
+    config = load_config()
+    if config is None:
+        return False
+    ruta_db = ruta_db or config['historial']['archivo']
+
+    print(f"\n📊 Leyendo archivo a cargar: {archivo}")
+    df, lectura = leer_entrada(archivo, config['lectura']['motor_excel'], config['lectura']['motor_csv'])
+    print(f"✅ Formato y motor de lectura: {lectura}")
+    print(f"✅ Registros leídos: {len(df):,}")
+
+    faltantes = [columna for columna in config['columnas'] if columna not in df.columns]
+    if faltantes:
+        print(f"❌ Error: Columnas no encontradas en el archivo: {faltantes}")
+        return False
+    df_clean = aplicar_reglas_calidad(df[config['columnas']].copy(), config.get('validaciones', {}))
+
+    inicio = time.perf_counter()
+    id_carga = cargar_registros(ruta_db, df_clean, archivo, hash_archivo(archivo), forzar)
+    if id_carga is None:
+        print(f"⚠️  El archivo ya estaba cargado en {ruta_db} (misma huella); use --forzar para reemplazarlo")
+        return True
+    print(f"✅ Carga {id_carga}: {len(df_clean):,} registros agregados a {ruta_db} en {time.perf_counter() - inicio:.2f} s")
+    print(f"✅ Periodo: {periodo_de(df_clean)}")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Historial local SQLite de registros limpios")
+    parser.add_argument('--db', default=None, help="Archivo del historial (por defecto historial.archivo de config.yaml)")
+    comandos = parser.add_subparsers(dest='comando', required=True)
+
+    cargar = comandos.add_parser('cargar', help="Agregar un archivo de entrada (un mes) al historial")
+    cargar.add_argument('archivo')
+    cargar.add_argument('--forzar', action='store_true', help="Reemplazar la carga previa del mismo archivo")
+
+    consultar = comandos.add_parser('consultar', help="Consultar registros por paciente, código, fechas o establecimiento")
+    consultar.add_argument('--paciente')
+    consultar.add_argument('--codigo', nargs='+', dest='codigos')
+    consultar.add_argument('--desde')
+    consultar.add_argument('--hasta')
+    consultar.add_argument('--establecimiento')
+    consultar.add_argument('--salida', help="Guardar el resultado en .xlsx o .csv")
+
+    comandos.add_parser('cargas', help="Listar las cargas del historial")
+
+    eliminar = comandos.add_parser('eliminar', help="Eliminar los registros de una carga")
+    eliminar.add_argument('id_carga', type=int)
+
+    args = parser.parse_args()
+    ruta_db = args.db
+    if ruta_db is None and args.comando != 'cargar':
+        ruta_db = "files/historial.sqlite"
+        if os.path.exists("config.yaml"):
+            import yaml
+            with open("config.yaml", 'r', encoding='utf-8') as file:
+                ruta_db = ((yaml.safe_load(file) or {}).get('historial') or {}).get('archivo', ruta_db)
+
+    try:
+        if args.comando == 'cargar':
+            return 0 if cargar_archivo(args.archivo, ruta_db, args.forzar) else 1
+
+        if args.comando == 'consultar':
+            inicio = time.perf_counter()
+            df, _ = leer_historial(ruta_db, paciente=args.paciente, codigos=args.codigos, desde=args.desde,
+                                   hasta=args.hasta, establecimiento=args.establecimiento)
+            duracion = (time.perf_counter() - inicio) * 1000
+            print(df.to_string(index=False) if len(df) <= 200 else f"{df.head(200).to_string(index=False)}\n…")
+            print(f"\n📊 {len(df):,} registros en {duracion:.1f} ms")
+            if args.salida:
+                if args.salida.lower().endswith('.csv'):
+                    df.to_csv(args.salida, index=False)
+                else:
+                    df.to_excel(args.salida, index=False)
+                print(f"✅ Resultado guardado en {args.salida}")
+            return 0
+
+        if args.comando == 'cargas':
+            print(listar_cargas(ruta_db).to_string(index=False))
+            return 0
+
+        eliminadas = eliminar_carga(ruta_db, args.id_carga)
+        print(f"✅ Carga {args.id_carga} eliminada: {eliminadas:,} registros")
+        return 0
+    except (ErrorHistorial, sqlite3.Error) as e:
+        print(f"❌ Error: {e}")
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Lectores del archivo de entrada con detección automática de formato
+Formatos: Excel (.xlsx/.xlsm/.xls) y CSV, este último opcionalmente comprimido con gzip o zstd
+(.csv.gz, .csv.zst), que se descomprime como flujo sin crear archivos intermedios, y Parquet (.parquet,
+por ejemplo las muestras de desarrollo de muestreo.py).
+También se reconoce el historial SQLite (.sqlite/.sqlite3/.db, ver historial.py).
+Cada formato tiene motores ordenados por preferencia; se usa el primero instalado:
+    Excel: calamine (python-calamine) -> openpyxl
+    CSV: pyarrow (multihilo) -> c (lector estándar de pandas)
+    Parquet: pyarrow
+"""
+
+import importlib.util
+import os
+
+import pandas as pd
+
+# Motores por formato, en orden de preferencia: (nombre, módulo que debe estar instalado)
+MOTORES = {
+    'excel': (('calamine', 'python_calamine'), ('openpyxl', 'openpyxl')),
+    'csv': (('pyarrow', 'pyarrow'), ('c', None)),
+    'parquet': (('pyarrow', 'pyarrow'),),
+}
+
+# Compresión -> módulo requerido por pandas para descomprimir
+MODULOS_COMPRESION = {'gzip': None, 'zstd': 'zstandard'}
+
+FIRMAS = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+FIRMA_SQLITE = b'SQLite format 3\x00'
+FIRMA_PARQUET = b'PAR1'
+
+# Columnas que se leen siempre como texto en los CSV: los códigos con aspecto numérico (99199.22, 99401)
+# se compararían como números (o como una mezcla de números y cadenas) y no coincidirían con la configuración
+COLUMNAS_TEXTO = {'Codigo_Item': str, 'Valor_Lab': str}
+
+EXTENSIONES_EXCEL = ('.xlsx', '.xlsm', '.xls')
+EXTENSIONES_HISTORIAL = ('.sqlite', '.sqlite3', '.db')
+EXTENSIONES_PARQUET = ('.parquet', '.pq')
+EXTENSIONES_COMPRESION = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+
+
+class ErrorLector(ValueError):
+    """Formato de entrada o motor de lectura no soportado"""
+
+
+def modulo_disponible(modulo):
+    """
+    Indica si un módulo opcional está instalado (sin importarlo)
+    """
+    return modulo is None or importlib.util.find_spec(modulo) is not None
+
+
+def detectar_formato(ruta):
+    """
+    Detecta el formato del archivo de entrada: devuelve (formato, compresion)
+    formato: 'excel' | 'csv' | 'parquet' | 'sqlite'; compresion: None | 'gzip' | 'zstd'
+    La compresión se reconoce por extensión y, si no la tiene, por los bytes iniciales del archivo
+    """
+    nombre = os.path.basename(ruta).lower()
+    base, extension = os.path.splitext(nombre)
+    if extension in EXTENSIONES_HISTORIAL:
+        return 'sqlite', None
+    if extension in EXTENSIONES_PARQUET:
+        return 'parquet', None
+    compresion = EXTENSIONES_COMPRESION.get(extension)
+    if compresion:
+        base, extension = os.path.splitext(base)
+    elif os.path.exists(ruta):
+        with open(ruta, 'rb') as file:
+            cabecera = file.read(len(FIRMA_SQLITE))
+        if cabecera == FIRMA_SQLITE:
+            return 'sqlite', None
+        if cabecera.startswith(FIRMA_PARQUET):
+            return 'parquet', None
+        for firma, tipo in FIRMAS:
+            if cabecera.startswith(firma):
+                compresion = tipo
+
+    if extension in EXTENSIONES_EXCEL:
+        if compresion:
+            raise ErrorLector(f"Los archivos Excel comprimidos no están soportados: {ruta}")
+        return 'excel', None
+    if extension in ('.csv', '.txt') or compresion:
+        return 'csv', compresion
+    raise ErrorLector(f"No se reconoce el formato del archivo de entrada: {ruta}")
+
+
+def motores_disponibles(formato):
+    """
+    Motores instalados para un formato, en orden de preferencia
+    """
+    return [nombre for nombre, modulo in MOTORES[formato] if modulo_disponible(modulo)]
+
+
+def elegir_motor(formato, motor='auto'):
+    """
+    Elige el motor de lectura: el primero disponible con 'auto', o el indicado si está instalado
+    """
+    disponibles = motores_disponibles(formato)
+    if not disponibles:
+        modulos = [modulo for _, modulo in MOTORES[formato]]
+        raise ErrorLector(f"Ningún motor instalado para {formato}: instale uno de {modulos}")
+    if motor == 'auto':
+        return disponibles[0]
+    nombres = [nombre for nombre, _ in MOTORES[formato]]
+    if motor not in nombres:
+        raise ErrorLector(f"Motor '{motor}' no válido para {formato}. Use uno de: {nombres}")
+    if motor not in disponibles:
+        raise ErrorLector(f"Motor '{motor}' no instalado. Disponibles para {formato}: {disponibles}")
+    return motor
+
+
+def leer_entrada(ruta, motor_excel='auto', motor_csv='auto'):
+    """
+    Lee el archivo de entrada completo detectando formato, compresión y motor
+    Devuelve (DataFrame, descripción de la lectura)
+    """
+    formato, compresion = detectar_formato(ruta)
+    if formato == 'sqlite':
+        # Importación diferida: historial.py usa este módulo para leer los archivos que carga
+        from historial import leer_historial
+        return leer_historial(ruta)
+    if formato == 'excel':
+        motor = elegir_motor('excel', motor_excel)
+        return pd.read_excel(ruta, engine=motor), f"Excel ({motor})"
+    if formato == 'parquet':
+        motor = elegir_motor('parquet')
+        return pd.read_parquet(ruta, engine=motor), f"Parquet ({motor})"
+
+    motor = elegir_motor('csv', motor_csv)
+    if compresion and not modulo_disponible(MODULOS_COMPRESION[compresion]):
+        raise ErrorLector(f"Para leer archivos {compresion} instale el paquete '{MODULOS_COMPRESION[compresion]}'")
+    df = pd.read_csv(ruta, engine=motor, compression=compresion, dtype=COLUMNAS_TEXTO)
+    return df, f"CSV{f' {compresion}' if compresion else ''} ({motor})"
+
+
+def estimar_filas(ruta):
+    """
+    Número de registros del archivo sin leerlo completo: devuelve (filas, exacto) o (None, False)
+    Excel: dimensión declarada de la primera hoja (.xls con xlrd, sin estimación si no está instalado); CSV sin comprimir: tamaño / bytes por fila del inicio;
+    historial SQLite y Parquet: conteo exacto (metadatos). Los CSV comprimidos no se pueden estimar sin descomprimirlos
+    """
+    formato, compresion = detectar_formato(ruta)
+    if formato == 'sqlite':
+        from historial import contar_registros
+        return contar_registros(ruta), True
+    if formato == 'parquet':
+        if not modulo_disponible('pyarrow'):
+            return None, False
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(ruta).metadata.num_rows, True
+    if formato == 'excel' and ruta.lower().endswith('.xls'):
+        # Excel 97-2003: openpyxl no lo abre; xlrd lee la dimensión de la hoja sin cargar las celdas
+        if not modulo_disponible('xlrd'):
+            return None, False
+        import xlrd
+        libro = xlrd.open_workbook(ruta, on_demand=True)
+        try:
+            filas = libro.sheet_by_index(0).nrows
+        finally:
+            libro.release_resources()
+        return (filas - 1, False) if filas else (None, False)
+    if formato == 'excel':
+        from openpyxl import load_workbook
+        libro = load_workbook(ruta, read_only=True)
+        try:
+            filas = libro.worksheets[0].max_row
+        finally:
+            libro.close()
+        return (filas - 1, False) if filas else (None, False)
+    if compresion:
+        return None, False
+    with open(ruta, 'rb') as file:
+        inicio = file.read(1024 * 1024)
+    lineas = inicio.count(b'\n')
+    if lineas < 2:
+        return max(lineas - 1, 0), True
+    tamano = os.path.getsize(ruta)
+    if len(inicio) >= tamano:
+        return lineas - 1 + (0 if inicio.endswith(b'\n') else 1), True
+    return int(tamano / (len(inicio) / lineas)) - 1, False
+
+
+def leer_csv_por_bloques(ruta, filas_por_bloque):
+    """
+    Lee un CSV (comprimido o no) por bloques de filas, descomprimiendo como flujo
+    """
+    _, compresion = detectar_formato(ruta)
+    if compresion and not modulo_disponible(MODULOS_COMPRESION[compresion]):
+        raise ErrorLector(f"Para leer archivos {compresion} instale el paquete '{MODULOS_COMPRESION[compresion]}'")
+    return pd.read_csv(ruta, chunksize=filas_por_bloque, compression=compresion, dtype=COLUMNAS_TEXTO)
+
+
+def leer_parquet_por_bloques(ruta, filas_por_bloque):
+    """
+    Lee un archivo Parquet por bloques de filas (lotes de pyarrow convertidos a DataFrame)
+    """
+    elegir_motor('parquet')
+    import pyarrow.parquet as pq
+    archivo = pq.ParquetFile(ruta)
+    try:
+        for lote in archivo.iter_batches(batch_size=filas_por_bloque):
+            yield lote.to_pandas()
+    finally:
+        archivo.close()
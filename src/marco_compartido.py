@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+DataFrame en un archivo columnar mapeado en memoria, compartido entre procesos
+Cada columna se guarda una sola vez como un buffer contiguo alineado; los procesos que la usan mapean el archivo
+(np.memmap en modo copia en escritura) y construyen el DataFrame sobre vistas de esos buffers sin deserializar
+ni copiar: las páginas las comparte el sistema operativo entre todos los procesos que mapean el mismo archivo,
+y un proceso que modifica una columna solo copia las páginas que escribe (el archivo nunca se modifica).
+    numéricas, booleanas y fechas  vistas directas del buffer (sin copia)
+    texto (str u object)           códigos int32 compartidos + valores distintos; cada proceso reconstruye
+                                   la columna con un take (8 bytes por fila, sin deserializar cadenas)
+    otros tipos                    se guardan con pickle en los metadatos y se copian en cada proceso
+Formato: firma (8 bytes) + longitud de los metadatos (8 bytes) + metadatos (pickle) + buffers alineados a 64 bytes
+"""
+
+import os
+import pickle
+import struct
+
+import numpy as np
+import pandas as pd
+
+FIRMA = b'MARCOCOL'
+VERSION = 1
+ALINEACION = 64
+
+
+class ErrorMarco(ValueError):
+    """Archivo que no es un marco compartido o de una versión incompatible"""
+
+
+def _tipo_columna(serie):
+    if isinstance(serie.dtype, np.dtype) and serie.dtype != object:
+        return 'buffer'
+    if serie.dtype == object or pd.api.types.is_string_dtype(serie.dtype):
+        return 'texto'
+    return 'objeto'
+
+
+def _describir(serie):
+    """
+    Metadatos y buffer (o None) de una columna o del índice
+    """
+    tipo = _tipo_columna(serie)
+    descripcion = {'nombre': serie.name, 'tipo': tipo, 'dtype': str(serie.dtype)}
+    if tipo == 'buffer':
+        return descripcion, np.ascontiguousarray(serie.to_numpy())
+    if tipo == 'texto':
+        codigos, valores = pd.factorize(serie)
+        descripcion['valores'] = np.asarray(valores, dtype=object)
+        return descripcion, codigos.astype(np.int32)
+    descripcion['datos'] = serie.array
+    return descripcion, None
+
+
+def guardar_marco(df, ruta, extra=None):
+    """
+    Escribe el DataFrame (con su índice) y un estado adicional pequeño (extra) de forma atómica
+    Devuelve el tamaño en bytes
+    """
+    columnas = []
+    buffers = []
+    for nombre in df.columns:
+        descripcion, buffer = _describir(df[nombre])
+        columnas.append(descripcion)
+        buffers.append(buffer)
+    indice, buffer_indice = _describir(pd.Series(df.index, name=df.index.name, copy=False))
+    buffers.append(buffer_indice)
+
+    # Desplazamientos relativos al inicio de la zona de buffers
+    desplazamiento = 0
+    for descripcion, buffer in zip(columnas + [indice], buffers):
+        if buffer is not None:
+            descripcion['desplazamiento'] = desplazamiento
+            descripcion['dtype_buffer'] = buffer.dtype.str
+            desplazamiento += -(-buffer.nbytes // ALINEACION) * ALINEACION
+    metadatos = pickle.dumps({'version': VERSION, 'filas': len(df), 'columnas': columnas, 'indice': indice,
+                              'extra': extra}, protocol=pickle.HIGHEST_PROTOCOL)
+    inicio_buffers = -(-(len(FIRMA) + 8 + len(metadatos)) // ALINEACION) * ALINEACION
+
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with open(temporal, 'wb') as file:
+            file.write(FIRMA)
+            file.write(struct.pack('<Q', len(metadatos)))
+            file.write(metadatos)
+            for descripcion, buffer in zip(columnas + [indice], buffers):
+                if buffer is not None:
+                    file.seek(inicio_buffers + descripcion['desplazamiento'])
+                    file.write(buffer.view(np.uint8).data)
+            file.truncate(inicio_buffers + desplazamiento)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return os.path.getsize(ruta)
+
+
+def _reconstruir(descripcion, mapa, inicio_buffers, filas):
+    if descripcion['tipo'] == 'objeto':
+        return descripcion['datos']
+    inicio = inicio_buffers + descripcion['desplazamiento']
+    dtype = np.dtype(descripcion['dtype_buffer'])
+    buffer = mapa[inicio:inicio + filas * dtype.itemsize].view(dtype)
+    if descripcion['tipo'] == 'buffer':
+        return buffer
+    # Texto: el código -1 (nulo) toma el último elemento, que es NaN
+    valores = np.append(descripcion['valores'], np.nan)
+    return pd.array(valores.take(buffer), dtype=descripcion['dtype'])
+
+
+def adjuntar_marco(ruta):
+    """
+    Mapea un marco guardado con guardar_marco: devuelve (DataFrame, extra)
+    Las columnas numéricas y de fechas son vistas del archivo compartidas con los demás procesos
+    """
+    with open(ruta, 'rb') as file:
+        if file.read(len(FIRMA)) != FIRMA:
+            raise ErrorMarco(f"{ruta} no es un marco compartido")
+        longitud = struct.unpack('<Q', file.read(8))[0]
+        metadatos = pickle.loads(file.read(longitud))
+    if metadatos.get('version') != VERSION:
+        raise ErrorMarco(f"{ruta}: versión {metadatos.get('version')} no soportada")
+    inicio_buffers = -(-(len(FIRMA) + 8 + longitud) // ALINEACION) * ALINEACION
+    filas = metadatos['filas']
+    # Vista ndarray del mapa (las columnas no heredan la subclase memmap); el mapa vive mientras haya vistas
+    mapa = np.asarray(np.memmap(ruta, dtype=np.uint8, mode='c')) if os.path.getsize(ruta) > inicio_buffers else np.empty(0, np.uint8)
+
+    datos = {descripcion['nombre']: _reconstruir(descripcion, mapa, inicio_buffers, filas)
+             for descripcion in metadatos['columnas']}
+    indice = pd.Index(_reconstruir(metadatos['indice'], mapa, inicio_buffers, filas), name=metadatos['indice']['nombre'],
+                      copy=False)
+    df = pd.DataFrame(datos, index=indice, columns=[d['nombre'] for d in metadatos['columnas']], copy=False)
+    return df, metadatos['extra']
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Muestreo determinista por paciente
+Cada paciente entra o no en la muestra según un hash de su Numero_Documento_Paciente, de modo que:
+    - la muestra conserva pacientes completos (todos sus registros, en cualquier bloque o archivo)
+    - la misma fracción y semilla seleccionan siempre los mismos pacientes
+    - una muestra con fracción menor es subconjunto de otra con fracción mayor y la misma semilla
+También escribe muestras de desarrollo de la entrada (por ejemplo 1% o 0.1% de los pacientes) en Parquet,
+ordenadas por paciente y fecha, con un archivo <muestra>.muestra.json que registra la fracción, la semilla y
+los totales del origen para escalar los conteos a la entrada completa.
+
+Uso:
+    python src/muestreo.py files/input.xlsx --fraccion 0.01 [--semilla 0] [--salida files/muestra_1pct.parquet]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from lectores import ErrorLector, detectar_formato, elegir_motor, modulo_disponible
+
+# Resolución de la fracción de muestreo (partes por millón)
+ESCALA_MUESTREO = 1_000_000
+SUFIJO_INFO = ".muestra.json"
+MASCARA_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def _mezclar_semilla(semilla):
+    """
+    Constante de 64 bits derivada de la semilla (splitmix64): semillas vecinas dan constantes sin relación
+    """
+    z = (int(semilla) + 0x9E3779B97F4A7C15) & MASCARA_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASCARA_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASCARA_64
+    return z ^ (z >> 31)
+
+
+def hash_pacientes(serie, semilla=0):
+    """
+    Hash uint64 estable del documento de cada paciente (el mismo documento leído como texto,
+    entero o decimal produce el mismo hash). Devuelve (hashes, máscara de documentos válidos)
+    pd.util.hash_array ignora hash_key con arrays numéricos: la semilla se mezcla en los enteros antes del hash
+    """
+    documentos = pd.to_numeric(serie, errors='coerce').to_numpy(dtype=np.float64)
+    validos = ~np.isnan(documentos)
+    enteros = np.where(validos, documentos, 0).astype(np.int64).view(np.uint64)
+    return pd.util.hash_array(enteros ^ np.uint64(_mezclar_semilla(semilla)), categorize=False), validos
+
+
+def mascara_muestra(serie, fraccion, semilla=0):
+    """
+    Máscara por fila de los registros cuyos pacientes pertenecen a la muestra
+    """
+    if fraccion >= 1:
+        return pd.to_numeric(serie, errors='coerce').notna().to_numpy()
+    hashes, validos = hash_pacientes(serie, semilla)
+    return validos & (hashes % np.uint64(ESCALA_MUESTREO) < np.uint64(int(round(fraccion * ESCALA_MUESTREO))))
+
+
+def ruta_info(ruta_muestra):
+    return f"{ruta_muestra}{SUFIJO_INFO}"
+
+
+def leer_info_muestra(ruta):
+    """
+    Datos de muestreo de un archivo escrito por escribir_muestra, o None si el archivo no es una muestra
+    """
+    try:
+        with open(ruta_info(ruta), 'r', encoding='utf-8') as file:
+            info = json.load(file)
+    except (OSError, ValueError):
+        return None
+    return info if isinstance(info, dict) and 'fraccion' in info else None
+
+
+def _columnas_uniformes(df):
+    """
+    Parquet exige un tipo por columna: las columnas object que mezclan números y textos (Valor_Lab) se
+    guardan como texto, conservando los nulos
+    """
+    for columna in df.columns:
+        if df[columna].dtype == object:
+            tipos = df[columna].dropna().map(type).unique()
+            if len(tipos) > 1:
+                df[columna] = df[columna].where(df[columna].isna(), df[columna].astype(str))
+    return df
+
+
+def escribir_muestra(archivo_entrada, salida, fraccion, semilla=0, filas_por_bloque=200000):
+    """
+    Lee la entrada por bloques, conserva los registros de los pacientes de la muestra y los escribe ordenados
+    por paciente y fecha (Parquet o CSV según la extensión de salida) junto con su archivo de información
+    Devuelve la información de la muestra
+    """
+    # Importación diferida: data_processor importa este módulo
+    from data_processor import leer_entrada_por_bloques
+
+    formato, _ = detectar_formato(salida)
+    if formato == 'parquet':
+        elegir_motor('parquet')
+    elif formato != 'csv':
+        raise ValueError(f"formato de salida no soportado para muestras: {salida} (use .parquet o .csv/.csv.gz/.csv.zst)")
+
+    registros_origen = 0
+    documentos_origen = []
+    partes = []
+    for bloque in leer_entrada_por_bloques(archivo_entrada, filas_por_bloque):
+        registros_origen += len(bloque)
+        documentos = pd.to_numeric(bloque['Numero_Documento_Paciente'], errors='coerce').dropna().to_numpy(dtype=np.float64)
+        documentos_origen.append(np.unique(documentos))
+        partes.append(bloque[mascara_muestra(bloque['Numero_Documento_Paciente'], fraccion, semilla)])
+    df = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame()
+    pacientes_origen = len(np.unique(np.concatenate(documentos_origen))) if documentos_origen else 0
+
+    # Orden por paciente y fecha: la muestra sirve como entrada ordenada (entrada_ordenada: true)
+    if len(df):
+        documentos = pd.to_numeric(df['Numero_Documento_Paciente'], errors='coerce')
+        df = df.assign(_documento=documentos).sort_values(['_documento', 'Fecha_Atencion'], kind='stable')
+        df = df.drop(columns='_documento').reset_index(drop=True)
+    pacientes = int(pd.to_numeric(df['Numero_Documento_Paciente'], errors='coerce').nunique()) if len(df) else 0
+
+    if os.path.dirname(salida):
+        os.makedirs(os.path.dirname(salida), exist_ok=True)
+    if formato == 'parquet':
+        _columnas_uniformes(df).to_parquet(salida, index=False)
+    else:
+        df.to_csv(salida, index=False, encoding='utf-8')
+
+    info = {
+        'origen': os.path.abspath(archivo_entrada),
+        'fraccion': fraccion,
+        'semilla': semilla,
+        'registros_origen': registros_origen,
+        'pacientes_origen': pacientes_origen,
+        'registros': len(df),
+        'pacientes': pacientes,
+        # Factor para escalar conteos de pacientes a la entrada completa (la fracción real de pacientes)
+        'factor_expansion': round(pacientes_origen / pacientes, 6) if pacientes else None,
+        'creado': datetime.now().isoformat(timespec='seconds'),
+    }
+    with open(ruta_info(salida), 'w', encoding='utf-8') as file:
+        json.dump(info, file, ensure_ascii=False, indent=2)
+    return info
+
+
+def escalar(info, cantidad):
+    """
+    Cantidad medida en la muestra escalada a la entrada completa
+    """
+    factor = info.get('factor_expansion') or 1 / info['fraccion']
+    return int(round(cantidad * factor))
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Muestra determinista de pacientes completos para desarrollo")
+    parser.add_argument('entrada', help="Archivo de entrada (xlsx, csv, csv.gz, csv.zst, parquet o historial SQLite)")
+    parser.add_argument('--fraccion', type=float, default=0.01, help="Fracción de pacientes (por defecto 0.01)")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla del hash de pacientes")
+    parser.add_argument('--salida', help="Archivo de la muestra (.parquet, .csv, .csv.gz o .csv.zst)")
+    parser.add_argument('--filas-por-bloque', type=int, default=200000, help="Filas leídas por bloque")
+    argumentos = parser.parse_args(argumentos)
+
+    if not 0 < argumentos.fraccion <= 1:
+        print(f"❌ Error: --fraccion debe estar entre 0 y 1")
+        return 1
+    if not os.path.exists(argumentos.entrada):
+        print(f"❌ Error: El archivo {argumentos.entrada} no existe")
+        return 1
+    salida = argumentos.salida
+    if salida is None:
+        base = os.path.basename(argumentos.entrada).split('.')[0]
+        extension = "parquet" if modulo_disponible('pyarrow') else "csv.gz"
+        if extension != "parquet":
+            print(f"⚠️  pyarrow no está instalado: la muestra se escribe como CSV comprimido")
+        salida = os.path.join(os.path.dirname(argumentos.entrada), f"{base}_muestra_{argumentos.fraccion:g}.{extension}")
+
+    print(f"🎲 Muestra de {argumentos.fraccion:.2%} de los pacientes de {argumentos.entrada} (semilla {argumentos.semilla})")
+    inicio = time.perf_counter()
+    try:
+        info = escribir_muestra(argumentos.entrada, salida, argumentos.fraccion, argumentos.semilla,
+                                argumentos.filas_por_bloque)
+    except (ErrorLector, ValueError) as e:
+        print(f"❌ Error: {e}")
+        return 1
+    print(f"✅ {info['registros']:,} de {info['registros_origen']:,} registros, "
+          f"{info['pacientes']:,} de {info['pacientes_origen']:,} pacientes en {time.perf_counter() - inicio:.2f} s")
+    print(f"✅ Muestra: {salida} ({os.path.getsize(salida):,} bytes)")
+    print(f"✅ Información de muestreo: {ruta_info(salida)} (factor de expansión {info['factor_expansion']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
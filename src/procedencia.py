@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Banderas de procedencia por registro
+Cada registro lleva un entero pequeño (campo de bits) con los requisitos que cumplió durante el procesamiento:
+reglas de calidad, código y Valor_Lab del filtro, códigos requeridos completos en la visita y en el paciente,
+y factor de riesgo. Las banderas se registran con las mismas máscaras del procesamiento, en el momento en que se
+calculan: las de calidad en cada regla de calidad (evaluada también en los registros que descartó una regla
+anterior) y las demás en las comprobaciones del filtro activo. Un registro descartado antes de una comprobación
+no la cumple; un requisito que el filtro activo no comprueba queda cumplido. Solo se traducen a texto al mostrarlas.
+
+Uso:
+    python src/procedencia.py files/procedencia_excluidos.csv --paciente 12345678
+    python src/procedencia.py files/resultado.csv
+"""
+
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# (nombre, descripción); el bit i vale 1 << i
+BANDERAS = (
+    ('DOCUMENTO_VALIDO', "Numero_Documento_Paciente no nulo y numérico"),
+    ('EDAD_VALIDA', "Edad_Reg dentro del rango de validaciones"),
+    ('GENERO_VALIDO', "Genero dentro de generos_validos"),
+    ('FECHA_VALIDA', "Fecha_Atencion con fecha válida"),
+    ('CODIGO_FILTRO', "Codigo_Item es uno de los códigos del filtro (o el filtro no exige códigos)"),
+    ('VALOR_LAB', "Valor_Lab coincide con el valor configurado (o el filtro no exige Valor_Lab)"),
+    ('REQUERIDOS_VISITA', "la visita (paciente + fecha) tiene los códigos requeridos (o el filtro no lo comprueba)"),
+    ('REQUERIDOS_PACIENTE', "el historial del paciente tiene los códigos requeridos (o el filtro no lo comprueba)"),
+    ('FACTOR_RIESGO', "hay algún factor de riesgo en la visita o el paciente (o el filtro no usa factores)"),
+)
+BIT = {nombre: np.uint16(1 << posicion) for posicion, (nombre, _) in enumerate(BANDERAS)}
+CALIDAD = np.uint16(BIT['DOCUMENTO_VALIDO'] | BIT['EDAD_VALIDA'] | BIT['GENERO_VALIDO'] | BIT['FECHA_VALIDA'])
+TODAS = np.uint16((1 << len(BANDERAS)) - 1)
+COLUMNA = 'Procedencia'
+
+
+def iniciar(indice, fallan):
+    """
+    Banderas de los registros que llegan a las reglas de calidad (índice de df_selected): todas encendidas salvo
+    las de calidad que cada registro no cumple, fallan = {bandera: [etiquetas de los registros que no la cumplen]}
+    Devuelve el estado que completan las comprobaciones del filtro con registrar()
+    """
+    bits = np.full(len(indice), TODAS, dtype=np.uint16)
+    for nombre, etiquetas in fallan.items():
+        for parte in etiquetas:
+            bits[indice.get_indexer(parte)] &= ~BIT[nombre]
+    return {'indice': indice, 'bits': bits}
+
+
+def registrar(banderas, nombre, filas):
+    """
+    Registra una comprobación del filtro: la bandera queda encendida solo en los registros que la cumplieron
+    (etiquetas de filas); los que no llegaron a la comprobación tampoco la cumplen. Sin banderas no hace nada
+    """
+    if banderas is None:
+        return
+    banderas['bits'] &= ~BIT[nombre]
+    banderas['bits'][banderas['indice'].get_indexer(filas)] |= BIT[nombre]
+
+
+def serie(banderas):
+    """
+    Columna de procedencia (uint16) con el índice de los registros que llegaron a las reglas de calidad
+    """
+    return pd.Series(banderas['bits'], index=banderas['indice'], name=COLUMNA)
+
+
+def decodificar(valor):
+    """
+    Nombres de las banderas activas de un valor
+    """
+    valor = int(valor)
+    return [nombre for nombre, _ in BANDERAS if valor & int(BIT[nombre])]
+
+
+def faltantes(valor):
+    """
+    Nombres de las banderas no cumplidas de un valor
+    """
+    valor = int(valor)
+    return [nombre for nombre, _ in BANDERAS if not valor & int(BIT[nombre])]
+
+
+def columna_decodificada(serie, solo_faltantes=False):
+    """
+    Traduce una columna de procedencia a texto, decodificando cada valor distinto una sola vez
+    """
+    traductor = faltantes if solo_faltantes else decodificar
+    textos = {valor: ", ".join(traductor(valor)) or "-" for valor in pd.unique(serie.dropna())}
+    return serie.map(textos)
+
+
+def resumen(serie):
+    """
+    Registros que cumplen cada bandera
+    """
+    valores = serie.dropna().astype(np.int64).to_numpy()
+    return pd.DataFrame([{'bandera': nombre, 'descripcion': descripcion,
+                          'registros': int(((valores & int(BIT[nombre])) != 0).sum())}
+                         for nombre, descripcion in BANDERAS])
+
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Decodifica la columna Procedencia de un resultado o del archivo de excluidos")
+    parser.add_argument('archivo', help="CSV con la columna Procedencia")
+    parser.add_argument('--paciente', type=int, help="Mostrar solo los registros de este Numero_Documento_Paciente")
+    argumentos = parser.parse_args(argumentos)
+
+    df = pd.read_csv(argumentos.archivo)
+    if COLUMNA not in df.columns:
+        print(f"❌ Error: {argumentos.archivo} no tiene la columna {COLUMNA}")
+        return 1
+    if argumentos.paciente is not None:
+        df = df[pd.to_numeric(df['Numero_Documento_Paciente'], errors='coerce') == argumentos.paciente]
+        print(f"👤 Paciente {argumentos.paciente}: {len(df):,} registros")
+        if len(df) == 0:
+            return 0
+        columnas = [c for c in ('Fecha_Atencion', 'Codigo_Item', 'Valor_Lab') if c in df.columns]
+        detalle = df[columnas].copy()
+        detalle['cumple'] = columna_decodificada(df[COLUMNA])
+        detalle['no_cumple'] = columna_decodificada(df[COLUMNA], solo_faltantes=True)
+        with pd.option_context('display.max_colwidth', None, 'display.width', 200):
+            print(detalle.to_string(index=False))
+    else:
+        print(f"📊 {argumentos.archivo}: {len(df):,} registros")
+        print(resumen(df[COLUMNA]).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Puntos de control del procesamiento en memoria
+Después de las etapas costosas (lectura, limpieza y filtrado) se guarda el estado en formato binario (pickle),
+con la clave del hash de la entrada y de la configuración. Si una ejecución falla más adelante (disco lleno al
+guardar el CSV, una excepción en un filtro), la siguiente continúa desde el último punto válido en lugar de
+volver a leer el archivo de entrada.
+    lectura   solo depende de la entrada (y de los predicados enviados al historial SQLite)
+    limpieza  depende de la entrada y de la configuración efectiva
+    filtrado  depende de la entrada y de la configuración efectiva
+"""
+
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+from cache_resultados import hash_archivo, hash_configuracion
+
+ETAPAS = ('lectura', 'limpieza', 'filtrado')
+
+
+def claves_puntos(archivo_entrada, config, directorio, dependencias_lectura=None):
+    """
+    Clave de cada etapa: {etapa: hash}
+    """
+    hash_entrada = hash_archivo(archivo_entrada, directorio)
+    lectura = json.dumps(dependencias_lectura or {}, sort_keys=True, default=str)
+    clave_lectura = hashlib.sha256(f"{hash_entrada}:lectura:{lectura}".encode('utf-8')).hexdigest()
+    clave_config = hashlib.sha256(f"{hash_entrada}:{hash_configuracion(config)}".encode('utf-8')).hexdigest()
+    return {'lectura': clave_lectura, 'limpieza': clave_config, 'filtrado': clave_config}
+
+
+def ruta_punto(directorio, clave, etapa):
+    return os.path.join(directorio, f"{clave}_{etapa}.pkl")
+
+
+def guardar_punto(directorio, claves, etapa, estado):
+    """
+    Guarda el estado de una etapa de forma atómica (archivo temporal + os.replace): un punto a medio
+    escribir nunca queda con el nombre definitivo. Devuelve el tamaño en bytes
+    """
+    os.makedirs(directorio, exist_ok=True)
+    ruta = ruta_punto(directorio, claves[etapa], etapa)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        pd.to_pickle({'clave': claves[etapa], 'etapa': etapa, 'estado': estado}, temporal, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    return os.path.getsize(ruta)
+
+
+def cargar_punto(directorio, claves, etapa):
+    """
+    Estado guardado de una etapa, o None si no existe o no es válido
+    """
+    ruta = ruta_punto(directorio, claves[etapa], etapa)
+    if not os.path.exists(ruta):
+        return None
+    try:
+        contenido = pd.read_pickle(ruta)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError):
+        return None
+    if not isinstance(contenido, dict) or contenido.get('clave') != claves[etapa] or contenido.get('etapa') != etapa:
+        return None
+    return contenido['estado']
+
+
+def ultimo_punto(directorio, claves):
+    """
+    Última etapa con un punto de control válido: (etapa, estado) o (None, None)
+    """
+    for etapa in reversed(ETAPAS):
+        estado = cargar_punto(directorio, claves, etapa)
+        if estado is not None:
+            return etapa, estado
+    return None, None
+
+
+def borrar_puntos(directorio, claves):
+    """
+    Elimina los puntos de control de una ejecución terminada. Devuelve cuántos archivos se eliminaron
+    """
+    eliminados = 0
+    for etapa in ETAPAS:
+        ruta = ruta_punto(directorio, claves[etapa], etapa)
+        if os.path.exists(ruta):
+            os.remove(ruta)
+            eliminados += 1
+    return eliminados
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Transiciones de clasificación entre periodos
+Cada registro se asigna a su ventana de fechas (búsqueda binaria sobre los inicios de las ventanas) y el
+estado de cada paciente en cada ventana se obtiene en una sola pasada agrupada sobre la matriz
+pacientes x ventanas (np.maximum.at), con el orden SIN_DATOS < NORMAL < ANORMAL:
+un paciente es ANORMAL en la ventana si algún registro suyo lo es, NORMAL si tiene registros
+clasificados y ninguno es ANORMAL, y SIN_DATOS si no tiene registros en la ventana.
+"""
+
+import numpy as np
+import pandas as pd
+
+ESTADOS = ('SIN_DATOS', 'NORMAL', 'ANORMAL')
+
+
+class ErrorVentanas(ValueError):
+    """Ventanas de fechas mal definidas en la configuración"""
+
+
+def validar_ventanas(ventanas):
+    """
+    Convierte la lista de rangos [[inicio, fin], ...] en pares de Timestamp
+    Las ventanas deben estar en orden cronológico y no solaparse (cada registro pertenece a una sola)
+    """
+    if not isinstance(ventanas, list) or len(ventanas) < 2:
+        raise ErrorVentanas("se necesitan al menos dos ventanas [inicio, fin]")
+    resultado = []
+    for ventana in ventanas:
+        if not isinstance(ventana, (list, tuple)) or len(ventana) != 2:
+            raise ErrorVentanas(f"la ventana {ventana} debe ser [inicio, fin]")
+        try:
+            inicio, fin = pd.to_datetime(ventana[0]), pd.to_datetime(ventana[1])
+        except (ValueError, TypeError) as e:
+            raise ErrorVentanas(f"fecha inválida en la ventana {ventana}: {e}")
+        if fin < inicio:
+            raise ErrorVentanas(f"la ventana {ventana} termina antes de empezar")
+        if resultado and inicio <= resultado[-1][1]:
+            raise ErrorVentanas(f"la ventana {ventana} se solapa o no sigue a la anterior")
+        resultado.append((inicio, fin))
+    return resultado
+
+
+def nombre_ventana(ventana):
+    inicio, fin = ventana
+    return f"{inicio.date()}_{fin.date()}"
+
+
+def ventana_de(fechas, ventanas):
+    """
+    Índice de la ventana de cada fecha (-1 si la fecha no cae en ninguna ventana)
+    """
+    fechas = pd.to_datetime(pd.Series(fechas), errors='coerce').to_numpy(dtype='datetime64[ns]')
+    inicios = np.array([inicio.to_datetime64() for inicio, _ in ventanas], dtype='datetime64[ns]')
+    fines = np.array([fin.to_datetime64() for _, fin in ventanas], dtype='datetime64[ns]')
+    indice = np.searchsorted(inicios, fechas, side='right') - 1
+    dentro = (indice >= 0) & ~np.isnat(fechas)
+    dentro[dentro] = fechas[dentro] <= fines[indice[dentro]]
+    return np.where(dentro, indice, -1)
+
+
+def estados_por_ventana(df, columna_clasificacion, ventanas):
+    """
+    Estado de cada paciente en cada ventana: DataFrame con Numero_Documento_Paciente y una columna
+    estado_<inicio>_<fin> por ventana. Solo incluye pacientes con algún registro clasificado en las ventanas
+    """
+    indice = ventana_de(df['Fecha_Atencion'], ventanas)
+    clasificacion = df[columna_clasificacion].to_numpy()
+    codigo = np.select([clasificacion == 'ANORMAL', clasificacion == 'NORMAL'], [2, 1], default=0)
+    validas = (indice >= 0) & (codigo > 0) & df['Numero_Documento_Paciente'].notna().to_numpy()
+
+    ids, pacientes = pd.factorize(df['Numero_Documento_Paciente'][validas], sort=True)
+    matriz = np.zeros((len(pacientes), len(ventanas)), dtype=np.int8)
+    np.maximum.at(matriz, (ids, indice[validas]), codigo[validas].astype(np.int8))
+
+    estados = np.asarray(ESTADOS, dtype=object)[matriz]
+    resultado = pd.DataFrame(estados, columns=[f"estado_{nombre_ventana(ventana)}" for ventana in ventanas])
+    resultado.insert(0, 'Numero_Documento_Paciente', pacientes)
+    return resultado
+
+
+def conteos_transiciones(estados):
+    """
+    Pacientes por transición entre cada par de ventanas consecutivas (todas las combinaciones de estados,
+    incluidas las de cero pacientes): columnas desde, hasta, estado_desde, estado_hasta, pacientes
+    """
+    columnas = [columna for columna in estados.columns if columna.startswith('estado_')]
+    filas = []
+    for desde, hasta in zip(columnas, columnas[1:]):
+        tabla = pd.crosstab(estados[desde], estados[hasta]) if len(estados) else pd.DataFrame()
+        tabla = tabla.reindex(index=ESTADOS, columns=ESTADOS, fill_value=0)
+        for estado_desde in ESTADOS:
+            for estado_hasta in ESTADOS:
+                filas.append({
+                    'desde': desde[len('estado_'):],
+                    'hasta': hasta[len('estado_'):],
+                    'estado_desde': estado_desde,
+                    'estado_hasta': estado_hasta,
+                    'pacientes': int(tabla.loc[estado_desde, estado_hasta]),
+                })
+    return pd.DataFrame(filas)